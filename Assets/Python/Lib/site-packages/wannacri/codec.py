@@ -1,7 +1,11 @@
 from __future__ import annotations
 
 from enum import Enum, auto
-import ffmpeg
+from typing import Optional
+
+from .usm.media.ivf import IVF_SIGNATURE, VP9_FOURCC
+from .usm.media.annexb import START_CODE, NAL_AUD, NAL_SEI, NAL_SPS
+from .usm.media.probe import ProbeCache, probe
 
 
 class Sofdec2Codec(Enum):
@@ -10,8 +14,24 @@ class Sofdec2Codec(Enum):
     VP9 = auto()
 
     @staticmethod
-    def from_file(path: str, ffprobe_path: str = "ffprobe") -> Sofdec2Codec:
-        info = ffmpeg.probe(path, cmd=ffprobe_path)
+    def from_file(
+        path: str, ffprobe_path: str = "ffprobe", probe_cache: Optional[ProbeCache] = None
+    ) -> Sofdec2Codec:
+        # VP9 ivf files and raw H.264 streams are recognised from their
+        # first bytes without running ffprobe
+        with open(path, "rb") as f:
+            header = f.read(0xC)
+        if header[:4] == IVF_SIGNATURE and header[8:12] == VP9_FOURCC:
+            return Sofdec2Codec.VP9
+
+        start = header.find(START_CODE)
+        if start in (0, 1) and header[:start] == bytes(start) and len(header) > start + 3:
+            nal_header = header[start + 3]
+            # forbidden_zero_bit rules out MPEG-2 start codes
+            if nal_header & 0x80 == 0 and nal_header & 0x1F in (NAL_AUD, NAL_SEI, NAL_SPS):
+                return Sofdec2Codec.H264
+
+        info = probe(path, cmd=ffprobe_path, cache=probe_cache)
 
         if len(info.get("streams")) == 0:
             raise ValueError("File has no video streams.")
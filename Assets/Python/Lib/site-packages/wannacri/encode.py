@@ -0,0 +1,210 @@
+"""Encodes videos to VP9 ivf files for USMs with FFmpeg. The source is split
+at its keyframes into segments that are encoded in parallel, one FFmpeg
+process each, and stitched back into a single ivf."""
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+import ffmpeg
+
+from .usm.media.ivf import concat_ivf
+from .usm.media.probe import ProbeCache, parse_rate, probe
+
+
+class KeyframeInfo(NamedTuple):
+    # Times in seconds of every keyframe of the first video stream
+    keyframes: List[float]
+    duration: float
+    framerate: float
+
+
+class Segment(NamedTuple):
+    start: float
+    # None for the last segment, which runs to the end of the source
+    end: Optional[float]
+
+
+def probe_keyframes(
+    path: str,
+    ffprobe_path: Optional[str] = None,
+    probe_cache: Optional[ProbeCache] = None,
+) -> KeyframeInfo:
+    """Finds the keyframes of a video file with ffprobe, decoding only the
+    keyframes. Encoders place keyframes at scene cuts, so they are also
+    where splitting the video costs the least quality."""
+    info = probe(
+        path,
+        cmd=ffprobe_path,
+        cache=probe_cache,
+        select_streams="v:0",
+        skip_frame="nokey",
+        show_entries="frame=pts_time,best_effort_timestamp_time",
+    )
+
+    if len(info.get("streams", [])) == 0:
+        raise ValueError("File has no video streams.")
+
+    video_stream = info.get("streams")[0]
+    framerate = parse_rate(video_stream.get("avg_frame_rate"))
+    if framerate is None:
+        framerate = parse_rate(video_stream.get("r_frame_rate"))
+    if framerate is None:
+        raise ValueError("Video stream has no frame rate.")
+
+    duration = info.get("format", {}).get("duration", video_stream.get("duration"))
+    if duration is None:
+        raise ValueError("File has no duration.")
+
+    keyframes = []
+    for frame in info.get("frames", []):
+        time = frame.get("best_effort_timestamp_time", frame.get("pts_time"))
+        if time is not None and time != "N/A":
+            keyframes.append(float(time))
+
+    keyframes.sort()
+    return KeyframeInfo(keyframes, float(duration), framerate)
+
+
+def split_segments(
+    keyframes: Sequence[float], duration: float, num_segments: int
+) -> List[Segment]:
+    """Splits a video into at most num_segments segments of about the same
+    duration, cut at the keyframes closest to even splits. Keyframes must
+    be sorted."""
+    cuts = [0.0]
+    for i in range(1, num_segments):
+        target = duration * i / num_segments
+        index = bisect.bisect_left(keyframes, target)
+        candidates = keyframes[max(index - 1, 0) : index + 1]
+        if len(candidates) == 0:
+            break
+
+        cut = min(candidates, key=lambda keyframe: abs(keyframe - target))
+        if cuts[-1] < cut < duration:
+            cuts.append(cut)
+
+    return [Segment(start, end) for start, end in zip(cuts, [*cuts[1:], None])]
+
+
+def encode_segment(
+    path: str,
+    output: str,
+    segment: Segment,
+    framerate: float,
+    crf: int = 20,
+    bitrate: Optional[int] = None,
+    speed: int = 4,
+    threads: int = 1,
+    video_filter: Optional[str] = None,
+    ffmpeg_path: Optional[str] = None,
+) -> None:
+    """Encodes the frames of a segment of a video to a VP9 ivf.
+
+    Reading starts and stops half a frame before the segment's start and end,
+    so exactly the frames from its start keyframe up to the next segment's
+    are encoded whatever the rounding of timestamps."""
+    margin = 0.5 / framerate
+    seek = max(segment.start - margin, 0)
+    input_args = {"ss": seek}
+    if segment.end is not None:
+        input_args["t"] = segment.end - margin - seek
+
+    output_args = {
+        "an": None,
+        "vcodec": "libvpx-vp9",
+        "crf": crf,
+        # 0 asks libvpx for constant quality
+        "b:v": 0 if bitrate is None else bitrate,
+        "speed": speed,
+        "threads": threads,
+        "pix_fmt": "yuv420p",
+        "f": "ivf",
+    }
+    if video_filter is not None:
+        output_args["vf"] = video_filter
+
+    stream = ffmpeg.input(path, **input_args).output(output, **output_args)
+    try:
+        stream.overwrite_output().run(
+            cmd="ffmpeg" if ffmpeg_path is None else ffmpeg_path,
+            capture_stdout=True,
+            capture_stderr=True,
+        )
+    except ffmpeg.Error as e:
+        lines = e.stderr.decode("UTF-8", errors="replace").strip().splitlines()
+        raise ValueError(
+            f"FFmpeg failed to encode segment at {segment.start}s: "
+            + (lines[-1] if len(lines) > 0 else "no output")
+        ) from e
+
+
+def encode_vp9(
+    path: str,
+    output: str,
+    workers: Optional[int] = None,
+    num_segments: Optional[int] = None,
+    crf: int = 20,
+    bitrate: Optional[int] = None,
+    speed: int = 4,
+    video_filter: Optional[str] = None,
+    ffmpeg_path: Optional[str] = None,
+    ffprobe_path: Optional[str] = None,
+    probe_cache: Optional[ProbeCache] = None,
+) -> int:
+    """Encodes a video to a VP9 ivf at output. The video is split at keyframes
+    into num_segments segments, one per worker by default, which are encoded
+    by at most workers FFmpeg processes at once and then stitched together.
+    Workers default to the number of cores, which are shared between them.
+
+    Returns the number of frames."""
+    cores = os.cpu_count() or 1
+    workers = cores if workers is None else max(workers, 1)
+    info = probe_keyframes(path, ffprobe_path, probe_cache)
+    segments = split_segments(
+        info.keyframes, info.duration, workers if num_segments is None else num_segments
+    )
+    threads = max(1, cores // min(workers, len(segments)))
+    logging.info(
+        "Encoding VP9",
+        extra={
+            "path": path,
+            "num_segments": len(segments),
+            "workers": workers,
+            "threads": threads,
+        },
+    )
+
+    with tempfile.TemporaryDirectory() as folder:
+        segment_paths = [
+            os.path.join(folder, f"{i}.ivf") for i in range(len(segments))
+        ]
+
+        def encode(i: int) -> None:
+            encode_segment(
+                path,
+                segment_paths[i],
+                segments[i],
+                info.framerate,
+                crf=crf,
+                bitrate=bitrate,
+                speed=speed,
+                threads=threads,
+                video_filter=video_filter,
+                ffmpeg_path=ffmpeg_path,
+            )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Raises the first error of any segment
+            list(executor.map(encode, range(len(segments))))
+
+        with open(output, "wb") as ivf:
+            num_frames = concat_ivf(
+                segment_paths, ivf, [segment.start for segment in segments]
+            )
+
+    return num_frames
@@ -9,10 +9,25 @@ from .tools import (
     get_video_header_end_offset,
     is_usm,
 )
-from .page import UsmPage, get_pages, pack_pages
-from .usm import Usm
+from .page import UsmPage, get_pages, pack_pages, packed_pages_size
+from .usm import Usm, UsmClip, crypt_usm_in_place, rekey_usm_in_place
+from .tables import PacketTable, SeekTable
+from .parser import ChunkEvent, ChunkParser, demux_stream
+from .info import UsmInfo, VideoInfo, AudioInfo
 from .chunk import UsmChunk
-from .media import UsmMedia, UsmVideo, UsmAudio, GenericVideo, GenericAudio, Vp9, H264
+from .media import (
+    UsmMedia,
+    UsmVideo,
+    UsmAudio,
+    GenericVideo,
+    GenericAudio,
+    Vp9,
+    H264,
+    Adx,
+    Hca,
+    ProbeCache,
+    probe_cache,
+)
 from .types import OpMode, ElementOccurrence, ElementType, PayloadType, ChunkType
 
 import logging
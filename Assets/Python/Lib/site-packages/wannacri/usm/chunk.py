@@ -1,12 +1,76 @@
 from __future__ import annotations
 import logging
-from typing import List, Union, Callable
+import struct
+from typing import List, Optional, Tuple, Union, Callable, NamedTuple
 
 from .types import ChunkType, PayloadType
-from .page import UsmPage, pack_pages, get_pages
+from .page import UsmPage, pack_pages, packed_pages_size, get_pages
 from .tools import bytes_to_hex, is_payload_list_pages
 
 
+class ChunkHeader(NamedTuple):
+    """The fixed 0x20 byte header in front of every chunk's payload."""
+
+    chunk_type: ChunkType
+    chunksize: int
+    payload_offset: int
+    padding_size: int
+    channel_number: int
+    payload_type: PayloadType
+    frame_time: int
+    frame_rate: int
+
+    # signature, chunksize, r08, payload_offset, padding_size, channel_number,
+    # r0D, r0E, payload_type, frame_time, frame_rate, r18, r1C
+    _struct = struct.Struct(">4sIxBHB2xBII8x")
+
+    @property
+    def payload_begin(self) -> int:
+        """Offset of the payload from the start of the chunk."""
+        return 0x08 + self.payload_offset
+
+    @property
+    def payload_size(self) -> int:
+        return self.chunksize - self.payload_offset - self.padding_size
+
+    @property
+    def size(self) -> int:
+        """Size of the whole chunk. Including header and padding."""
+        return 0x08 + self.chunksize
+
+    @classmethod
+    def from_bytes(cls, header: bytes) -> ChunkHeader:
+        """Parse a chunk header without touching its payload."""
+        if len(header) < 0x20:
+            raise ValueError(f"Chunk header too short: {len(header)} bytes")
+
+        (
+            signature,
+            chunksize,
+            payload_offset,
+            padding_size,
+            channel_number,
+            payload_type,
+            frame_time,
+            frame_rate,
+        ) = cls._struct.unpack_from(header)
+
+        result = cls(
+            ChunkType.from_bytes(signature),
+            chunksize,
+            payload_offset,
+            padding_size,
+            channel_number,
+            PayloadType.from_int(payload_type & 0x3),
+            frame_time,
+            frame_rate,
+        )
+        if result.payload_size < 0:
+            raise ValueError("Negative size")
+
+        return result
+
+
 class UsmChunk:
     def __init__(
         self,
@@ -30,25 +94,60 @@ class UsmChunk:
         self.payload_offset = payload_offset
         self.encoding = encoding
 
+        # Packed page list payload and its size, each with the
+        # fingerprint of the pages they were computed from
+        self._packed: Optional[Tuple[tuple, bytes]] = None
+        self._packed_size: Optional[Tuple[tuple, int]] = None
+
+    def _pages_fingerprint(self) -> tuple:
+        # Holds the pages themselves rather than their ids, which could be
+        # reused by new pages once the old ones are gone. UsmPage compares
+        # by identity.
+        return (
+            self.encoding,
+            tuple(self.payload),
+            tuple(page.revision for page in self.payload),
+        )
+
+    def _packed_payload(self) -> bytes:
+        """The payload as bytes. Page lists are packed once and
+        packed again only after a page is updated."""
+        if not isinstance(self.payload, list):
+            return self.payload
+
+        fingerprint = self._pages_fingerprint()
+        if self._packed is None or self._packed[0] != fingerprint:
+            self._packed = (fingerprint, pack_pages(self.payload, self.encoding))
+
+        return self._packed[1]
+
+    def _payload_size(self) -> int:
+        if not isinstance(self.payload, list):
+            return len(self.payload)
+
+        fingerprint = self._pages_fingerprint()
+        if self._packed is not None and self._packed[0] == fingerprint:
+            return len(self._packed[1])
+
+        if self._packed_size is None or self._packed_size[0] != fingerprint:
+            self._packed_size = (
+                fingerprint,
+                packed_pages_size(self.payload, self.encoding),
+            )
+
+        return self._packed_size[1]
+
     @property
     def padding(self) -> int:
         """The number of byte padding a chunk will have when packed."""
         if isinstance(self._padding, int):
             return self._padding
 
-        if isinstance(self.payload, list):
-            payload_size = len(pack_pages(self.payload, self.encoding))
-        else:
-            payload_size = len(self.payload)
-
-        return self._padding(0x20 + payload_size)
+        return self._padding(0x20 + self._payload_size())
 
     def __len__(self) -> int:
         """Returns the packed length of a chunk. Including _padding."""
-        if isinstance(self.payload, list):
-            payload_size = len(pack_pages(self.payload, self.encoding))
-        else:
-            payload_size = len(self.payload)
+        payload_size = self._payload_size()
 
         if isinstance(self._padding, int):
             padding = self._padding
@@ -148,10 +247,7 @@ class UsmChunk:
         result = bytearray()
         result += self.chunk_type.value
 
-        if isinstance(self.payload, list):
-            payload = pack_pages(self.payload, self.encoding)
-        else:
-            payload = self.payload
+        payload = self._packed_payload()
 
         if isinstance(self._padding, int):
             padding = self._padding
@@ -0,0 +1,250 @@
+"""Cipher engines for USM stream payloads.
+
+Video payloads are encrypted with a rolling key where every byte only depends
+on the byte 0x20 positions before it. Laid out as rows of 0x20 bytes, the
+cipher is therefore 32 independent lanes and decryption is a running XOR down
+each lane, which NumPy computes with a single accumulate call.
+
+Without NumPy, e.g. in the embedded runtime shipped with the GUI, the same
+lane arithmetic runs on whole packets converted to big Python integers, where
+shifting by 0x100 bits moves every byte one row down. The byte-at-a-time
+reference engine is kept for verification.
+"""
+import threading
+from typing import Callable, Dict, NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class CipherBackend(NamedTuple):
+    name: str
+    encrypt_video: Callable[[bytes, bytes], bytes]
+    decrypt_video: Callable[[bytes, bytes], bytes]
+    crypt_audio: Callable[[bytes, bytes], bytes]
+
+
+def _decrypt_video_python(packet: bytes, video_key: bytes) -> bytes:
+    data = bytearray(packet)
+    encrypted_part_size = len(data) - 0x40
+    if encrypted_part_size >= 0x200:
+        rolling = bytearray(video_key)
+        for i in range(0x100, encrypted_part_size):
+            data[0x40 + i] ^= rolling[0x20 + i % 0x20]
+            rolling[0x20 + i % 0x20] = data[0x40 + i] ^ video_key[0x20 + i % 0x20]
+
+        for i in range(0x100):
+            rolling[i % 0x20] ^= data[0x140 + i]
+            data[0x40 + i] ^= rolling[i % 0x20]
+
+    return bytes(data)
+
+
+def _encrypt_video_python(packet: bytes, video_key: bytes) -> bytes:
+    data = bytearray(packet)
+    if len(data) >= 0x240:
+        encrypted_part_size = len(data) - 0x40
+        rolling = bytearray(video_key)
+        for i in range(0x100):
+            rolling[i % 0x20] ^= data[0x140 + i]
+            data[0x40 + i] ^= rolling[i % 0x20]
+
+        for i in range(0x100, encrypted_part_size):
+            plainbyte = data[0x40 + i]
+            data[0x40 + i] ^= rolling[0x20 + i % 0x20]
+            rolling[0x20 + i % 0x20] = plainbyte ^ video_key[0x20 + i % 0x20]
+
+    return bytes(data)
+
+
+def _crypt_audio_python(packet: bytes, key: bytes) -> bytes:
+    data = bytearray(packet)
+    if len(data) > 0x140:
+        for i in range(0x140, len(data)):
+            data[i] ^= key[i % 0x20]
+
+    return bytes(data)
+
+
+# Tiled keys, at most _TILED_KEYS_MAX_SIZE bytes of them in total
+_tiled_keys: Dict[bytes, bytes] = {}
+_tiled_keys_lock = threading.Lock()
+_TILED_KEYS_MAX_SIZE = 0x800000
+
+
+def _tiled_key_int(key: bytes, size: int) -> int:
+    """Integer of the 0x20 byte key repeated over size bytes. The tiled key is
+    kept and only grown when a larger packet comes along. Kept keys are
+    dropped when they would take more than _TILED_KEYS_MAX_SIZE bytes, and
+    keys for packets larger than that aren't kept at all."""
+    with _tiled_keys_lock:
+        tiled = _tiled_keys.get(key, b"")
+
+    if len(tiled) < size:
+        tiled = key * (2 * -(-size // len(key)))
+        with _tiled_keys_lock:
+            _tiled_keys.pop(key, None)
+            kept_size = sum(len(kept) for kept in _tiled_keys.values())
+            if kept_size + len(tiled) > _TILED_KEYS_MAX_SIZE:
+                _tiled_keys.clear()
+            if len(tiled) <= _TILED_KEYS_MAX_SIZE:
+                _tiled_keys[key] = tiled
+
+    return int.from_bytes(tiled[:size], "little")
+
+
+def _scan_rows(value: int, size: int) -> int:
+    """Running XOR of every 0x20 byte row over the ones before it, for a
+    little-endian integer of size bytes."""
+    bits = size * 8
+    shift = 0x100
+    while shift < bits:
+        value ^= (value & ((1 << (bits - shift)) - 1)) << shift
+        shift <<= 1
+
+    return value
+
+
+def _decrypt_video_int(packet: bytes, video_key: bytes) -> bytes:
+    if len(packet) < 0x240:
+        return bytes(packet)
+
+    body_size = len(packet) - 0x140
+    plain = _scan_rows(
+        int.from_bytes(packet[0x140:], "little")
+        ^ _tiled_key_int(video_key[0x20:0x40], body_size),
+        body_size,
+    )
+
+    rolling = _scan_rows(plain & ((1 << 0x800) - 1), 0x100)
+    rolling ^= _tiled_key_int(video_key[:0x20], 0x100)
+    head = int.from_bytes(packet[0x40:0x140], "little") ^ rolling
+    return (
+        bytes(packet[:0x40])
+        + head.to_bytes(0x100, "little")
+        + plain.to_bytes(body_size, "little")
+    )
+
+
+def _encrypt_video_int(packet: bytes, video_key: bytes) -> bytes:
+    if len(packet) < 0x240:
+        return bytes(packet)
+
+    body_size = len(packet) - 0x140
+    plain = int.from_bytes(packet[0x140:], "little")
+    rolling = _scan_rows(plain & ((1 << 0x800) - 1), 0x100)
+    rolling ^= _tiled_key_int(video_key[:0x20], 0x100)
+    head = int.from_bytes(packet[0x40:0x140], "little") ^ rolling
+
+    body = plain ^ ((plain & ((1 << (body_size * 8 - 0x100)) - 1)) << 0x100)
+    body ^= _tiled_key_int(video_key[0x20:0x40], body_size)
+    return (
+        bytes(packet[:0x40])
+        + head.to_bytes(0x100, "little")
+        + body.to_bytes(body_size, "little")
+    )
+
+
+def _crypt_audio_int(packet: bytes, key: bytes) -> bytes:
+    if len(packet) <= 0x140:
+        return bytes(packet)
+
+    # 0x140 is a multiple of 0x20, so the tiled key starts aligned
+    size = len(packet) - 0x140
+    tail = int.from_bytes(packet[0x140:], "little") ^ _tiled_key_int(key[:0x20], size)
+    return bytes(packet[:0x140]) + tail.to_bytes(size, "little")
+
+
+def _lanes(data, size: int):
+    """Copy a uint8 array into a (rows, 0x20) array, zero filling the last row."""
+    rows = -(-size // 0x20)
+    lanes = np.zeros(rows * 0x20, dtype=np.uint8)
+    lanes[:size] = data
+    return lanes.reshape(rows, 0x20)
+
+
+def _decrypt_video_numpy(packet: bytes, video_key: bytes) -> bytes:
+    data = np.frombuffer(packet, dtype=np.uint8).copy()
+    if len(data) < 0x240:
+        return data.tobytes()
+
+    key = np.frombuffer(video_key, dtype=np.uint8, count=0x40)
+    body_size = len(data) - 0x140
+
+    # Every plain byte is the running XOR of (cipher byte ^ key byte) down its lane
+    lanes = _lanes(data[0x140:], body_size)
+    lanes ^= key[0x20:]
+    np.bitwise_xor.accumulate(lanes, axis=0, out=lanes)
+    data[0x140:] = lanes.reshape(-1)[:body_size]
+
+    # The first 0x100 bytes are keyed with a running XOR of the next 0x100 plain bytes
+    rolling = np.bitwise_xor.accumulate(lanes[:8], axis=0)
+    rolling ^= key[:0x20]
+    data[0x40:0x140] ^= rolling.reshape(-1)
+    return data.tobytes()
+
+
+def _encrypt_video_numpy(packet: bytes, video_key: bytes) -> bytes:
+    data = np.frombuffer(packet, dtype=np.uint8).copy()
+    if len(data) < 0x240:
+        return data.tobytes()
+
+    key = np.frombuffer(video_key, dtype=np.uint8, count=0x40)
+    body_size = len(data) - 0x140
+    plain = _lanes(data[0x140:], body_size)
+
+    rolling = np.bitwise_xor.accumulate(plain[:8], axis=0)
+    rolling ^= key[:0x20]
+    data[0x40:0x140] ^= rolling.reshape(-1)
+
+    # Every cipher byte is its plain byte ^ the plain byte 0x20 before it ^ key byte
+    lanes = plain ^ key[0x20:]
+    lanes[1:] ^= plain[:-1]
+    data[0x140:] = lanes.reshape(-1)[:body_size]
+    return data.tobytes()
+
+
+def _crypt_audio_numpy(packet: bytes, key: bytes) -> bytes:
+    data = np.frombuffer(packet, dtype=np.uint8).copy()
+    if len(data) <= 0x140:
+        return data.tobytes()
+
+    size = len(data) - 0x140
+    lanes = _lanes(data[0x140:], size)
+    lanes ^= np.frombuffer(key, dtype=np.uint8, count=0x20)
+    data[0x140:] = lanes.reshape(-1)[:size]
+    return data.tobytes()
+
+
+BACKENDS: Dict[str, CipherBackend] = {
+    "python": CipherBackend(
+        "python", _encrypt_video_python, _decrypt_video_python, _crypt_audio_python
+    ),
+    "int": CipherBackend(
+        "int", _encrypt_video_int, _decrypt_video_int, _crypt_audio_int
+    ),
+}
+if np is not None:
+    BACKENDS["numpy"] = CipherBackend(
+        "numpy", _encrypt_video_numpy, _decrypt_video_numpy, _crypt_audio_numpy
+    )
+
+backend = BACKENDS["numpy"] if np is not None else BACKENDS["int"]
+
+
+def use_backend(name: str) -> CipherBackend:
+    """Select the engine used by the packet cipher functions in tools.
+    Returns the previously selected backend."""
+    global backend
+
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown or unavailable cipher backend {name}. "
+            f"Available: {', '.join(BACKENDS)}"
+        )
+
+    previous = backend
+    backend = BACKENDS[name]
+    return previous
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .page import UsmPage
+
+# mpeg_codec of VIDEO_HDRINFO and audio_codec of AUDIO_HDRINFO
+VIDEO_CODECS = {1: "MPEG", 5: "H264", 9: "VP9"}
+AUDIO_CODECS = {2: "ADX", 4: "HCA"}
+
+
+class VideoInfo(NamedTuple):
+    channel_number: int
+    codec: str
+    width: int
+    height: int
+    num_frames: int
+    framerate: float
+    bitrate: int
+    # None when the USM has no seek info for the channel
+    num_keyframes: Optional[int]
+
+
+class AudioInfo(NamedTuple):
+    channel_number: int
+    codec: str
+    sampling_rate: int
+    num_channels: int
+    num_samples: int
+    bitrate: int
+
+
+class UsmInfo(NamedTuple):
+    filename: str
+    filesize: int
+    version: int
+    videos: List[VideoInfo]
+    audios: List[AudioInfo]
+    alphas: List[VideoInfo]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "filename": self.filename,
+            "filesize": self.filesize,
+            "version": self.version,
+            "videos": [video._asdict() for video in self.videos],
+            "audios": [audio._asdict() for audio in self.audios],
+            "alphas": [alpha._asdict() for alpha in self.alphas],
+        }
+
+
+def _value(page: UsmPage, name: str, default: Any = 0) -> Any:
+    element = page.get(name)
+    return default if element is None else element.val
+
+
+def video_info(
+    channel_number: int,
+    crid: UsmPage,
+    header: UsmPage,
+    metadata: Optional[List[UsmPage]],
+) -> VideoInfo:
+    """Summarises a video channel from its CRID, VIDEO_HDRINFO and VIDEO_SEEKINFO pages."""
+    mpeg_codec = _value(header, "mpeg_codec")
+    framerate_n = _value(header, "framerate_n")
+    framerate_d = _value(header, "framerate_d", 1)
+    if metadata is not None and len(metadata) > 0 and metadata[0].name == "VIDEO_SEEKINFO":
+        num_keyframes: Optional[int] = len(metadata)
+    else:
+        num_keyframes = None
+
+    return VideoInfo(
+        channel_number=channel_number,
+        codec=VIDEO_CODECS.get(mpeg_codec, str(mpeg_codec)),
+        width=_value(header, "width"),
+        height=_value(header, "height"),
+        num_frames=_value(header, "total_frames"),
+        framerate=framerate_n / framerate_d if framerate_d != 0 else 0.0,
+        bitrate=_value(crid, "avbps"),
+        num_keyframes=num_keyframes,
+    )
+
+
+def audio_info(channel_number: int, crid: UsmPage, header: UsmPage) -> AudioInfo:
+    """Summarises an audio channel from its CRID and AUDIO_HDRINFO pages."""
+    audio_codec = _value(header, "audio_codec")
+    return AudioInfo(
+        channel_number=channel_number,
+        codec=AUDIO_CODECS.get(audio_codec, str(audio_codec)),
+        sampling_rate=_value(header, "sampling_rate"),
+        num_channels=_value(header, "num_channels"),
+        num_samples=_value(header, "total_samples"),
+        bitrate=_value(crid, "avbps"),
+    )
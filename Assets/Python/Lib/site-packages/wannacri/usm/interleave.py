@@ -0,0 +1,89 @@
+"""Lays out the packets of several streams in one file by presentation time,
+and measures the buffer a player needs to read the result."""
+from __future__ import annotations
+
+import heapq
+from array import array
+from typing import Generator, Iterable, Iterator, List, Sequence, Tuple
+
+
+def interleave(
+    times: List[Iterable[float]], max_lead: float = 0.0
+) -> Generator[Tuple[int, int], None, None]:
+    """Merges streams by the time in seconds of their packets with a heap.
+    Yields the stream index and packet index of every packet in file order.
+
+    A stream's lead is how far the time of its next packet is ahead of the
+    slowest stream, the one whose next packet is earliest. max_lead caps it:
+    the stream being written keeps going, which saves switches between
+    streams, until its lead would reach max_lead. It is then held back and
+    the slowest stream goes next. No packet is written max_lead seconds or
+    more ahead of a packet that follows it in the file. With the default
+    max_lead of 0 no stream may lead at all, so packets are placed strictly
+    by time, and packets with the same time go in stream order.
+
+    Times are read lazily, one packet ahead of the last yielded packet of
+    every stream, so they can come from streams whose length isn't known yet."""
+    iterators: List[Iterator[float]] = [iter(stream_times) for stream_times in times]
+    heap = []
+    for stream, iterator in enumerate(iterators):
+        time = next(iterator, None)
+        if time is not None:
+            heap.append((time, stream, 0))
+
+    heapq.heapify(heap)
+    while len(heap) > 0:
+        # The slowest stream
+        time, stream, index = heapq.heappop(heap)
+        iterator = iterators[stream]
+        while True:
+            yield stream, index
+            index += 1
+            next_packet_time = next(iterator, None)
+            if next_packet_time is None:
+                break
+
+            time = next_packet_time
+            if len(heap) == 0:
+                # The last stream left has no one to lead
+                continue
+
+            slowest_time, slowest_stream, _ = heap[0]
+            lead = time - slowest_time
+            if lead < max_lead or (lead == 0 and stream < slowest_stream):
+                continue
+
+            # Held back until it is the slowest stream
+            heapq.heappush(heap, (time, stream, index))
+            break
+
+
+def peak_buffer(times: Sequence[float], sizes: Sequence[int]) -> int:
+    """The most bytes a player holds at once when it reads chunks, given as
+    their times in seconds and sizes in file order, just in time to play them.
+
+    The reader has to reach a chunk by the earliest time of it and every chunk
+    after it, which is the time of the slowest stream as interleave sees it
+    when the chunk is written. The chunk is then held until its own time has
+    passed, that is for its lead, so a larger max_lead in interleave means
+    chunks are held longer and the peak grows."""
+    # Time by which the reader has to have read every chunk, the time of
+    # the slowest stream at that point of the file
+    read_times = array("d", [0.0]) * len(times)
+    earliest = float("inf")
+    for i in range(len(times) - 1, -1, -1):
+        earliest = min(earliest, times[i])
+        read_times[i] = earliest
+
+    held: List[Tuple[float, int]] = []
+    occupancy = 0
+    peak = 0
+    for time, size, read_time in zip(times, sizes, read_times):
+        heapq.heappush(held, (time, size))
+        occupancy += size
+        while held[0][0] < read_time:
+            occupancy -= heapq.heappop(held)[1]
+
+        peak = max(peak, occupancy)
+
+    return peak
@@ -1,7 +1,10 @@
 from .protocols import UsmVideo, UsmAudio, UsmMedia
 from .video import GenericVideo, Vp9, H264
-from .audio import GenericAudio
+from .audio import GenericAudio, Adx, Hca
+from .probe import ProbeCache, probe, probe_cache, probe_packets
 from .tools import (
     create_video_crid_page,
     create_video_header_page,
+    create_audio_crid_page,
+    create_audio_header_page,
 )
@@ -0,0 +1,59 @@
+"""Reads CRI ADX headers directly to split ADX files into frames.
+
+An ADX file is a header ending in "(c)CRI" followed by frames. Every frame
+holds one block per channel, and every block is a 2 byte scale followed by
+samples of bit_depth bits."""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+ADX_SIGNATURE = b"\x80\x00"
+ADX_COPYRIGHT = b"(c)CRI"
+
+
+class AdxHeader(NamedTuple):
+    encoding_type: int
+    block_size: int
+    bit_depth: int
+    num_channels: int
+    sampling_rate: int
+    total_samples: int
+    # Offset of the first frame
+    data_offset: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> AdxHeader:
+        if len(data) < 0x14 or data[:2] != ADX_SIGNATURE:
+            raise ValueError("File is not an adx.")
+
+        data_offset = int.from_bytes(data[2:4], "big") + 4
+        if len(data) < data_offset or data[data_offset - 6 : data_offset] != ADX_COPYRIGHT:
+            raise ValueError("Adx header has no copyright string.")
+
+        result = cls(
+            encoding_type=data[4],
+            block_size=data[5],
+            bit_depth=data[6],
+            num_channels=data[7],
+            sampling_rate=int.from_bytes(data[8:12], "big"),
+            total_samples=int.from_bytes(data[12:16], "big"),
+            data_offset=data_offset,
+        )
+        if result.block_size <= 2 or result.bit_depth == 0 or result.num_channels == 0:
+            raise ValueError("Invalid adx block layout.")
+        if result.sampling_rate == 0:
+            raise ValueError("Invalid adx sampling rate.")
+
+        return result
+
+    @property
+    def frame_size(self) -> int:
+        return self.block_size * self.num_channels
+
+    @property
+    def samples_per_frame(self) -> int:
+        return (self.block_size - 2) * 8 // self.bit_depth
+
+    @property
+    def num_frames(self) -> int:
+        return -(-self.total_samples // self.samples_per_frame)
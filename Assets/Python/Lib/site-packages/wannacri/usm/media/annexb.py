@@ -0,0 +1,256 @@
+"""Indexes raw H.264 (Annex B) elementary streams without ffprobe.
+
+NAL units are found by scanning large blocks for start codes with bytes.find,
+grouped into access units, and the first SPS is parsed for the picture size
+and VUI timing."""
+from __future__ import annotations
+
+import io
+
+from typing import IO, Generator, List, NamedTuple, Optional, Tuple
+
+from .tools import BitReader
+
+START_CODE = b"\x00\x00\x01"
+
+NAL_SLICE = 1
+NAL_IDR_SLICE = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# NAL units that start a new access unit when they follow a picture's slices
+_AU_START_TYPES = {NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD, 14, 15, 16, 17, 18}
+
+# Profiles with chroma format and bit depth fields in their SPS
+_HIGH_PROFILES = {100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+
+class AccessUnit(NamedTuple):
+    # Offset of the access unit's first start code
+    offset: int
+    is_keyframe: bool
+
+
+class SequenceParameterSet(NamedTuple):
+    width: int
+    height: int
+    # None when the SPS has no VUI timing info
+    framerate: Optional[float]
+
+
+def scan_nal_units(
+    stream: IO, block_size: int = 0x100000, lookahead: int = 0x200
+) -> Generator[Tuple[int, int, bytes], None, None]:
+    """Yields the offset of every NAL unit's start code (including the zero_byte
+    of 4 byte start codes), the offset of the NAL unit itself, and up to
+    lookahead bytes of the NAL unit."""
+    buffer = b""
+    base = 0  # Stream offset of buffer[0]
+    position = 0  # Where to continue searching in buffer
+    eof = False
+    while True:
+        index = buffer.find(START_CODE, position)
+        if not eof and (index == -1 or index + 3 + lookahead > len(buffer)):
+            # Keep the tail since a start code can straddle two blocks
+            next_position = max(position, len(buffer) - 2) if index == -1 else index
+            cut = max(0, next_position - 1)
+
+            block = stream.read(block_size)
+            eof = len(block) == 0
+            buffer = buffer[cut:] + block
+            base += cut
+            position = next_position - cut
+            continue
+
+        if index == -1:
+            return
+
+        nal_offset = index + 3
+        start = index - 1 if index > 0 and buffer[index - 1] == 0 else index
+        yield base + start, base + nal_offset, buffer[nal_offset : nal_offset + lookahead]
+        position = nal_offset
+
+
+def nal_units(data: bytes) -> List[Tuple[int, bytes]]:
+    """Splits Annex B data held in memory, e.g. an access unit, into the type
+    and bytes, start code included, of every NAL unit."""
+    found = [
+        (offset, nal[0] & 0x1F)
+        for offset, _, nal in scan_nal_units(io.BytesIO(data), lookahead=1)
+        if len(nal) != 0
+    ]
+    ends = [offset for offset, _ in found[1:]] + [len(data)]
+    return [
+        (nal_type, bytes(data[offset:end]))
+        for (offset, nal_type), end in zip(found, ends)
+    ]
+
+
+def unescape_rbsp(nal: bytes) -> bytes:
+    """Removes emulation prevention bytes (00 00 03 -> 00 00)."""
+    if b"\x00\x00\x03" not in nal:
+        return nal
+
+    result = bytearray()
+    start = 0
+    while True:
+        index = nal.find(b"\x00\x00\x03", start)
+        if index == -1:
+            result += nal[start:]
+            return bytes(result)
+
+        result += nal[start : index + 2]
+        start = index + 3
+
+
+def _first_mb_in_slice(nal: bytes) -> int:
+    return BitReader(unescape_rbsp(nal[1:9])).read_ue()
+
+
+def index_access_units(
+    stream: IO,
+) -> Tuple[List[AccessUnit], Optional[SequenceParameterSet]]:
+    """Groups the NAL units of a raw H.264 stream into access units, following
+    the access unit boundaries of H.264 7.4.1.2.3. Access units with an IDR
+    slice are keyframes. The first access unit always starts at offset 0."""
+    access_units: List[AccessUnit] = []
+    sps: Optional[SequenceParameterSet] = None
+
+    au_offset: Optional[int] = None
+    au_has_vcl = False
+    au_is_keyframe = False
+    for offset, _, nal in scan_nal_units(stream):
+        if len(nal) == 0:
+            continue
+
+        nal_type = nal[0] & 0x1F
+        is_vcl = nal_type in (NAL_SLICE, NAL_IDR_SLICE)
+
+        starts_au = False
+        if au_has_vcl:
+            if nal_type in _AU_START_TYPES:
+                starts_au = True
+            elif is_vcl:
+                try:
+                    starts_au = _first_mb_in_slice(nal) == 0
+                except ValueError:
+                    starts_au = False
+
+        if starts_au and au_offset is not None:
+            access_units.append(AccessUnit(au_offset, au_is_keyframe))
+            au_offset = None
+            au_has_vcl = False
+            au_is_keyframe = False
+
+        if au_offset is None:
+            au_offset = offset if len(access_units) != 0 else 0
+
+        if is_vcl:
+            au_has_vcl = True
+            au_is_keyframe |= nal_type == NAL_IDR_SLICE
+        elif nal_type == NAL_SPS and sps is None:
+            try:
+                sps = parse_sps(nal)
+            except ValueError:
+                sps = None
+
+    if au_has_vcl and au_offset is not None:
+        access_units.append(AccessUnit(au_offset, au_is_keyframe))
+
+    return access_units, sps
+
+
+def _skip_scaling_list(reader: BitReader, size: int):
+    last_scale = 8
+    next_scale = 8
+    for _ in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + reader.read_se() + 256) % 256
+        last_scale = next_scale if next_scale != 0 else last_scale
+
+
+def parse_sps(nal: bytes) -> SequenceParameterSet:
+    """Parses the picture size and VUI frame rate of an SPS NAL unit,
+    given with its one byte NAL header."""
+    reader = BitReader(unescape_rbsp(nal[1:]))
+    profile_idc = reader.read(8)
+    reader.read(8)  # constraint_set flags and reserved_zero_2bits
+    reader.read(8)  # level_idc
+    reader.read_ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in _HIGH_PROFILES:
+        chroma_format_idc = reader.read_ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.read(1)
+        reader.read_ue()  # bit_depth_luma_minus8
+        reader.read_ue()  # bit_depth_chroma_minus8
+        reader.read(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.read(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.read(1):
+                    _skip_scaling_list(reader, 16 if i < 6 else 64)
+
+    reader.read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.read_ue()
+    if pic_order_cnt_type == 0:
+        reader.read_ue()  # log2_max_pic_order_cnt_lsb_minus4
+    elif pic_order_cnt_type == 1:
+        reader.read(1)  # delta_pic_order_always_zero_flag
+        reader.read_se()  # offset_for_non_ref_pic
+        reader.read_se()  # offset_for_top_to_bottom_field
+        for _ in range(reader.read_ue()):
+            reader.read_se()  # offset_for_ref_frame
+
+    reader.read_ue()  # max_num_ref_frames
+    reader.read(1)  # gaps_in_frame_num_value_allowed_flag
+    pic_width_in_mbs = reader.read_ue() + 1
+    pic_height_in_map_units = reader.read_ue() + 1
+    frame_mbs_only = reader.read(1)
+    if not frame_mbs_only:
+        reader.read(1)  # mb_adaptive_frame_field_flag
+    reader.read(1)  # direct_8x8_inference_flag
+
+    crop_left = crop_right = crop_top = crop_bottom = 0
+    if reader.read(1):  # frame_cropping_flag
+        crop_left = reader.read_ue()
+        crop_right = reader.read_ue()
+        crop_top = reader.read_ue()
+        crop_bottom = reader.read_ue()
+
+    if chroma_format_idc == 0 or separate_colour_plane:
+        crop_unit_x = 1
+        crop_unit_y = 2 - frame_mbs_only
+    else:
+        crop_unit_x = 2 if chroma_format_idc in (1, 2) else 1
+        crop_unit_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+
+    width = pic_width_in_mbs * 16 - crop_unit_x * (crop_left + crop_right)
+    height = (2 - frame_mbs_only) * pic_height_in_map_units * 16 - crop_unit_y * (
+        crop_top + crop_bottom
+    )
+
+    framerate = None
+    if reader.read(1):  # vui_parameters_present_flag
+        if reader.read(1):  # aspect_ratio_info_present_flag
+            if reader.read(8) == 255:  # Extended_SAR
+                reader.read(32)  # sar_width and sar_height
+        if reader.read(1):  # overscan_info_present_flag
+            reader.read(1)  # overscan_appropriate_flag
+        if reader.read(1):  # video_signal_type_present_flag
+            reader.read(4)  # video_format and video_full_range_flag
+            if reader.read(1):  # colour_description_present_flag
+                reader.read(24)
+        if reader.read(1):  # chroma_loc_info_present_flag
+            reader.read_ue()
+            reader.read_ue()
+        if reader.read(1):  # timing_info_present_flag
+            num_units_in_tick = reader.read(32)
+            time_scale = reader.read(32)
+            if num_units_in_tick != 0 and time_scale != 0:
+                framerate = time_scale / (2 * num_units_in_tick)
+
+    return SequenceParameterSet(width, height, framerate)
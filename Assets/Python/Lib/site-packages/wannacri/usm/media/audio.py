@@ -1,7 +1,13 @@
+import os
 from typing import Generator, Optional, List
 
+from .adx import AdxHeader
+from .hca import HcaHeader, HCA_SAMPLES_PER_FRAME
 from .protocols import UsmAudio
+from .tools import create_audio_crid_page, create_audio_header_page
 from ..page import UsmPage
+from ..tables import PacketTable
+from ..tools import PacketReader
 
 
 class GenericAudio(UsmAudio):
@@ -17,6 +23,8 @@ class GenericAudio(UsmAudio):
         length: int,
         channel_number: int = 0,
         metadata_pages: Optional[List[UsmPage]] = None,
+        packets: Optional[PacketTable] = None,
+        reader: Optional[PacketReader] = None,
     ):
         self._stream = stream
         self._crid_page = crid_page
@@ -24,3 +32,165 @@ class GenericAudio(UsmAudio):
         self._length = length
         self._channel_number = channel_number
         self._metadata_pages = metadata_pages
+        self._packets = packets
+        self._reader = reader
+
+
+class Adx(UsmAudio):
+    def __init__(
+        self,
+        filepath: str,
+        channel_number: int = 0,
+        format_version: int = 16777984,
+        frames_per_packet: Optional[int] = None,
+    ):
+        """Splits an ADX file into packets of whole frames by reading its header.
+        The first packet holds the header. By default every packet holds about a
+        30th of a second of audio."""
+        filesize = os.path.getsize(filepath)
+        with open(filepath, "rb") as adx:
+            header = AdxHeader.from_bytes(adx.read(0x1000))
+
+        packets = _frame_packets(
+            filesize,
+            header.data_offset,
+            header.frame_size,
+            header.num_frames,
+            header.samples_per_frame,
+            header.sampling_rate,
+            frames_per_packet,
+        )
+        _init_audio(
+            self,
+            filepath,
+            filesize,
+            packets,
+            channel_number,
+            format_version,
+            audio_codec=2,  # Value for ADX USMs
+            sampling_rate=header.sampling_rate,
+            num_channels=header.num_channels,
+            total_samples=header.total_samples,
+        )
+
+
+class Hca(UsmAudio):
+    def __init__(
+        self,
+        filepath: str,
+        channel_number: int = 0,
+        format_version: int = 16777984,
+        frames_per_packet: Optional[int] = None,
+    ):
+        """Splits an HCA file into packets of whole frames by reading its header.
+        The first packet holds the header. By default every packet holds about a
+        30th of a second of audio."""
+        filesize = os.path.getsize(filepath)
+        with open(filepath, "rb") as hca:
+            data = hca.read(8)
+            if len(data) == 8:
+                data += hca.read(max(0, int.from_bytes(data[6:8], "big") - 8))
+        header = HcaHeader.from_bytes(data)
+
+        packets = _frame_packets(
+            filesize,
+            header.data_offset,
+            header.block_size,
+            header.num_frames,
+            HCA_SAMPLES_PER_FRAME,
+            header.sampling_rate,
+            frames_per_packet,
+        )
+        _init_audio(
+            self,
+            filepath,
+            filesize,
+            packets,
+            channel_number,
+            format_version,
+            audio_codec=4,  # Value for HCA USMs
+            sampling_rate=header.sampling_rate,
+            num_channels=header.num_channels,
+            total_samples=header.total_samples,
+        )
+
+
+def _frame_packets(
+    filesize: int,
+    data_offset: int,
+    frame_size: int,
+    num_frames: int,
+    samples_per_frame: int,
+    sampling_rate: int,
+    frames_per_packet: Optional[int],
+) -> PacketTable:
+    """Lays out a header packet and packets of frames_per_packet frames, with
+    timestamps in samples. Bytes after the last frame, like an ADX footer,
+    go with the last packet."""
+    if frames_per_packet is None:
+        frames_per_packet = max(1, round(sampling_rate / 30 / samples_per_frame))
+    if frames_per_packet <= 0:
+        raise ValueError(f"Invalid frames per packet: {frames_per_packet}")
+
+    num_frames = min(num_frames, (filesize - data_offset) // frame_size)
+    if num_frames <= 0:
+        raise ValueError("File has no audio frames.")
+
+    packets = PacketTable(rate=sampling_rate)
+    packets.append(0, data_offset)
+    for frame in range(0, num_frames, frames_per_packet):
+        count = min(frames_per_packet, num_frames - frame)
+        packets.append(
+            data_offset + frame * frame_size,
+            count * frame_size,
+            frame * samples_per_frame,
+        )
+
+    # Trailing bytes after the last whole frame
+    packets.sizes[-1] = filesize - packets.offsets[-1]
+    return packets
+
+
+def _init_audio(
+    audio: UsmAudio,
+    filepath: str,
+    filesize: int,
+    packets: PacketTable,
+    channel_number: int,
+    format_version: int,
+    audio_codec: int,
+    sampling_rate: int,
+    num_channels: int,
+    total_samples: int,
+):
+    max_size = max(packets.sizes)
+    max_padding_size = 0x20 - (max_size % 0x20) if max_size % 0x20 != 0 else 0
+    duration = total_samples / sampling_rate
+
+    audio._crid_page = create_audio_crid_page(
+        filename=os.path.basename(filepath),
+        filesize=filesize,
+        max_size=max_size,
+        format_version=format_version,
+        channel_number=channel_number,
+        bitrate=int(filesize * 8 / duration) if duration > 0 else 0,
+    )
+    audio._header_page = create_audio_header_page(
+        audio_codec=audio_codec,
+        sampling_rate=sampling_rate,
+        num_channels=num_channels,
+        total_samples=total_samples,
+        max_packed_size=0x18 + max_size + max_padding_size,
+    )
+    audio._stream = _packet_gen(filepath, packets)
+    audio._length = len(packets)
+    audio._channel_number = channel_number
+    audio._metadata_pages = None
+    audio._packets = packets
+
+
+def _packet_gen(path: str, packets: PacketTable) -> Generator[bytes, None, None]:
+    with open(path, "rb") as audio:
+        for offset, size in packets:
+            audio.seek(offset)
+            yield audio.read(size)
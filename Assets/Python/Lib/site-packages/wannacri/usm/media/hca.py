@@ -0,0 +1,75 @@
+"""Reads CRI HCA headers directly to split HCA files into frames.
+
+An HCA file is a header made of tagged chunks, "HCA", "fmt" and "comp" or
+"dec" among them, followed by frames of block_size bytes holding 1024
+samples each. The high bit of every tag byte is set in encrypted files."""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+HCA_SIGNATURE = b"HCA\x00"
+HCA_SAMPLES_PER_FRAME = 1024
+
+
+def _tag(data: bytes) -> bytes:
+    return bytes(b & 0x7F for b in data)
+
+
+class HcaHeader(NamedTuple):
+    version: int
+    num_channels: int
+    sampling_rate: int
+    num_frames: int
+    encoder_delay: int
+    encoder_padding: int
+    block_size: int
+    # Offset of the first frame
+    data_offset: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> HcaHeader:
+        if len(data) < 8 or _tag(data[:4]) != HCA_SIGNATURE:
+            raise ValueError("File is not an hca.")
+
+        version = int.from_bytes(data[4:6], "big")
+        data_offset = int.from_bytes(data[6:8], "big")
+        if len(data) < data_offset or data_offset < 0x18:
+            raise ValueError("Hca header is truncated.")
+
+        if _tag(data[8:12]) != b"fmt\x00":
+            raise ValueError("Hca header has no fmt chunk.")
+
+        num_channels = data[12]
+        sampling_rate = int.from_bytes(data[13:16], "big")
+        num_frames = int.from_bytes(data[16:20], "big")
+        encoder_delay = int.from_bytes(data[20:22], "big")
+        encoder_padding = int.from_bytes(data[22:24], "big")
+
+        # comp and dec chunks both start with the block size
+        tag = _tag(data[24:28])
+        if tag != b"comp" and tag != b"dec\x00":
+            raise ValueError("Hca header has no comp or dec chunk.")
+
+        block_size = int.from_bytes(data[28:30], "big")
+        if num_channels == 0 or sampling_rate == 0 or block_size == 0:
+            raise ValueError("Invalid hca fmt or comp chunk.")
+
+        return cls(
+            version=version,
+            num_channels=num_channels,
+            sampling_rate=sampling_rate,
+            num_frames=num_frames,
+            encoder_delay=encoder_delay,
+            encoder_padding=encoder_padding,
+            block_size=block_size,
+            data_offset=data_offset,
+        )
+
+    @property
+    def total_samples(self) -> int:
+        return max(
+            0,
+            self.num_frames * HCA_SAMPLES_PER_FRAME
+            - self.encoder_delay
+            - self.encoder_padding,
+        )
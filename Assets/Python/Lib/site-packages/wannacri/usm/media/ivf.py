@@ -0,0 +1,265 @@
+"""Reads IVF files directly to index VP9 frames without ffprobe.
+
+IVF is a 0x20 byte file header followed by frames, each with a 0xC byte
+header holding the frame size and timestamp."""
+from __future__ import annotations
+
+from typing import IO, Generator, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+from .tools import BitReader
+
+IVF_SIGNATURE = b"DKIF"
+IVF_FRAME_HEADER_SIZE = 0xC
+VP9_FOURCC = b"VP90"
+
+
+class IvfHeader(NamedTuple):
+    fourcc: bytes
+    width: int
+    height: int
+    # Timestamps are in units of timebase_numerator / timebase_denominator seconds
+    timebase_denominator: int
+    timebase_numerator: int
+    num_frames: int
+    header_size: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> IvfHeader:
+        if len(data) < 0x20 or data[:4] != IVF_SIGNATURE:
+            raise ValueError("File is not an ivf.")
+
+        return cls(
+            fourcc=bytes(data[8:12]),
+            width=int.from_bytes(data[12:14], "little"),
+            height=int.from_bytes(data[14:16], "little"),
+            timebase_denominator=int.from_bytes(data[16:20], "little"),
+            timebase_numerator=int.from_bytes(data[20:24], "little"),
+            num_frames=int.from_bytes(data[24:28], "little"),
+            header_size=int.from_bytes(data[6:8], "little"),
+        )
+
+
+class IvfFrame(NamedTuple):
+    # Offset of the frame data, after the frame header
+    offset: int
+    size: int
+    timestamp: int
+    is_keyframe: bool
+
+
+def read_ivf_header(ivf: IO) -> IvfHeader:
+    ivf.seek(0)
+    return IvfHeader.from_bytes(ivf.read(0x20))
+
+
+def index_ivf_frames(
+    ivf: IO, header: IvfHeader
+) -> Generator[Tuple[IvfFrame, bytes], None, None]:
+    """Walks the frame headers of a seekable IVF file. Yields every frame
+    along with the first bytes of its data, enough for a VP9 keyframe's
+    uncompressed header."""
+    position = header.header_size
+    ivf.seek(position)
+    while True:
+        frame_header = ivf.read(IVF_FRAME_HEADER_SIZE + 0x10)
+        if len(frame_header) < IVF_FRAME_HEADER_SIZE:
+            break
+
+        size = int.from_bytes(frame_header[0:4], "little")
+        timestamp = int.from_bytes(frame_header[4:12], "little")
+        data = frame_header[IVF_FRAME_HEADER_SIZE : IVF_FRAME_HEADER_SIZE + size]
+
+        offset = position + IVF_FRAME_HEADER_SIZE
+        yield IvfFrame(offset, size, timestamp, vp9_is_keyframe(data)), data
+
+        position = offset + size
+        ivf.seek(position)
+
+
+def ivf_clip(
+    header: bytes,
+    frame_header: bytes,
+    packets: Iterable[bytes],
+    num_frames: int,
+    ends_stream: bool,
+) -> Generator[bytes, None, None]:
+    """Turns a range of frames of an IVF that was cut into packets at the start
+    of every frame's data, like the VP9 streams of USMs, into a standalone IVF.
+    Every packet holds a frame's data followed by the frame header of the next
+    frame, except for the last packet of the stream.
+
+    Args:
+        header: The IVF file header of the stream.
+        frame_header: The frame header of the first frame in the range.
+        packets: The packets of the range, without the file and frame header
+            the first packet of the stream starts with.
+        num_frames: The number of packets in the range.
+        ends_stream: Whether the range runs to the end of the stream, so
+            its last packet has no trailing frame header.
+
+    Raises:
+        ValueError: When a packet doesn't hold exactly one frame.
+    """
+    header = bytearray(header)
+    header[24:28] = num_frames.to_bytes(4, "little")
+    yield bytes(header)
+
+    # Timestamps are rebased to start at 0
+    size = int.from_bytes(frame_header[0:4], "little")
+    base = int.from_bytes(frame_header[4:12], "little")
+    yield _ivf_frame_header(size, 0)
+    for i, packet in enumerate(packets):
+        if i == num_frames - 1 and ends_stream:
+            if len(packet) != size:
+                raise ValueError(f"Packet {i} doesn't hold a whole ivf frame.")
+
+            yield packet
+            return
+
+        if len(packet) != size + IVF_FRAME_HEADER_SIZE:
+            raise ValueError(f"Packet {i} doesn't hold a whole ivf frame.")
+
+        yield packet[:size]
+        if i == num_frames - 1:
+            return
+
+        size = int.from_bytes(packet[size : size + 4], "little")
+        timestamp = int.from_bytes(packet[-8:], "little")
+        yield _ivf_frame_header(size, timestamp - base)
+
+
+def concat_ivf(paths: Sequence[str], output: IO, start_times: Sequence[float]) -> int:
+    """Joins IVF files of the same codec, size and timebase, e.g. segments of a
+    video that were encoded separately, into a seekable output file. The
+    timestamps of every file are rebased to start at its start time in
+    seconds, and the frame count in the file header is rewritten.
+
+    Returns the number of frames written.
+
+    Raises:
+        ValueError: When no files are given, a file ends inside a frame, or
+            the files don't match.
+    """
+    header: Optional[IvfHeader] = None
+    num_frames = 0
+    last_timestamp = -1
+    for path, start_time in zip(paths, start_times):
+        with open(path, "rb") as ivf:
+            data = ivf.read(0x20)
+            segment_header = IvfHeader.from_bytes(data)
+            if header is None:
+                header = segment_header
+                output.write(data + ivf.read(max(header.header_size - 0x20, 0)))
+            elif (
+                segment_header.fourcc != header.fourcc
+                or segment_header.width != header.width
+                or segment_header.height != header.height
+                or segment_header.timebase_denominator != header.timebase_denominator
+                or segment_header.timebase_numerator != header.timebase_numerator
+            ):
+                raise ValueError(f"{path} doesn't match the first ivf.")
+
+            base = round(
+                start_time * header.timebase_denominator / header.timebase_numerator
+            )
+            first_timestamp = None
+            ivf.seek(segment_header.header_size)
+            while True:
+                frame_header = ivf.read(IVF_FRAME_HEADER_SIZE)
+                if len(frame_header) < IVF_FRAME_HEADER_SIZE:
+                    break
+
+                size = int.from_bytes(frame_header[0:4], "little")
+                timestamp = int.from_bytes(frame_header[4:12], "little", signed=True)
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+
+                frame = ivf.read(size)
+                if len(frame) < size:
+                    raise ValueError(f"{path} ends inside a frame.")
+
+                # Timestamps can't go backwards across files
+                timestamp = max(base + timestamp - first_timestamp, last_timestamp + 1)
+                output.write(_ivf_frame_header(size, timestamp))
+                output.write(frame)
+                last_timestamp = timestamp
+                num_frames += 1
+
+    if header is None:
+        raise ValueError("No ivf files given.")
+
+    end = output.tell()
+    output.seek(24)
+    output.write(num_frames.to_bytes(4, "little"))
+    output.seek(end)
+    return num_frames
+
+
+def _ivf_frame_header(size: int, timestamp: int) -> bytes:
+    return size.to_bytes(4, "little") + timestamp.to_bytes(8, "little", signed=True)
+
+
+def _vp9_profile(reader: BitReader) -> int:
+    if reader.read(2) != 0b10:
+        raise ValueError("Invalid VP9 frame marker.")
+
+    profile = reader.read(1)
+    profile |= reader.read(1) << 1
+    if profile == 3:
+        reader.read(1)  # reserved_zero
+
+    return profile
+
+
+def vp9_is_keyframe(data: bytes) -> bool:
+    """Reads frame_type from a VP9 uncompressed header. The first frame of a
+    superframe decides for the whole packet, as in FFmpeg's VP9 parser."""
+    if len(data) == 0:
+        return False
+
+    reader = BitReader(data[:1])
+    try:
+        _vp9_profile(reader)
+    except ValueError:
+        return False
+
+    show_existing_frame = reader.read(1)
+    if show_existing_frame:
+        return False
+
+    return reader.read(1) == 0
+
+
+def vp9_frame_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Width and height from a VP9 keyframe's uncompressed header.
+    Returns None if data doesn't start with a keyframe."""
+    if not vp9_is_keyframe(data):
+        return None
+
+    reader = BitReader(data[:0x10])
+    try:
+        profile = _vp9_profile(reader)
+        reader.read(1)  # show_existing_frame
+        reader.read(1)  # frame_type
+        reader.read(1)  # show_frame
+        reader.read(1)  # error_resilient_mode
+        if reader.read(24) != 0x498342:
+            return None
+
+        # color_config
+        if profile >= 2:
+            reader.read(1)  # ten_or_twelve_bit
+        color_space = reader.read(3)
+        if color_space != 7:  # CS_RGB
+            reader.read(1)  # color_range
+            if profile in (1, 3):
+                reader.read(3)  # subsampling_x, subsampling_y, reserved_zero
+        elif profile in (1, 3):
+            reader.read(1)  # reserved_zero
+
+        width = reader.read(16) + 1
+        height = reader.read(16) + 1
+    except ValueError:
+        return None
+
+    return width, height
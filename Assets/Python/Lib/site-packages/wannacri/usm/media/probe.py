@@ -0,0 +1,223 @@
+"""Caches ffprobe results so a file is probed once however many times it is
+asked for, within a run and, with a cache folder, across runs. Also reads
+ffprobe's packet list as it is printed, for files too long to hold it
+as one JSON document."""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import ffmpeg
+
+from ..tables import PacketTable
+
+
+class ProbeCache:
+    """ffprobe results keyed on the file's absolute path, size and mtime and on
+    the ffprobe options, like show_entries. A changed file is probed again.
+
+    Results are kept in an in-process LRU of max_entries results. With a
+    folder, every result is also saved there as a JSON file, which is read
+    when the LRU misses."""
+
+    def __init__(self, max_entries: int = 64, folder: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.folder = folder
+        self._results: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, filename: str, cmd: Optional[str] = None, **kwargs) -> dict:
+        """Same as ffmpeg.probe, running ffprobe only on a cache miss. Returns
+        a copy of the cached result, which callers are free to change."""
+        key = _cache_key(filename, kwargs)
+        with self._lock:
+            info = self._results.get(key)
+            if info is not None:
+                self._results.move_to_end(key)
+                return copy.deepcopy(info)
+
+        info = self._load(key)
+        if info is None:
+            info = ffmpeg.probe(
+                filename, cmd="ffprobe" if cmd is None else cmd, **kwargs
+            )
+            self._save(key, info)
+
+        with self._lock:
+            self._results[key] = info
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+        return copy.deepcopy(info)
+
+    def clear(self) -> None:
+        """Drops the in-process results. The cache folder is kept."""
+        with self._lock:
+            self._results.clear()
+
+    def _path(self, key: str) -> Optional[str]:
+        if self.folder is None:
+            return None
+
+        return os.path.join(
+            self.folder, hashlib.sha1(key.encode("UTF-8")).hexdigest() + ".json"
+        )
+
+    def _load(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        if path is None or not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "r", encoding="UTF-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable probe cache entry", extra={"path": path})
+            return None
+
+        # Guards against hash collisions
+        if entry.get("key") != key:
+            return None
+
+        return entry.get("info")
+
+    def _save(self, key: str, info: dict) -> None:
+        path = self._path(key)
+        if path is None:
+            return
+
+        os.makedirs(self.folder, exist_ok=True)
+        # Written to a temporary file first so readers never see half an entry
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w", encoding="UTF-8") as f:
+                json.dump({"key": key, "info": info}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            logging.warning("Could not save probe cache entry", extra={"path": path})
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _cache_key(filename: str, options: dict) -> str:
+    stat = os.stat(filename)
+    return json.dumps(
+        [
+            os.path.abspath(filename),
+            stat.st_size,
+            stat.st_mtime_ns,
+            sorted((str(name), str(value)) for name, value in options.items()),
+        ]
+    )
+
+
+# Shared by ffprobe callers that aren't given a cache of their own
+probe_cache = ProbeCache()
+
+
+def probe(
+    filename: str,
+    cmd: Optional[str] = None,
+    cache: Optional[ProbeCache] = None,
+    **kwargs,
+) -> dict:
+    """ffmpeg.probe through cache, or the shared probe_cache by default."""
+    return (probe_cache if cache is None else cache).probe(filename, cmd, **kwargs)
+
+
+def parse_rate(value: Optional[str]) -> Optional[float]:
+    """Parses an ffprobe rational like 30000/1001. None when it's 0 or missing."""
+    if value is None or "/" not in value:
+        return None
+
+    numerator, denominator = value.split("/")
+    if int(numerator) == 0 or int(denominator) == 0:
+        return None
+
+    return int(numerator) / int(denominator)
+
+
+def probe_packets(
+    filename: str, cmd: Optional[str] = None, select_streams: str = "v:0"
+) -> Tuple[PacketTable, Dict[str, str]]:
+    """Reads the packets of a stream with ffprobe into a PacketTable as ffprobe
+    prints them, one compact line per packet, so memory stays flat however
+    long the file is and parsing overlaps ffprobe's work.
+
+    Offsets are the packets' byte positions in the file. Sizes are left at 0,
+    to be filled from the offsets. Timestamps are pts, or dts without one, in
+    ticks of the stream's time base, which sets the table's rate.
+
+    Returns the table and the stream's entries: time_base, width, height,
+    avg_frame_rate and r_frame_rate. Not cached, since the packet lists
+    this is for are too large to keep.
+
+    Raises:
+        ffmpeg.Error: When ffprobe fails, like ffmpeg.probe.
+        ValueError: When a packet has no byte position.
+    """
+    args = [
+        "ffprobe" if cmd is None else cmd,
+        "-v",
+        "error",
+        "-select_streams",
+        select_streams,
+        "-show_entries",
+        "packet=pts,dts,pos,flags:stream=time_base,width,height,avg_frame_rate,r_frame_rate",
+        "-of",
+        "compact",
+        filename,
+    ]
+    packets = PacketTable()
+    stream: Dict[str, str] = {}
+    # stderr goes to a file, since a pipe could fill up with one error per
+    # damaged packet and stall ffprobe while only stdout is read
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            for line in process.stdout:
+                line = line.decode("UTF-8", errors="replace").strip()
+                section, _, entries = line.partition("|")
+                fields = dict(
+                    entry.split("=", 1) for entry in entries.split("|") if "=" in entry
+                )
+                if section == "stream":
+                    stream = fields
+                elif section == "packet":
+                    position = fields.get("pos", "N/A")
+                    if position == "N/A":
+                        raise ValueError(f"Packet {len(packets)} has no byte position.")
+
+                    timestamp = fields.get("pts", "N/A")
+                    if timestamp == "N/A":
+                        timestamp = fields.get("dts", "N/A")
+
+                    packets.append(
+                        int(position),
+                        0,
+                        0 if timestamp == "N/A" else int(timestamp),
+                        "K" in fields.get("flags", ""),
+                    )
+        except BaseException:
+            process.kill()
+            process.communicate()
+            raise
+
+        process.communicate()
+        if process.returncode != 0:
+            errors.seek(0)
+            raise ffmpeg.Error("ffprobe", b"", errors.read())
+
+    time_base = stream.get("time_base", "0/1").split("/")
+    if len(time_base) == 2 and int(time_base[0]) != 0:
+        packets.rate = int(time_base[1]) / int(time_base[0])
+
+    return packets, stream
@@ -1,14 +1,23 @@
-from typing import Optional, Generator, Tuple, List, Protocol
+import itertools
+from bisect import bisect_left, bisect_right
+from typing import Optional, Generator, Tuple, List, Protocol, Sequence
 
 from wannacri.usm.types import ChunkType, PayloadType, OpMode
 from wannacri.usm.page import UsmPage, ElementType
 from wannacri.usm.usm import UsmChunk
+from wannacri.usm.tables import PacketTable
+from wannacri.usm.media.adx import AdxHeader
+from wannacri.usm.media.annexb import NAL_PPS, NAL_SPS, nal_units
+from wannacri.usm.media.hca import HCA_SAMPLES_PER_FRAME, HcaHeader
+from wannacri.usm.media.ivf import IVF_FRAME_HEADER_SIZE, IVF_SIGNATURE, ivf_clip
+from wannacri.usm.media.tools import audio_header
 from wannacri.usm.tools import (
     encrypt_video_packet,
     decrypt_video_packet,
     slugify,
     encrypt_audio_packet,
     decrypt_audio_packet,
+    PacketReader,
 )
 
 
@@ -26,6 +35,12 @@ class UsmMedia(Protocol):
     _length: int
     _channel_number: int
     _metadata_pages: Optional[List[UsmPage]]
+    # Optional. Set when packets are known before streaming,
+    # which lets Usm lay out the whole file in a single pass.
+    _packets: Optional[PacketTable] = None
+    # Optional. A reader of the source the packet table points into,
+    # which lets packets be read at random with the packets method.
+    _reader: Optional[PacketReader] = None
 
     @property
     def crid_page(self) -> UsmPage:
@@ -48,6 +63,21 @@ class UsmMedia(Protocol):
 
         self._metadata_pages = pages
 
+    @property
+    def packet_table(self) -> Optional[PacketTable]:
+        """Offset, size, timestamp and keyframe flag of every packet in the
+        source, or None when they are only known after streaming."""
+        return self._packets
+
+    @property
+    def packet_sizes(self) -> Optional[Sequence[int]]:
+        """The size of every packet in stream order, or None when
+        they are only known after streaming."""
+        if self._packets is None:
+            return None
+
+        return self._packets.sizes
+
     @property
     def channel_number(self) -> int:
         return self._channel_number
@@ -85,6 +115,57 @@ class UsmMedia(Protocol):
         self.crid_page["filename"].type = ElementType.STRING
         self.crid_page["filename"].val = new_filename
 
+    def time_of(self, index: int) -> float:
+        """The time in seconds of the packet at index, see packet_times.
+        An index of len(self) gives the end time of the last packet, assuming
+        it lasts as long as the one before it."""
+        timestamps, rate = self.packet_times()
+        if index >= len(timestamps):
+            # One packet after the last one
+            if len(timestamps) < 2:
+                return 0.0
+            last = timestamps[-1]
+            return (2 * last - timestamps[-2]) / rate
+
+        return timestamps[index] / rate
+
+    def packet_range(self, start_time: float, end_time: float) -> Tuple[int, int]:
+        """The indexes of the first packet and the one after the last packet
+        that cover the time span from start_time to end_time in seconds."""
+        timestamps, rate = self.packet_times()
+        # Rounded so times from time_of land back on their own packet
+        start = bisect_right(timestamps, round(start_time * rate, 6)) - 1
+        end = bisect_left(timestamps, round(end_time * rate, 6))
+        return max(start, 0), min(end, len(timestamps))
+
+    def packet_times(self) -> Tuple[Sequence[int], float]:
+        """The timestamp of every packet and the timestamps per second.
+        By default these are the packet table's.
+
+        Raises:
+            ValueError: When packet times are unknown.
+        """
+        table = self._packets
+        if table is None or table.rate <= 0:
+            raise ValueError("Packet times are unknown.")
+
+        return table.timestamps, table.rate
+
+    def _read_packets(
+        self, start: int, end: Optional[int]
+    ) -> Generator[Tuple[bytes, int], None, None]:
+        table, reader = self._packets, self._reader
+        if table is None or reader is None:
+            raise ValueError("Packets can't be read at random from this source.")
+
+        end = len(table) if end is None else min(end, len(table))
+        if start < 0 or start > end:
+            raise ValueError(f"Invalid packet range {start} to {end}.")
+
+        for index in range(start, end):
+            offset, size = table[index]
+            yield reader.read(offset, size), index
+
     def __len__(self) -> int:
         """The number of packets a Usm videos or audios has."""
         return self._length
@@ -108,6 +189,119 @@ class UsmVideo(UsmMedia, Protocol):
     _stream: Generator[Tuple[bytes, bool], None, None]
     is_alpha: bool
 
+    @property
+    def keyframes(self) -> Optional[Sequence[int]]:
+        """The packet indexes of keyframes, or None when they are
+        only known after streaming."""
+        if self._packets is None:
+            return None
+
+        return self._packets.keyframes
+
+    @property
+    def framerate(self) -> float:
+        """Frames per second from the header page. Defaults to 30."""
+        framerate_n = self.header_page.get("framerate_n")
+        framerate_d = self.header_page.get("framerate_d")
+        if framerate_n is not None and framerate_d is not None:
+            return int(framerate_n.val) / int(framerate_d.val)
+
+        return 30
+
+    def packet_times(self) -> Tuple[Sequence[int], float]:
+        """Frame indexes at the frame rate. Usm videos play at a constant
+        frame rate, which chunk header times only approximate."""
+        return range(len(self)), self.framerate
+
+    def keyframe_before(self, frame: int) -> int:
+        """The index of the nearest keyframe at or before frame."""
+        keyframes = self.keyframes
+        if keyframes is None or len(keyframes) == 0:
+            raise ValueError("Video has no known keyframes.")
+
+        index = bisect_right(keyframes, frame) - 1
+        return keyframes[max(index, 0)]
+
+    def packets(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        mode: OpMode = OpMode.NONE,
+        key: Optional[bytes] = None,
+    ) -> Generator[Tuple[bytes, bool], None, None]:
+        """Like stream, but reads only the packets from index start up to,
+        not including, end straight from the source. Can be called any number
+        of times. Only available when the packet table and a reader of its
+        source are known, like for videos of a Usm loaded with Usm.open.
+
+        Decoding has to begin at a keyframe; see keyframe_before.
+
+        Raises:
+            ValueError: When the packets can't be read at random, when
+                the range is invalid, or when key is not supplied when
+                mode is set to encrypt or decrypt.
+        """
+        if mode is not OpMode.NONE and key is None:
+            raise ValueError("No keys given for encrypt or decrypt mode.")
+
+        table = self._packets
+        for packet, index in self._read_packets(start, end):
+            yield _crypt_video(packet, mode, key), table.is_keyframe(index)
+
+    def clip(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        mode: OpMode = OpMode.NONE,
+        key: Optional[bytes] = None,
+    ) -> Generator[bytes, None, None]:
+        """Reads the packets from start up to, not including, end as a
+        standalone video file. start should be a keyframe. VP9 packets get
+        an ivf header with timestamps rebased to the first frame, and H.264
+        packets get the SPS and PPS from the start of the stream when their
+        first access unit has none. Other codecs are read as they are.
+        Takes the same arguments and raises the same errors as packets."""
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            yield from self.packets(start, end, mode, key)
+            return
+
+        stream_start = bytes(next(self.packets(0, 1, mode, key))[0])
+        mpeg_codec = self.header_page.get("mpeg_codec")
+        if stream_start[:4] == IVF_SIGNATURE:
+            header_size = int.from_bytes(stream_start[6:8], "little")
+            frames_start = header_size + IVF_FRAME_HEADER_SIZE
+            if start == 0:
+                frame_header = stream_start[header_size:frames_start]
+                packets = itertools.chain(
+                    [stream_start[frames_start:]],
+                    (packet for packet, _ in self.packets(1, end, mode, key)),
+                )
+            else:
+                previous, _ = next(self.packets(start - 1, start, mode, key))
+                frame_header = bytes(previous[-IVF_FRAME_HEADER_SIZE:])
+                packets = (packet for packet, _ in self.packets(start, end, mode, key))
+
+            yield from ivf_clip(
+                stream_start[:header_size],
+                frame_header,
+                packets,
+                end - start,
+                end == len(self),
+            )
+        elif mpeg_codec is not None and mpeg_codec.val == 5:  # H.264
+            packets = self.packets(start, end, mode, key)
+            packet, _ = next(packets)
+            if all(nal_type != NAL_SPS for nal_type, _ in nal_units(packet)):
+                for nal_type, nal in nal_units(stream_start):
+                    if nal_type in (NAL_SPS, NAL_PPS):
+                        yield nal
+
+            yield packet
+            yield from (packet for packet, _ in packets)
+        else:
+            yield from (packet for packet, _ in self.packets(start, end, mode, key))
+
     def stream(
         self, mode: OpMode = OpMode.NONE, key: Optional[bytes] = None
     ) -> Generator[Tuple[bytes, bool], None, None]:
@@ -132,16 +326,7 @@ class UsmVideo(UsmMedia, Protocol):
             raise ValueError("No keys given for encrypt or decrypt mode.")
 
         for packet, is_keyframe in self._stream:
-            if mode is OpMode.NONE:
-                payload = packet
-            elif mode is OpMode.ENCRYPT:
-                payload = encrypt_video_packet(packet, key)
-            elif mode is OpMode.DECRYPT:
-                payload = decrypt_video_packet(packet, key)
-            else:
-                raise ValueError(f"Unknown mode {mode}.")
-
-            yield payload, is_keyframe
+            yield _crypt_video(packet, mode, key), is_keyframe
 
     def chunks(
         self, mode: OpMode.NONE, key: Optional[bytes] = None
@@ -170,13 +355,7 @@ class UsmVideo(UsmMedia, Protocol):
         if mode is not OpMode.NONE and key is None:
             raise ValueError("Key is required for encryption/decryption.")
 
-        framerate_n = self.header_page.get("framerate_n")
-        framerate_d = self.header_page.get("framerate_d")
-        if framerate_n is not None and framerate_d is not None:
-            framerate = int(framerate_n.val) / int(framerate_d.val)
-        else:
-            framerate = 30
-
+        framerate = self.framerate
         for i, (payload, is_keyframe) in enumerate(self.stream(mode, key)):
             frame_time = int(i * 99.9)
 
@@ -234,6 +413,41 @@ class UsmAudio(UsmMedia, Protocol):
     # Classes that explicitly inherit UsmAudio should have this attribute
     # to use the default stream and chunks methods.
     _stream: Generator[bytes, None, None]
+    # Cache of packet_times
+    _sample_times: Optional[Tuple[Sequence[int], float]] = None
+
+    def packet_times(self) -> Tuple[Sequence[int], float]:
+        """Packet starts in samples at the sampling rate. When packets can be
+        read at random, these are counted from the ADX or HCA header and the
+        packet sizes, since chunk header times are only as exact as the muxer
+        that wrote them. Otherwise, or for other codecs, the packet table's."""
+        if self._sample_times is None:
+            times = None
+            if self._packets is not None and self._reader is not None:
+                first_packet, _ = next(self._read_packets(0, 1), (b"", 0))
+                times = _sample_times(self._packets.sizes, bytes(first_packet))
+
+            self._sample_times = super().packet_times() if times is None else times
+
+        return self._sample_times
+
+    def clip(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        mode: OpMode = OpMode.NONE,
+        key: Optional[bytes] = None,
+    ) -> Generator[bytes, None, None]:
+        """Reads the packets from start up to, not including, end as a
+        standalone audio file. Unless start is 0, the packets are preceded
+        by the ADX or HCA header from the start of the stream, if any.
+        Takes the same arguments and raises the same errors as packets."""
+        if start > 0:
+            header = audio_header(bytes(next(self.packets(0, 1, mode, key))))
+            if header is not None:
+                yield header
+
+        yield from self.packets(start, end, mode, key)
 
     def stream(
         self, mode: OpMode = OpMode.NONE, key: Optional[bytes] = None
@@ -258,16 +472,30 @@ class UsmAudio(UsmMedia, Protocol):
             raise RuntimeError("No keys given for encrypt or decrypt mode.")
 
         for packet in self._stream:
-            if mode is OpMode.NONE:
-                payload = packet
-            elif mode is OpMode.ENCRYPT:
-                payload = encrypt_audio_packet(packet, key)
-            elif mode is OpMode.DECRYPT:
-                payload = decrypt_audio_packet(packet, key)
-            else:
-                raise ValueError(f"Unknown mode: {mode}.")
+            yield _crypt_audio(packet, mode, key)
+
+    def packets(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        mode: OpMode = OpMode.NONE,
+        key: Optional[bytes] = None,
+    ) -> Generator[bytes, None, None]:
+        """Like stream, but reads only the packets from index start up to,
+        not including, end straight from the source. Can be called any number
+        of times. Only available when the packet table and a reader of its
+        source are known, like for audios of a Usm loaded with Usm.open.
+
+        Raises:
+            ValueError: When the packets can't be read at random, when
+                the range is invalid, or when key is not supplied when
+                mode is set to encrypt or decrypt.
+        """
+        if mode is not OpMode.NONE and key is None:
+            raise ValueError("No keys given for encrypt or decrypt mode.")
 
-            yield payload
+        for packet, _ in self._read_packets(start, end):
+            yield _crypt_audio(packet, mode, key)
 
     def chunks(
         self, mode: OpMode = OpMode.NONE, key: Optional[bytes] = None
@@ -295,8 +523,17 @@ class UsmAudio(UsmMedia, Protocol):
         if mode in ["encrypt", "decrypt"] and key is None:
             raise ValueError("No key given for encrypt or decrypt mode")
 
+        # Packets hold any number of samples, so their times come from the
+        # packet table when it has them, in the 1/3000 s of audio chunks
+        table = self._packets
+        if table is None or table.rate <= 0 or len(table) != self._length:
+            table = None
+
         for i, payload in enumerate(self.stream(mode, key)):
-            frame_time = int(i * 99.9)
+            if table is None:
+                frame_time = int(i * 99.9)
+            else:
+                frame_time = round(table.timestamps[i] * 3000 / table.rate)
 
             padding_size = (
                 0x20 - (len(payload) % 0x20) if len(payload) % 0x20 != 0 else 0
@@ -335,3 +572,56 @@ class UsmAudio(UsmMedia, Protocol):
                         channel_number=self.channel_number,
                     ),
                 ]
+
+
+def _sample_times(
+    sizes: Sequence[int], first_packet: bytes
+) -> Optional[Tuple[List[int], int]]:
+    """The first sample of every packet of an ADX or HCA stream and the
+    sampling rate, from the header at the start of first_packet. None
+    when first_packet doesn't start with a readable header."""
+    header = audio_header(first_packet)
+    if header is None:
+        return None
+
+    try:
+        if header[0] == 0x80:
+            adx = AdxHeader.from_bytes(header)
+            data_offset, frame_size = adx.data_offset, adx.frame_size
+            samples_per_frame, sampling_rate = adx.samples_per_frame, adx.sampling_rate
+        else:
+            hca = HcaHeader.from_bytes(header)
+            data_offset, frame_size = hca.data_offset, hca.block_size
+            samples_per_frame, sampling_rate = HCA_SAMPLES_PER_FRAME, hca.sampling_rate
+    except ValueError:
+        return None
+
+    times = []
+    position = 0
+    for size in sizes:
+        times.append(max(position - data_offset, 0) // frame_size * samples_per_frame)
+        position += size
+
+    return times, sampling_rate
+
+
+def _crypt_video(packet: bytes, mode: OpMode, key: Optional[bytes]) -> bytes:
+    if mode is OpMode.NONE:
+        return packet
+    elif mode is OpMode.ENCRYPT:
+        return encrypt_video_packet(packet, key)
+    elif mode is OpMode.DECRYPT:
+        return decrypt_video_packet(packet, key)
+    else:
+        raise ValueError(f"Unknown mode {mode}.")
+
+
+def _crypt_audio(packet: bytes, mode: OpMode, key: Optional[bytes]) -> bytes:
+    if mode is OpMode.NONE:
+        return packet
+    elif mode is OpMode.ENCRYPT:
+        return encrypt_audio_packet(packet, key)
+    elif mode is OpMode.DECRYPT:
+        return decrypt_audio_packet(packet, key)
+    else:
+        raise ValueError(f"Unknown mode: {mode}.")
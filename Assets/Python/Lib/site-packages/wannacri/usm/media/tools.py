@@ -1,9 +1,39 @@
-from typing import List
+from typing import List, Optional
 
 from ..page import UsmPage
 from ..types import ElementType
 
 
+class BitReader:
+    """MSB-first bit reader for codec headers."""
+
+    def __init__(self, data: bytes):
+        self._value = int.from_bytes(data, "big")
+        self._bits = len(data) * 8
+        self.position = 0
+
+    def read(self, num_bits: int) -> int:
+        if self.position + num_bits > self._bits:
+            raise ValueError("Read past the end of the data.")
+
+        self.position += num_bits
+        shift = self._bits - self.position
+        return (self._value >> shift) & ((1 << num_bits) - 1)
+
+    def read_ue(self) -> int:
+        """Unsigned Exp-Golomb code."""
+        leading_zeros = 0
+        while self.read(1) == 0:
+            leading_zeros += 1
+
+        return (1 << leading_zeros) - 1 + self.read(leading_zeros)
+
+    def read_se(self) -> int:
+        """Signed Exp-Golomb code."""
+        value = self.read_ue()
+        return (value + 1) // 2 if value % 2 else -(value // 2)
+
+
 def create_video_crid_page(
     filename: str,
     filesize: int,
@@ -58,3 +88,60 @@ def create_video_header_page(
     header.update("color_space", ElementType.INT, 0)
     header.update("picture_type", ElementType.INT, 0)
     return header
+
+
+def create_audio_crid_page(
+    filename: str,
+    filesize: int,
+    max_size: int,
+    format_version: int,
+    channel_number: int,
+    bitrate: int,
+) -> UsmPage:
+    crid = UsmPage("CRIUSF_DIR_STREAM")
+    crid.update("fmtver", ElementType.INT, format_version)
+    crid.update("filename", ElementType.STRING, filename)
+    crid.update("filesize", ElementType.INT, filesize)
+    crid.update("datasize", ElementType.INT, 0)
+    crid.update("stmid", ElementType.INT, 1079199297)  # @SFA
+    crid.update("chno", ElementType.SHORT, channel_number)
+    crid.update("minchk", ElementType.SHORT, 1)
+    crid.update("minbuf", ElementType.INT, max_size)
+    crid.update("avbps", ElementType.INT, bitrate)
+    return crid
+
+
+def create_audio_header_page(
+    audio_codec: int,
+    sampling_rate: int,
+    num_channels: int,
+    total_samples: int,
+    max_packed_size: int,
+) -> UsmPage:
+    header = UsmPage("AUDIO_HDRINFO")
+    header.update("audio_codec", ElementType.UCHAR, audio_codec)
+    header.update("sampling_rate", ElementType.INT, sampling_rate)
+    header.update("total_samples", ElementType.INT, total_samples)
+    header.update("num_channels", ElementType.UCHAR, num_channels)
+    header.update("metadata_count", ElementType.INT, 0)
+    header.update("metadata_size", ElementType.INT, 0)
+    header.update("ixsize", ElementType.INT, max_packed_size)
+    header.update("ambisonics", ElementType.INT, 0)
+    return header
+
+
+def audio_header(packet: bytes) -> Optional[bytes]:
+    """The ADX or HCA header at the start of an audio stream's first packet,
+    or None when the packet doesn't start with one."""
+    if len(packet) >= 4 and packet[0] == 0x80 and packet[1] == 0x00:
+        # ADX: the header size is counted from after the first four bytes
+        size = int.from_bytes(packet[2:4], "big") + 4
+        if len(packet) >= size and packet[size - 6 : size] == b"(c)CRI":
+            return bytes(packet[:size])
+    elif len(packet) >= 8 and bytes(b & 0x7F for b in packet[:4]) == b"HCA\x00":
+        # HCA: signature bytes may have their high bit set when encrypted
+        size = int.from_bytes(packet[6:8], "big")
+        if len(packet) >= size:
+            return bytes(packet[:size])
+
+    return None
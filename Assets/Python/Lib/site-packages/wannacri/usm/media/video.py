@@ -1,11 +1,25 @@
-import os
-from typing import Generator, Tuple, Optional, List
+from __future__ import annotations
 
-import ffmpeg
+import os
+import warnings
+from typing import IO, Generator, Tuple, Optional, List, Sequence
 
 from .tools import create_video_crid_page, create_video_header_page
+from .ivf import (
+    IvfHeader,
+    IVF_FRAME_HEADER_SIZE,
+    VP9_FOURCC,
+    index_ivf_frames,
+    read_ivf_header,
+    vp9_frame_size,
+    vp9_is_keyframe,
+)
+from .annexb import index_access_units
+from .probe import ProbeCache, parse_rate, probe, probe_packets
 from .protocols import UsmVideo
 from ..page import UsmPage
+from ..tables import PacketTable
+from ..tools import PacketReader
 
 
 class GenericVideo(UsmVideo):
@@ -22,6 +36,8 @@ class GenericVideo(UsmVideo):
         channel_number: int = 0,
         metadata_pages: Optional[List[UsmPage]] = None,
         is_alpha: bool = False,
+        packets: Optional[PacketTable] = None,
+        reader: Optional[PacketReader] = None,
     ):
         self._stream = stream
         self._crid_page = crid_page
@@ -30,6 +46,8 @@ class GenericVideo(UsmVideo):
         self._channel_number = channel_number
         self._metadata_pages = metadata_pages
         self.is_alpha = is_alpha
+        self._packets = packets
+        self._reader = reader
 
 
 class Vp9(UsmVideo):
@@ -40,82 +58,246 @@ class Vp9(UsmVideo):
         format_version: int = 16777984,
         ffprobe_path: Optional[str] = None,
     ):
-        if ffprobe_path is None:
-            info = ffmpeg.probe(filepath, show_entries="packet=dts,pts_time,pos,flags")
-        else:
-            info = ffmpeg.probe(
-                filepath,
-                cmd=ffprobe_path,
-                show_entries="packet=dts,pts_time,pos,flags",
+        """Indexes a VP9 ivf file by reading its frame headers directly.
+        ffprobe_path is deprecated and ignored, since ffprobe isn't needed."""
+        if ffprobe_path is not None:
+            warnings.warn(
+                "Vp9's ffprobe_path is deprecated and ignored.",
+                DeprecationWarning,
+                stacklevel=2,
             )
 
-        if len(info.get("streams")) == 0:
-            raise ValueError("File has no videos streams.")
-        if info.get("format").get("format_name") != "ivf":
-            raise ValueError("File is not an ivf.")
-        if info.get("streams")[0].get("codec_name") != "vp9":
-            raise ValueError("File is not a VP9 videos.")
-
         filesize = os.path.getsize(filepath)
         filename = os.path.basename(filepath)
 
-        video_stream = info.get("streams")[0]
-        framerate = int(video_stream.get("r_frame_rate").split("/")[0]) / int(
-            video_stream.get("r_frame_rate").split("/")[1]
-        )
+        with open(filepath, "rb") as ivf:
+            ivf_header = read_ivf_header(ivf)
+            if ivf_header.fourcc != VP9_FOURCC:
+                raise ValueError("File is not a VP9 videos.")
 
-        frames = info.get("packets")
-        keyframes = [kf.get("dts") for kf in frames if "K" in kf.get("flags")]
-        max_size = 0
-        sizes = []
-        for i, frame in enumerate(frames):
-            frame_offset = int(frame.get("pos"))
-            if i == len(frames) - 1:
-                frame_size = filesize - frame_offset
-            elif i == 0:
-                frame_size = int(frames[i + 1].get("pos"))
-            else:
-                frame_size = int(frames[i + 1].get("pos")) - frame_offset
-
-            max_size = max(max_size, frame_size)
-            sizes.append(frame_size)
+            # Packets are cut at the start of every frame's data like FFmpeg's
+            # packet positions. So the first packet holds the ivf header and
+            # every packet ends with the frame header of the next one.
+            packets = PacketTable(
+                rate=ivf_header.timebase_denominator / ivf_header.timebase_numerator
+            )
+            dimensions = None
+            for frame, data in index_ivf_frames(ivf, ivf_header):
+                if dimensions is None and frame.is_keyframe:
+                    dimensions = vp9_frame_size(data)
 
-        max_padding_size = 0x20 - (max_size % 0x20) if max_size % 0x20 != 0 else 0
-        max_packed_size = 0x18 + max_size + max_padding_size
+                offset = 0 if len(packets) == 0 else frame.offset
+                packets.append(offset, 0, frame.timestamp, frame.is_keyframe)
 
-        self._crid_page = create_video_crid_page(
-            filename=filename,
-            filesize=filesize,
-            max_size=max_size,
-            format_version=format_version,
-            channel_number=channel_number,
-            bitrate=int(info.get("format").get("bit_rate")),
+        if len(packets) == 0:
+            raise ValueError("File has no videos streams.")
+
+        packets.fill_sizes(filesize)
+
+        self._crid_page, self._header_page = _vp9_pages(
+            filename,
+            filesize,
+            ivf_header,
+            packets,
+            dimensions,
+            format_version,
+            channel_number,
         )
+        self._stream = _packet_gen(filepath, packets)
+        self._length = len(packets)
+        self._channel_number = channel_number
+        self._metadata_pages = None
+        self._packets = packets
 
-        self._header_page = create_video_header_page(
-            num_frames=len(frames),
-            num_keyframes=len(keyframes),
-            framerate=framerate,
-            max_packed_size=max_packed_size,
-            mpeg_codec=9,  # Value for VP9 USMs
-            mpeg_dcprec=0,  # Value for VP9 USMs
-            ffprobe_video_stream=video_stream,
+    @classmethod
+    def from_stream(
+        cls,
+        source: IO,
+        filename: str,
+        channel_number: int = 0,
+        format_version: int = 16777984,
+    ) -> Vp9:
+        """Reads a VP9 ivf from a file object that doesn't need to be seekable,
+        e.g. the stdout of an encoder, frame by frame as its packets are consumed.
+
+        Only the ivf header is read here. The length, the packet table and the
+        crid and header pages are filled in once the last packet is read, so
+        Usm.write has to be used to pack it. filename is the name stored in the
+        crid page."""
+        header = _read_exactly(source, 0x20)
+        ivf_header = IvfHeader.from_bytes(header)
+        if ivf_header.fourcc != VP9_FOURCC:
+            raise ValueError("Stream is not a VP9 videos.")
+
+        if ivf_header.header_size > 0x20:
+            header += _read_exactly(source, ivf_header.header_size - 0x20)
+
+        video = cls.__new__(cls)
+        video._crid_page, video._header_page = _vp9_pages(
+            filename,
+            0,
+            ivf_header,
+            PacketTable(
+                rate=ivf_header.timebase_denominator / ivf_header.timebase_numerator
+            ),
+            None,
+            format_version,
+            channel_number,
+        )
+        video._stream = _ivf_stream_gen(
+            video, source, header, ivf_header, format_version
         )
+        video._length = 0
+        video._channel_number = channel_number
+        video._metadata_pages = None
+        video._packets = None
+        return video
 
-        def packet_gen(
-            path: str, packet_sizes: List[int], keyframe_indexes: List[int]
-        ) -> Generator[Tuple[bytes, bool], None, None]:
-            video = open(path, "rb")
-            for index, size in enumerate(packet_sizes):
-                is_keyframe = index in keyframe_indexes
-                yield video.read(size), is_keyframe
 
-            video.close()
+def _vp9_pages(
+    filename: str,
+    filesize: int,
+    ivf_header: IvfHeader,
+    packets: PacketTable,
+    dimensions: Optional[Tuple[int, int]],
+    format_version: int,
+    channel_number: int,
+) -> Tuple[UsmPage, UsmPage]:
+    """Crid and header pages of a VP9 video. An empty packet table gives
+    pages with the right layout but placeholder counts and sizes."""
+    if dimensions is None:
+        width, height = ivf_header.width, ivf_header.height
+    else:
+        width, height = dimensions
+
+    framerate = _ivf_framerate(ivf_header, packets.timestamps)
+    num_frames = len(packets)
+    max_size = max(packets.sizes, default=0)
+    max_padding_size = 0x20 - (max_size % 0x20) if max_size % 0x20 != 0 else 0
+    max_packed_size = 0x18 + max_size + max_padding_size
+
+    crid_page = create_video_crid_page(
+        filename=filename,
+        filesize=filesize,
+        max_size=max_size,
+        format_version=format_version,
+        channel_number=channel_number,
+        bitrate=int(filesize * 8 * framerate / max(num_frames, 1)),
+    )
+
+    header_page = create_video_header_page(
+        num_frames=num_frames,
+        num_keyframes=len(packets.keyframes),
+        framerate=framerate,
+        max_packed_size=max_packed_size,
+        mpeg_codec=9,  # Value for VP9 USMs
+        mpeg_dcprec=0,  # Value for VP9 USMs
+        ffprobe_video_stream={"width": width, "height": height},
+    )
+    return crid_page, header_page
+
+
+def _read_exactly(source: IO, size: int) -> bytes:
+    """Reads size bytes from a file object that may return less per read,
+    like a pipe. Returns fewer bytes only at the end of the stream."""
+    result = bytearray()
+    while len(result) < size:
+        data = source.read(size - len(result))
+        if not data:
+            break
+        result += data
+
+    return bytes(result)
+
+
+def _ivf_stream_gen(
+    video: Vp9,
+    source: IO,
+    header: bytes,
+    ivf_header: IvfHeader,
+    format_version: int,
+) -> Generator[Tuple[bytes, bool], None, None]:
+    """Cuts the frames of an ivf stream into packets like Vp9 does for files.
+    A packet is yielded once the frame header after it has been read, so the
+    video's length is set just before its last packet. The pages and packet
+    table are set after it."""
+    packets = PacketTable(
+        rate=ivf_header.timebase_denominator / ivf_header.timebase_numerator
+    )
+    dimensions = None
+    position = len(header)
+    frame_header = _read_exactly(source, IVF_FRAME_HEADER_SIZE)
+    if len(frame_header) < IVF_FRAME_HEADER_SIZE:
+        raise ValueError("Stream has no videos frames.")
+
+    while True:
+        size = int.from_bytes(frame_header[0:4], "little")
+        timestamp = int.from_bytes(frame_header[4:12], "little")
+        data = _read_exactly(source, size)
+        if len(data) < size:
+            raise ValueError(f"Stream ends inside frame {len(packets)}.")
+
+        offset = 0 if len(packets) == 0 else position + IVF_FRAME_HEADER_SIZE
+        position += IVF_FRAME_HEADER_SIZE + size
+        next_header = _read_exactly(source, IVF_FRAME_HEADER_SIZE)
+        if 0 < len(next_header) < IVF_FRAME_HEADER_SIZE:
+            raise ValueError(
+                f"Stream ends inside the header of frame {len(packets) + 1}."
+            )
+
+        is_keyframe = vp9_is_keyframe(data[:0x10])
+        if dimensions is None and is_keyframe:
+            dimensions = vp9_frame_size(data[:0x10])
+
+        if len(packets) == 0:
+            packet = header + frame_header + data + next_header
+        else:
+            packet = data + next_header
+
+        packets.append(offset, len(packet), timestamp, is_keyframe)
+        if len(next_header) == 0:
+            video._length = len(packets)
+            yield packet, is_keyframe
+            break
+
+        yield packet, is_keyframe
+        frame_header = next_header
+
+    video._crid_page, video._header_page = _vp9_pages(
+        video.crid_page.get("filename").val,
+        position,
+        ivf_header,
+        packets,
+        dimensions,
+        format_version,
+        video.channel_number,
+    )
+    video._packets = packets
+
+
+def _packet_gen(
+    path: str, packets: PacketTable
+) -> Generator[Tuple[bytes, bool], None, None]:
+    with open(path, "rb") as video:
+        for index, (offset, size) in enumerate(packets):
+            video.seek(offset)
+            yield video.read(size), packets.is_keyframe(index)
+
+
+def _ivf_framerate(header: IvfHeader, timestamps: Sequence[int]) -> float:
+    """Frame rate from the frame timestamps, falling back to the ivf timebase."""
+    timebase = header.timebase_numerator / header.timebase_denominator
+    if len(timestamps) < 2 or timestamps[-1] <= timestamps[0]:
+        return 1 / timebase
+
+    deltas = {timestamps[i + 1] - timestamps[i] for i in range(len(timestamps) - 1)}
+    if len(deltas) == 1:
+        return 1 / (timebase * deltas.pop())
+
+    # Rounded timestamps, e.g. 30000/1001 fps in a 1/1000 timebase
+    duration = (timestamps[-1] - timestamps[0]) * timebase
+    return (len(timestamps) - 1) / duration
 
-        self._stream = packet_gen(filepath, sizes, keyframes)
-        self._length = len(frames)
-        self._channel_number = channel_number
-        self._metadata_pages = None
 
 class H264(UsmVideo):
     def __init__(
@@ -124,46 +306,55 @@ class H264(UsmVideo):
         channel_number: int = 0,
         format_version: int = 0,
         ffprobe_path: Optional[str] = None,
+        framerate: Optional[float] = None,
+        probe_cache: Optional[ProbeCache] = None,
     ):
-        if ffprobe_path is None:
-            info = ffmpeg.probe(filepath, show_entries="packet=dts,pts_time,pos,flags")
-        else:
-            info = ffmpeg.probe(
-                filepath,
-                cmd=ffprobe_path,
-                show_entries="packet=dts,pts_time,pos,flags",
-            )
-
-        if len(info.get("streams")) == 0:
-            raise ValueError("File has no videos streams.")
-        if info.get("format").get("format_name") != "h264" :
-            raise ValueError("File is not a raw H.264 video stream.")
-        if info.get("streams")[0].get("codec_name") != "h264":
-            raise ValueError("File is not a valid H.264 stream.")
+        """Indexes a raw H.264 (Annex B) stream by scanning its NAL units.
+        The frame rate is taken from the SPS VUI timing info. If the SPS has
+        none and no framerate is given, it is asked from ffprobe, through
+        probe_cache if given.
 
+        Streams whose SPS the scan can't read are indexed from ffprobe's
+        packets instead, read as ffprobe prints them."""
         filesize = os.path.getsize(filepath)
         filename = os.path.basename(filepath)
 
-        video_stream = info.get("streams")[0]
-        framerate = int(video_stream.get("r_frame_rate").split("/")[0]) / int(
-            video_stream.get("r_frame_rate").split("/")[1]
-        )
+        with open(filepath, "rb") as video:
+            access_units, sps = index_access_units(video)
+
+        if len(access_units) > 0 and sps is not None:
+            units = [(unit.offset, unit.is_keyframe) for unit in access_units]
+            width, height = sps.width, sps.height
+            if framerate is None:
+                framerate = sps.framerate
+            if framerate is None:
+                framerate = _ffprobe_framerate(filepath, ffprobe_path, probe_cache)
+        else:
+            probed, stream = probe_packets(filepath, ffprobe_path)
+            if len(probed) == 0 or "width" not in stream:
+                raise ValueError("File is not a raw H.264 video stream.")
 
-        frames = info.get("packets")
-        keyframes = [kf.get("dts") for kf in frames if "K" in kf.get("flags")]
-        max_size = 0
-        sizes = []
-        for i, frame in enumerate(frames):
-            frame_offset = int(frame.get("pos"))
-            if i == len(frames) - 1:
-                frame_size = filesize - frame_offset
-            elif i == 0:
-                frame_size = int(frames[i + 1].get("pos"))
-            else:
-                frame_size = int(frames[i + 1].get("pos")) - frame_offset
-
-            max_size = max(max_size, frame_size)
-            sizes.append(frame_size)
+            # The first packet also holds the headers before it
+            units = [
+                (0 if i == 0 else offset, probed.is_keyframe(i))
+                for i, offset in enumerate(probed.offsets)
+            ]
+            width, height = int(stream["width"]), int(stream["height"])
+            if framerate is None:
+                framerate = parse_rate(stream.get("avg_frame_rate"))
+            if framerate is None:
+                framerate = parse_rate(stream.get("r_frame_rate"))
+            if framerate is None:
+                raise ValueError("Video stream has no frame rate.")
+
+        # Raw streams have no timestamps so access units are numbered in frames
+        packets = PacketTable(rate=framerate)
+        for i, (offset, is_keyframe) in enumerate(units):
+            packets.append(offset, 0, i, is_keyframe)
+
+        packets.fill_sizes(filesize)
+        num_frames = len(packets)
+        max_size = max(packets.sizes)
 
         max_padding_size = 0x20 - (max_size % 0x20) if max_size % 0x20 != 0 else 0
         max_packed_size = 0x18 + max_size + max_padding_size
@@ -178,26 +369,34 @@ class H264(UsmVideo):
         )
 
         self._header_page = create_video_header_page(
-            num_frames=len(frames),
-            num_keyframes=len(keyframes),
+            num_frames=num_frames,
+            num_keyframes=len(packets.keyframes),
             framerate=framerate,
             max_packed_size=max_packed_size,
             mpeg_codec=5,  # Value for H.264 USMs
             mpeg_dcprec=11,  # Value for H.264 USMs
-            ffprobe_video_stream=video_stream,
+            ffprobe_video_stream={"width": width, "height": height},
         )
 
-        def packet_gen(
-            path: str, packet_sizes: List[int], keyframe_indexes: List[int]
-        ) -> Generator[Tuple[bytes, bool], None, None]:
-            video = open(path, "rb")
-            for index, size in enumerate(packet_sizes):
-                is_keyframe = index in keyframe_indexes
-                yield video.read(size), is_keyframe
+        self._stream = _packet_gen(filepath, packets)
+        self._length = num_frames
+        self._channel_number = channel_number
+        self._metadata_pages = None
+        self._packets = packets
+
 
-            video.close()
+def _ffprobe_framerate(
+    filepath: str,
+    ffprobe_path: Optional[str] = None,
+    probe_cache: Optional[ProbeCache] = None,
+) -> float:
+    info = probe(filepath, cmd=ffprobe_path, cache=probe_cache)
 
-        self._stream = packet_gen(filepath, sizes, keyframes)
-        self._length = len(frames)
-        self._channel_number = channel_number
-        self._metadata_pages = None
\ No newline at end of file
+    if len(info.get("streams")) == 0:
+        raise ValueError("File has no videos streams.")
+
+    framerate = parse_rate(info.get("streams")[0].get("r_frame_rate"))
+    if framerate is None:
+        raise ValueError("Video stream has no frame rate.")
+
+    return framerate
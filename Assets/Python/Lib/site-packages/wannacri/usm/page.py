@@ -22,16 +22,26 @@ class UsmPage:
         else:
             self._dict = {}
 
+        self._revision = 0
+
     @property
     def dict(self) -> Dict[str, Element]:
         return self._dict
 
+    @property
+    def revision(self) -> int:
+        """Number of times the page was updated. Used to tell whether a packed
+        copy of the page is stale. Changes made directly through dict are not
+        counted."""
+        return self._revision
+
     def update(self, name: str, element_type: ElementType, element: Any) -> None:
         # Replace ugly Windows path style with Unix style
         if name == "filename":
             element = element.replace("\\", "/")
 
         self._dict.update({name: Element(element, element_type)})
+        self._revision += 1
 
     def __getitem__(self, item) -> Element:
         return self._dict[item]
@@ -43,34 +53,121 @@ class UsmPage:
         return None
 
 
+# Element types and occurrences by their packed value
+_ELEMENT_TYPES = {element_type.value: element_type for element_type in ElementType}
+_ELEMENT_OCCURRENCES = {
+    occurrence.value: occurrence for occurrence in ElementOccurrence
+}
+
+# Big-endian struct format of each element type's packed value. Floats are
+# little-endian so they're kept as raw bytes and unpacked separately.
+_ELEMENT_FORMATS = {
+    ElementType.CHAR: "B",
+    ElementType.UCHAR: "B",
+    ElementType.SHORT: "h",
+    ElementType.USHORT: "H",
+    ElementType.INT: "i",
+    ElementType.UINT: "I",
+    ElementType.LONGLONG: "q",
+    ElementType.ULONGLONG: "Q",
+    ElementType.FLOAT: "4s",
+    ElementType.STRING: "I",
+    ElementType.BYTES: "II",
+}
+
+# Element types whose unpacked value is used as is
+_PLAIN_ELEMENT_TYPES = frozenset(
+    [
+        ElementType.CHAR,
+        ElementType.UCHAR,
+        ElementType.SHORT,
+        ElementType.USHORT,
+        ElementType.INT,
+        ElementType.UINT,
+        ElementType.LONGLONG,
+        ElementType.ULONGLONG,
+    ]
+)
+
+_PAGES_HEADER = struct.Struct(">4sIIIIIHHI")
+_COLUMN_HEADER = struct.Struct(">BI")
+# < means little-endian
+_FLOAT = struct.Struct("<f")
+
+
+class _StringTable:
+    """Null-byte terminated strings of an @UTF payload, decoded once per offset."""
+
+    def __init__(self, string_array: bytes, encoding: str) -> None:
+        self._array = string_array
+        self._encoding = encoding
+        self._cache: Dict[int, str] = {}
+
+    def get(self, offset: int, encoding: Optional[str] = None) -> str:
+        if encoding is not None and encoding != self._encoding:
+            end = self._array.index(0x00, offset)
+            return self._array[offset:end].decode(encoding)
+
+        string = self._cache.get(offset)
+        if string is None:
+            end = self._array.index(0x00, offset)
+            string = self._array[offset:end].decode(self._encoding)
+            self._cache[offset] = string
+
+        return string
+
+
+def _element_value(
+    element_type: ElementType,
+    values: Tuple[Any, ...],
+    strings: _StringTable,
+    byte_array: bytes,
+) -> Any:
+    """Converts values unpacked with _ELEMENT_FORMATS to an element's value."""
+    if element_type is ElementType.FLOAT:
+        return _FLOAT.unpack(values[0])
+    if element_type is ElementType.STRING:
+        return strings.get(values[0])
+    if element_type is ElementType.BYTES:
+        return byte_array[values[0] : values[1]]
+
+    return values[0]
+
+
 def get_pages(info: bytearray, encoding: str = "UTF-8") -> List[UsmPage]:
+    """Decodes an @UTF payload into a list of pages.
+
+    The column schema is read once and compiled into a struct describing one
+    row of non-recurring values, so every page is decoded with a single unpack."""
     # START OF 8 BYTE PAYLOAD HEADER
     if bytearray(info[0:4]) != bytearray("@UTF", "UTF-8"):
         raise ValueError(f"Invalid info data signature: {info[0:4]}")
 
-    # payload_size doesn't include the 8 byte header
-    payload_size = int.from_bytes(info[4:8], "big")
-    # END OF 8 BYTE PAYLOAD HEADER
-
-    unique_array_offset = int.from_bytes(info[8:12], "big")
-    strings_offset = int.from_bytes(info[12:16], "big")
-    byte_array_offset = int.from_bytes(info[16:20], "big")
-    page_name_offset = int.from_bytes(info[20:24], "big")
+    if len(info) < _PAGES_HEADER.size:
+        raise ValueError(f"Info data too small: {len(info)} bytes")
 
-    num_elements_per_page = int.from_bytes(info[24:26], "big")
-    unique_array_size_per_page = int.from_bytes(info[26:28], "big")
-    num_pages = int.from_bytes(info[28:32], "big")
+    # payload_size doesn't include the 8 byte header
+    (
+        _,
+        payload_size,
+        # END OF 8 BYTE PAYLOAD HEADER
+        unique_array_offset,
+        strings_offset,
+        byte_array_offset,
+        page_name_offset,
+        num_elements_per_page,
+        unique_array_size_per_page,
+        num_pages,
+    ) = _PAGES_HEADER.unpack_from(info)
 
     # Offsets are always **after** the 8 byte header
-    string_array = info[(8 + strings_offset) : (8 + byte_array_offset)]
+    string_array = bytes(info[(8 + strings_offset) : (8 + byte_array_offset)])
     byte_array = info[8 + byte_array_offset : 8 + payload_size]
+    strings = _StringTable(string_array, encoding)
 
     try:
         # Strings are null-byte terminated
-        page_name_end = page_name_offset + string_array[page_name_offset:].index(0x00)
-        page_name: Optional[str] = string_array[page_name_offset:page_name_end].decode(
-            "UTF-8"
-        )
+        page_name: Optional[str] = strings.get(page_name_offset, "UTF-8")
     except (ValueError, UnicodeDecodeError) as e:
         logging.error(
             "Error occurred in processing page name",
@@ -95,330 +192,336 @@ def get_pages(info: bytearray, encoding: str = "UTF-8") -> List[UsmPage]:
     if page_name is None:
         raise ValueError("Error occurred in processing page name")
 
-    pages = [UsmPage(page_name) for _ in range(num_pages)]
-
-    unique_array = info[
-        8
-        + unique_array_offset : 8
-        + unique_array_offset
-        + unique_array_size_per_page * num_pages
-    ]
-    for page in pages:
-        shared_array = info[0x20 : 8 + unique_array_offset]
-        for _ in range(num_elements_per_page):
+    # Compile the schema. Each column is its name, type, and either its
+    # recurring element or the index of its values in an unpacked row.
+    columns: List[Tuple[str, ElementType, Optional[Element], int]] = []
+    row_format = ">"
+    row_length = 0
+    position = 0x20
+    shared_array_end = 8 + unique_array_offset
+    for _ in range(num_elements_per_page):
+        try:
+            flags, element_name_offset = _COLUMN_HEADER.unpack_from(info, position)
+        except struct.error as e:
+            raise ValueError(f"Truncated element schema at {position}") from e
+
+        position += _COLUMN_HEADER.size
+        element_type = _ELEMENT_TYPES.get(flags & 0x1F, flags & 0x1F)
+        element_occurrence = _ELEMENT_OCCURRENCES.get(flags >> 5, flags >> 5)
+
+        try:
+            element_name: Optional[str] = strings.get(element_name_offset)
+        except (ValueError, UnicodeDecodeError) as e:
+            logging.error(
+                "Error occurred in processing element name",
+                extra={
+                    "error": e,
+                    "element_name_offset": element_name_offset,
+                    "string_array_at_element_name": string_array[
+                        element_name_offset:
+                    ],
+                },
+            )
+            element_name = None
+
+        # Leave a note before we die
+        if (
+            element_name is None
+            or not isinstance(element_type, ElementType)
+            or not isinstance(element_occurrence, ElementOccurrence)
+        ):
+            logging.error(
+                "Error occurred in element processing",
+                extra={
+                    "page_name": element_name,
+                    "type": element_type,
+                    "occurrence": element_occurrence,
+                    "shared_array": bytes_to_hex(info[position:shared_array_end]),
+                    "string_array": string_array,
+                    "byte_array": byte_array,
+                },
+            )
+
+        if element_name is None:
+            raise ValueError("Error occurred in processing element name")
+        if not isinstance(element_type, ElementType):
+            raise ValueError(f"Unknown element type {element_type}")
+        if not isinstance(element_occurrence, ElementOccurrence):
+            raise ValueError(f"Unknown element occurence {element_occurrence}")
+
+        element_format = _ELEMENT_FORMATS[element_type]
+        if element_occurrence is ElementOccurrence.RECURRING:
+            element_struct = struct.Struct(">" + element_format)
             try:
-                element_type: Union[ElementType, int] = ElementType.from_int(
-                    shared_array[0] & 0x1F
-                )
-            except ValueError:
-                element_type = shared_array[0] & 0x1F
+                values = element_struct.unpack_from(info, position)
+            except struct.error as e:
+                raise ValueError(f"Truncated value of element {element_name}") from e
 
-            try:
-                element_occurrence: Union[
-                    ElementOccurrence, int
-                ] = ElementOccurrence.from_int(shared_array[0] >> 5)
-            except ValueError:
-                element_occurrence = shared_array[0] >> 5
+            position += element_struct.size
+            value = _element_value(element_type, values, strings, byte_array)
+            if element_name == "filename":
+                value = value.replace("\\", "/")
 
-            element_name_offset = int.from_bytes(shared_array[1:5], "big")
+            columns.append((element_name, element_type, Element(value, element_type), 0))
+        else:
+            columns.append((element_name, element_type, None, row_length))
+            row_format += element_format
+            row_length += 2 if element_type is ElementType.BYTES else 1
+
+    row_struct = struct.Struct(row_format)
+    if row_struct.size == 0:
+        rows: List[Tuple[Any, ...]] = [()] * num_pages
+    else:
+        # Rows are packed back to back after the shared array
+        rows_begin = 8 + unique_array_offset
+        rows_end = rows_begin + row_struct.size * num_pages
+        if len(info) < rows_end:
+            raise ValueError(
+                f"Unique array too small for {num_pages} pages: {len(info)} < {rows_end}"
+            )
+
+        rows = list(row_struct.iter_unpack(memoryview(info)[rows_begin:rows_end]))
+
+    pages = []
+    for row in rows:
+        page_dict: Dict[str, Element] = {}
+        for element_name, element_type, element, index in columns:
+            if element is None:
+                if element_type in _PLAIN_ELEMENT_TYPES:
+                    value = row[index]
+                else:
+                    value = _element_value(
+                        element_type, row[index : index + 2], strings, byte_array
+                    )
+                    if element_name == "filename":
+                        value = value.replace("\\", "/")
 
-            try:
-                element_end = element_name_offset + string_array[
-                    element_name_offset:
-                ].index(0x00)
-                element_name: Optional[str] = string_array[
-                    element_name_offset:element_end
-                ].decode(encoding)
-            except (ValueError, UnicodeDecodeError) as e:
-                logging.error(
-                    "Error occurred in processing element name",
-                    extra={
-                        "error": e,
-                        "element_name_offset": element_name_offset,
-                        "string_array_at_element_name": string_array[
-                            element_name_offset:
-                        ],
-                    },
-                )
-                element_name = None
-
-            shared_array = shared_array[5:]
-
-            # Leave a note before we die
-            if (
-                element_name is None
-                or not isinstance(element_type, ElementType)
-                or not isinstance(element_occurrence, ElementOccurrence)
-            ):
-                logging.error(
-                    "Error occurred in element processing",
-                    extra={
-                        "page_name": element_name,
-                        "type": element_type,
-                        "occurrence": element_occurrence,
-                        "shared_array": bytes_to_hex(shared_array),
-                        "unique_array": bytes_to_hex(unique_array),
-                        "string_array": string_array,
-                        "byte_array": byte_array,
-                    },
-                )
-
-            if element_name is None:
-                raise ValueError("Error occurred in processing element name")
-            if not isinstance(element_type, ElementType):
-                raise ValueError(f"Unknown element type {element_type}")
-            if not isinstance(element_occurrence, ElementOccurrence):
-                raise ValueError(f"Unknown element occurence {element_occurrence}")
-
-            if element_occurrence is ElementOccurrence.RECURRING:
-                current_array = shared_array
-            else:
-                current_array = unique_array
-
-            if element_type == ElementType.CHAR:
-                page.update(element_name, ElementType.CHAR, current_array[0])
-                element_size = 1
-            elif element_type == ElementType.UCHAR:
-                page.update(element_name, ElementType.UCHAR, current_array[0])
-                element_size = 1
-            elif element_type == ElementType.SHORT:
-                page.update(
-                    element_name,
-                    ElementType.SHORT,
-                    int.from_bytes(current_array[0:2], "big", signed=True),
-                )
-                element_size = 2
-            elif element_type == ElementType.USHORT:
-                page.update(
-                    element_name,
-                    ElementType.USHORT,
-                    int.from_bytes(current_array[0:2], "big"),
-                )
-                element_size = 2
-            elif element_type == ElementType.INT:
-                page.update(
-                    element_name,
-                    ElementType.INT,
-                    int.from_bytes(current_array[0:4], "big", signed=True),
-                )
-                element_size = 4
-            elif element_type == ElementType.UINT:
-                page.update(
-                    element_name,
-                    ElementType.UINT,
-                    int.from_bytes(current_array[0:4], "big"),
-                )
-                element_size = 4
-            elif element_type == ElementType.LONGLONG:
-                page.update(
-                    element_name,
-                    ElementType.LONGLONG,
-                    int.from_bytes(current_array[0:8], "big", signed=True),
-                )
-                element_size = 8
-            elif element_type == ElementType.ULONGLONG:
-                page.update(
-                    element_name,
-                    ElementType.ULONGLONG,
-                    int.from_bytes(current_array[0:8], "big"),
-                )
-                element_size = 8
-            elif element_type == ElementType.FLOAT:
-                page.update(
-                    element_name,
-                    ElementType.FLOAT,
-                    # < means little-endian
-                    struct.unpack("<f", current_array[0:4]),
-                )
-                element_size = 4
-            elif element_type == ElementType.STRING:
-                string_offset = int.from_bytes(current_array[0:4], "big")
-                string_end = string_offset + string_array[string_offset:].index(0x00)
-                string = string_array[string_offset:string_end].decode(encoding)
-                page.update(element_name, ElementType.STRING, string)
-                element_size = 4
-            elif element_type == ElementType.BYTES:
-                data_offset = int.from_bytes(current_array[0:4], "big")
-                data_end = int.from_bytes(current_array[4:8], "big")
-                page.update(
-                    element_name,
-                    ElementType.BYTES,
-                    byte_array[data_offset:data_end],
-                )
-                element_size = 8
-            else:
-                # Should be caught at element_type's initialization
-                raise ValueError(f"Unknown element type: {element_type}")
-
-            if element_occurrence is ElementOccurrence.RECURRING:
-                shared_array = shared_array[element_size:]
-            else:
-                unique_array = unique_array[element_size:]
+                element = Element(value, element_type)
+
+            page_dict[element_name] = element
+
+        pages.append(UsmPage(page_name, page_dict))
 
     return pages
 
 
-def pack_pages(
-    pages: List[UsmPage],
-    encoding: str,
-    string_padding: int = 0,
-) -> bytes:
-    if len(pages) == 0:
-        return bytes()
+# CHAR is packed signed but read back unsigned, as in real USMs
+_ELEMENT_PACK_FORMATS = {**_ELEMENT_FORMATS, ElementType.CHAR: "b"}
+
 
+class _StringPool:
+    """String array of an @UTF payload being packed. Every distinct
+    string is stored once and null-byte terminated."""
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        self.array = bytearray()
+        self._offsets: Dict[bytes, int] = {}
+        self._values: Dict[str, int] = {}
+
+    def add_bytes(self, data: bytes) -> int:
+        offset = self._offsets.get(data)
+        if offset is None:
+            offset = len(self.array)
+            self._offsets[data] = offset
+            self.array += data
+            self.array.append(0x00)
+
+        return offset
+
+    def add(self, string: str) -> int:
+        """Adds a string value in the pool's encoding. Returns its offset."""
+        offset = self._values.get(string)
+        if offset is None:
+            offset = self.add_bytes(bytes(string, self.encoding))
+            self._values[string] = offset
+
+        return offset
+
+
+class _EncodedPages(NamedTuple):
+    page_name_offset: int
+    num_elements: int
+    shared_array: bytes
+    row_struct: struct.Struct
+    # None when only the size is needed
+    rows: Optional[List[List[Any]]]
+    strings: _StringPool
+    byte_array: bytearray
+
+
+def _encode_pages(pages: List[UsmPage], encoding: str, keep_rows: bool) -> _EncodedPages:
+    """Classifies the columns of pages and encodes everything but the
+    non-recurring values into their arrays. Columns are laid out in the
+    key order of the first page."""
     page_name = pages[0].name
-    keys = set()
-    num_keys = len(pages[0].dict.keys())
+    schema = [(name, element.type) for name, element in pages[0].dict.items()]
+    keys = pages[0].dict.keys()
 
     # Check if pages have the same name and the same keys.
     for page in pages:
         if page_name != page.name:
             raise ValueError("Pages don't have the same names.")
-        if num_keys != len(page.dict.keys()):
+        if page.dict.keys() != keys:
             raise ValueError("Pages don't have the same keys.")
 
-        for key in page.dict.keys():
-            keys.add(key)
-
-    if len(keys) != num_keys:
-        raise ValueError("Pages don't have the same keys.")
+    # A column is recurring when every page has the same element
+    recurring: Set[str] = set()
+    if len(pages) > 1:
+        for name, _ in schema:
+            first = pages[0].dict[name]
+            if all(page.dict[name] == first for page in pages):
+                recurring.add(name)
 
     # Initialize string array with "<NULL>" and terminate string with null-byte (C-string)
     # TODO: What does "<NULL>" suppose to mean?
-    string_array = bytearray()
-    string_array += bytes("<NULL>", "UTF-8") + bytes(1)
+    strings = _StringPool(encoding)
+    strings.add_bytes(bytes("<NULL>", "UTF-8"))
+    page_name_offset = strings.add_bytes(bytes(page_name, "UTF-8"))
+    name_offsets = [strings.add_bytes(bytes(name, "UTF-8")) for name, _ in schema]
 
-    page_name_offset = len(string_array)
-    string_array += bytes(page_name, "UTF-8") + bytes(1)
-
-    # Dict with all the values
-    # Key is page key
-    # Tuple is the element name offset and the set is a set of all pages' values
-    elements: Dict[str, Tuple[int, Set[Element]]] = {}
-
-    for key in keys:
-        element_name_offset = len(string_array)
-        string_array += bytes(key, "UTF-8") + bytes(1)
-
-        values = set()
-        for page in pages:
-            values.add(page[key])
-
-        elements.update({key: (element_name_offset, values)})
-
-    common_elements = [
-        name
-        for name, (_, values) in elements.items()
-        if len(values) == 1 and len(pages) > 1
-    ]
+    byte_array = bytearray()
 
-    # Generate s and d array
+    def packed_values(element: Element, element_type: ElementType) -> Tuple[Any, ...]:
+        if element.type is not element_type:
+            raise ValueError(
+                f"Pages don't have the same element types: {element.type} and {element_type}."
+            )
+
+        if element_type in _PLAIN_ELEMENT_TYPES:
+            return (element.val,)
+        if element_type is ElementType.FLOAT:
+            return (_FLOAT.pack(element.val),)
+        if element_type is ElementType.STRING:
+            return (strings.add(element.val),)
+        if element_type is ElementType.BYTES:
+            bytes_offset = len(byte_array)
+            byte_array.extend(element.val)
+            return bytes_offset, len(byte_array)
+
+        raise ValueError(f"Unknown element type {element_type}.")
+
+    # Element type, occurrence and name offset of every column, followed
+    # by the value when it's recurring. Uses the pool in row order so
+    # strings of the first page come first.
     shared_array = bytearray()
-    unique_array = bytearray()
-    byte_array = bytearray()
-    for i, page in enumerate(pages):
-        for element_name, element in page.dict.items():
-            element_type_packed = int(element.type.value)
-            if element_name in common_elements:
-                # We only need to encode payload once since it's recurring for the same key
-                if i != 0:
-                    continue
-
-                element_type_packed += int(ElementOccurrence.RECURRING.value) << 5
-                shared_array += element_type_packed.to_bytes(1, "big")
-
-                element_name_offset = elements[element_name][0]
-                shared_array += element_name_offset.to_bytes(4, "big")
-
-                current_array = shared_array
-            else:
-                # We only need to encode payload **about** non-recurring values once
-                # But we encode actual payload every time since they're not recurring
-                if i == 0:
-                    element_type_packed += (
-                        int(ElementOccurrence.NON_RECURRING.value) << 5
-                    )
-                    shared_array += element_type_packed.to_bytes(1, "big")
-
-                    element_name_offset = elements[element_name][0]
-                    shared_array += element_name_offset.to_bytes(4, "big")
-
-                current_array = unique_array
-
-            if element.type == ElementType.CHAR:
-                current_array += element.val.to_bytes(1, "big", signed=True)
-            elif element.type == ElementType.UCHAR:
-                current_array += element.val.to_bytes(1, "big")
-            elif element.type == ElementType.SHORT:
-                current_array += element.val.to_bytes(2, "big", signed=True)
-            elif element.type == ElementType.USHORT:
-                current_array += element.val.to_bytes(2, "big")
-            elif element.type == ElementType.INT:
-                current_array += element.val.to_bytes(4, "big", signed=True)
-            elif element.type == ElementType.UINT:
-                current_array += element.val.to_bytes(4, "big")
-            elif element.type == ElementType.LONGLONG:
-                current_array += element.val.to_bytes(8, "big", signed=True)
-            elif element.type == ElementType.ULONGLONG:
-                current_array += element.val.to_bytes(8, "big")
-            elif element.type == ElementType.FLOAT:
-                # < means little-endian
-                current_array += struct.pack("<f", element.val)
-            elif element.type == ElementType.STRING:
-                value_offset = len(string_array)
-                string_array += bytes(element.val, encoding) + bytes(1)
-                current_array += value_offset.to_bytes(4, "big")
-            elif element.type == ElementType.BYTES:
-                bytes_offset = len(byte_array)
-                bytes_end = bytes_offset + len(element.val)
-                current_array += bytes_offset.to_bytes(4, "big")
-                current_array += bytes_end.to_bytes(4, "big")
-                byte_array += element.val
-            else:
-                raise ValueError(f"Unknown element type {element.type}.")
-
-    string_array += bytes(string_padding)
-
-    # Combine everything together
-    result = bytearray("@UTF", "UTF-8")
-
-    # 24 bytes for offset and page number info
-    data_size = (
-        24 + len(shared_array) + len(unique_array) + len(string_array) + len(byte_array)
+    row_format = ">"
+    row_columns: List[Tuple[str, ElementType]] = []
+    first_row: List[Any] = []
+    for (name, element_type), name_offset in zip(schema, name_offsets):
+        if element_type not in _ELEMENT_PACK_FORMATS:
+            raise ValueError(f"Unknown element type {element_type}.")
+
+        element_format = _ELEMENT_PACK_FORMATS[element_type]
+        values = packed_values(pages[0].dict[name], element_type)
+        if name in recurring:
+            occurrence = ElementOccurrence.RECURRING
+            shared_array += _COLUMN_HEADER.pack(
+                element_type.value + (occurrence.value << 5), name_offset
+            )
+            try:
+                shared_array += struct.pack(">" + element_format, *values)
+            except struct.error as e:
+                raise ValueError(f"Can't pack element {name}: {e}") from e
+        else:
+            occurrence = ElementOccurrence.NON_RECURRING
+            shared_array += _COLUMN_HEADER.pack(
+                element_type.value + (occurrence.value << 5), name_offset
+            )
+            row_format += element_format
+            row_columns.append((name, element_type))
+            first_row.extend(values)
+
+    rows: Optional[List[List[Any]]] = [first_row] if keep_rows else None
+    for page in pages[1:]:
+        page_dict = page.dict
+        row: List[Any] = []
+        for name, element_type in row_columns:
+            row.extend(packed_values(page_dict[name], element_type))
+
+        if rows is not None:
+            rows.append(row)
+
+    return _EncodedPages(
+        page_name_offset,
+        len(schema),
+        bytes(shared_array),
+        struct.Struct(row_format),
+        rows,
+        strings,
+        byte_array,
     )
-    result += data_size.to_bytes(4, "big")
-
-    unique_array_offset = 24 + len(shared_array)
-    result += unique_array_offset.to_bytes(4, "big")
-    strings_offset = 24 + len(shared_array) + len(unique_array)
-    result += strings_offset.to_bytes(4, "big")
-    byte_array_offset = 24 + len(shared_array) + len(unique_array) + len(string_array)
-    result += byte_array_offset.to_bytes(4, "big")
 
-    result += page_name_offset.to_bytes(4, "big")
-    result += len(keys).to_bytes(2, "big")
 
-    unique_array_size_per_page = len(unique_array) // len(pages)
-    result += unique_array_size_per_page.to_bytes(2, "big")
-
-    result += len(pages).to_bytes(4, "big")
+def pack_pages(
+    pages: List[UsmPage],
+    encoding: str,
+    string_padding: int = 0,
+) -> bytes:
+    """Encodes pages into an @UTF payload. Columns follow the key order of
+    the first page and equal strings are only stored once."""
+    if len(pages) == 0:
+        return bytes()
 
-    result += shared_array
-    result += unique_array
-    result += string_array
-    result += byte_array
+    encoded = _encode_pages(pages, encoding, keep_rows=True)
+    row_struct = encoded.row_struct
+
+    # Offsets are always **after** the 8 byte header, which the 24 bytes
+    # for offset and page number info come after
+    unique_array_offset = 24 + len(encoded.shared_array)
+    strings_offset = unique_array_offset + row_struct.size * len(pages)
+    byte_array_offset = strings_offset + len(encoded.strings.array) + string_padding
+    data_size = byte_array_offset + len(encoded.byte_array)
+
+    result = bytearray(8 + data_size)
+    _PAGES_HEADER.pack_into(
+        result,
+        0,
+        bytes("@UTF", "UTF-8"),
+        data_size,
+        unique_array_offset,
+        strings_offset,
+        byte_array_offset,
+        encoded.page_name_offset,
+        encoded.num_elements,
+        row_struct.size,
+        len(pages),
+    )
+    result[0x20 : 8 + unique_array_offset] = encoded.shared_array
+
+    position = 8 + unique_array_offset
+    if row_struct.size > 0 and encoded.rows is not None:
+        try:
+            for row in encoded.rows:
+                row_struct.pack_into(result, position, *row)
+                position += row_struct.size
+        except struct.error as e:
+            raise ValueError(f"Can't pack page {len(encoded.rows)}: {e}") from e
+
+    # String padding is already zeroed
+    position = 8 + strings_offset
+    result[position : position + len(encoded.strings.array)] = encoded.strings.array
+    result[8 + byte_array_offset :] = encoded.byte_array
     return bytes(result)
 
 
-def keyframes_from_seek_pages(seek_pages: Optional[List[UsmPage]]) -> List[int]:
-    result = []
-    if seek_pages is None:
-        return result
-
-    for seek in seek_pages:
-        if seek.name != "VIDEO_SEEKINFO":
-            raise ValueError("Page name is not 'VIDEO_SEEKINFO'")
-
-        result.append(seek["ofs_frmid"].val)
+def packed_pages_size(
+    pages: List[UsmPage],
+    encoding: str,
+    string_padding: int = 0,
+) -> int:
+    """Returns the size of pack_pages(pages, encoding, string_padding)
+    without building the payload."""
+    if len(pages) == 0:
+        return 0
+
+    encoded = _encode_pages(pages, encoding, keep_rows=False)
+    return (
+        0x20
+        + len(encoded.shared_array)
+        + encoded.row_struct.size * len(pages)
+        + len(encoded.strings.array)
+        + string_padding
+        + len(encoded.byte_array)
+    )
 
-    return result
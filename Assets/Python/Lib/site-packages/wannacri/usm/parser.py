@@ -0,0 +1,194 @@
+"""Incremental parsing of USMs that arrive as a stream of bytes, e.g. from
+a pipe, a socket or stdin, where Usm.open can't seek."""
+from __future__ import annotations
+
+import logging
+import os
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from .chunk import ChunkHeader, UsmChunk
+from .page import UsmPage
+from .tools import (
+    decrypt_audio_packet,
+    decrypt_video_packet,
+    generate_keys,
+    is_usm,
+    slugify,
+)
+from .types import ChunkType, PayloadType
+
+
+class ChunkEvent(NamedTuple):
+    """A whole chunk found by ChunkParser."""
+
+    # Offset of the chunk from the start of the stream
+    offset: int
+    header: ChunkHeader
+    # Raw bytes for stream chunks. Parsed pages, or bytes for section
+    # ends, for every other chunk.
+    payload: Union[bytes, List[UsmPage]]
+
+
+class ChunkParser:
+    """Push parser for USM chunks. Feed it bytes as they arrive, in any
+    amounts, and it returns the chunks completed by them. Only the bytes
+    of the chunk being read are kept.
+
+    Raises ValueError from feed on an invalid chunk header and from close
+    when the stream ends in the middle of a chunk."""
+
+    def __init__(self, encoding: str = "UTF-8") -> None:
+        self.encoding = encoding
+        self._buffer = bytearray()
+        # Stream offset of the start of the buffer
+        self._offset = 0
+
+    @property
+    def offset(self) -> int:
+        """The number of bytes parsed into chunks so far."""
+        return self._offset
+
+    def feed(self, data: bytes) -> List[ChunkEvent]:
+        buffer = self._buffer
+        buffer += data
+
+        events = []
+        position = 0
+        while len(buffer) - position >= 0x20:
+            header = ChunkHeader.from_bytes(buffer[position : position + 0x20])
+            if len(buffer) - position < header.size:
+                break
+
+            payload_begin = position + header.payload_begin
+            payload_end = payload_begin + header.payload_size
+            if header.payload_type is PayloadType.STREAM:
+                payload: Union[bytes, List[UsmPage]] = bytes(
+                    buffer[payload_begin:payload_end]
+                )
+            else:
+                payload = UsmChunk.from_bytes(
+                    buffer[position:payload_end], encoding=self.encoding
+                ).payload
+
+            events.append(ChunkEvent(self._offset + position, header, payload))
+            position += header.size
+
+        del buffer[:position]
+        self._offset += position
+        return events
+
+    def close(self) -> None:
+        """Checks that the stream ended on a chunk boundary."""
+        if len(self._buffer) != 0:
+            raise ValueError(
+                f"Stream ends inside the chunk at offset {self._offset}, "
+                f"{len(self._buffer)} bytes in."
+            )
+
+
+def demux_stream(
+    source: IO,
+    path: str,
+    key: Optional[int] = None,
+    encoding: str = "UTF-8",
+    folder_name: Optional[str] = None,
+    block_size: int = 0x100000,
+) -> Tuple[List[str], List[str]]:
+    """Saves all videos, audios and alpha videos of a USM read from a file
+    object that doesn't need to be seekable. Packets are written out as they
+    arrive. Files are laid out like with Usm.demux. Without a folder_name, the
+    folder is named after the filename in the USM's CRID page.
+
+    Returns the paths of the saved videos and audios.
+    """
+    if key is None:
+        video_key: Optional[bytes] = None
+        audio_key: Optional[bytes] = None
+    else:
+        video_key, audio_key = generate_keys(key)
+
+    folders = {
+        ChunkType.VIDEO: ("videos", 0x40534656),  # @SFV
+        ChunkType.AUDIO: ("audios", 0x40534641),  # @SFA
+        ChunkType.ALPHA: ("alphas", 0x40414C50),  # @ALP
+    }
+    crids: List[UsmPage] = []
+    outputs: Dict[Tuple[ChunkType, int], IO] = {}
+    saved: Dict[ChunkType, List[str]] = {chunk_type: [] for chunk_type in folders}
+
+    def open_output(chunk_type: ChunkType, channel_number: int) -> IO:
+        usm_crid = [page for page in crids if page.get("chno").val == -1]
+        if len(usm_crid) == 0:
+            raise ValueError("No usm crid page found before the stream.")
+
+        usm_name = usm_crid[0].get("filename").val.split("/")[-1]
+        output = os.path.join(
+            path, slugify(usm_name if folder_name is None else folder_name)
+        )
+        if os.path.exists(output) and os.path.isfile(output):
+            raise FileExistsError
+
+        name, stmid = folders[chunk_type]
+        crid = [
+            page
+            for page in crids
+            if page.get("chno").val == channel_number
+            and page.get("stmid").val == stmid
+        ]
+        if len(crid) == 0:
+            raise ValueError(f"No crid page found for {name} ch {channel_number}.")
+
+        sub_output = os.path.join(output, name)
+        os.makedirs(sub_output, exist_ok=True)
+        filename = os.path.join(
+            sub_output,
+            slugify(crid[0].get("filename").val.split("/")[-1], allow_unicode=True),
+        )
+        logging.info(f"Saving {name}", extra={"filename": filename})
+        saved[chunk_type].append(filename)
+        return open(filename, "wb")
+
+    parser = ChunkParser(encoding)
+    first_block = True
+    try:
+        while True:
+            block = source.read(block_size)
+            if len(block) == 0:
+                break
+            if first_block and not is_usm(block[:4]):
+                raise ValueError("Stream is not a usm.")
+            first_block = False
+
+            for event in parser.feed(block):
+                header = event.header
+                if header.chunk_type is ChunkType.INFO:
+                    if isinstance(event.payload, list):
+                        crids.extend(event.payload)
+                    continue
+
+                if (
+                    header.payload_type is not PayloadType.STREAM
+                    or header.chunk_type not in folders
+                ):
+                    continue
+
+                output = outputs.get((header.chunk_type, header.channel_number))
+                if output is None:
+                    output = open_output(header.chunk_type, header.channel_number)
+                    outputs[(header.chunk_type, header.channel_number)] = output
+
+                payload = event.payload
+                if header.chunk_type is ChunkType.AUDIO:
+                    if audio_key is not None:
+                        payload = decrypt_audio_packet(payload, audio_key)
+                elif video_key is not None:
+                    payload = decrypt_video_packet(payload, video_key)
+
+                output.write(payload)
+
+        parser.close()
+    finally:
+        for output in outputs.values():
+            output.close()
+
+    return saved[ChunkType.VIDEO], saved[ChunkType.AUDIO]
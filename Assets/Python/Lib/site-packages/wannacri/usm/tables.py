@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .page import UsmPage
+from .types import ElementType
+
+
+class SeekTable:
+    """Columnar VIDEO_SEEKINFO table. Every row is a keyframe with its
+    frame index and the byte offset of its chunk.
+
+    Iterating gives (frame index, offset) tuples in table order and
+    `frame in table` checks whether a frame is a keyframe in O(1)."""
+
+    # Column names and element types of VIDEO_SEEKINFO pages
+    COLUMNS: Dict[str, ElementType] = {
+        "ofs_byte": ElementType.LONGLONG,
+        "ofs_frmid": ElementType.UINT,
+        "num_skip": ElementType.USHORT,
+        "resv": ElementType.USHORT,
+    }
+
+    def __init__(self, element_types: Optional[Dict[str, ElementType]] = None) -> None:
+        self.ofs_byte = array("q")
+        self.ofs_frmid = array("I")
+        self.num_skip = array("i")
+        self.resv = array("i")
+        # Element types to pack each column as
+        self.element_types = dict(self.COLUMNS if element_types is None else element_types)
+        self._frames: Optional[Set[int]] = None
+
+    def append(self, frame: int, offset: int, num_skip: int = 0, resv: int = 0) -> None:
+        self.ofs_frmid.append(frame)
+        self.ofs_byte.append(offset)
+        self.num_skip.append(num_skip)
+        self.resv.append(resv)
+        if self._frames is not None:
+            self._frames.add(frame)
+
+    def __len__(self) -> int:
+        return len(self.ofs_frmid)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.ofs_frmid, self.ofs_byte)
+
+    def __contains__(self, frame: object) -> bool:
+        if self._frames is None:
+            self._frames = set(self.ofs_frmid)
+
+        return frame in self._frames
+
+    @property
+    def frames(self) -> array:
+        """Frame indexes of every keyframe."""
+        return self.ofs_frmid
+
+    def shifted(self, delta: int) -> SeekTable:
+        """Returns a copy of the table with delta added to every offset."""
+        result = SeekTable(self.element_types)
+        result.ofs_byte = array("q", [offset + delta for offset in self.ofs_byte])
+        result.ofs_frmid = array("I", self.ofs_frmid)
+        result.num_skip = array("i", self.num_skip)
+        result.resv = array("i", self.resv)
+        return result
+
+    @classmethod
+    def from_pages(cls, pages: Optional[List[UsmPage]]) -> SeekTable:
+        """Reads a list of VIDEO_SEEKINFO pages. None gives an empty table."""
+        if pages is None or len(pages) == 0:
+            return cls()
+
+        first = pages[0]
+        if first.name != "VIDEO_SEEKINFO":
+            raise ValueError("Page name is not 'VIDEO_SEEKINFO'")
+        if set(first.dict.keys()) != set(cls.COLUMNS):
+            raise ValueError(
+                f"Unknown VIDEO_SEEKINFO columns: {', '.join(first.dict.keys())}"
+            )
+
+        # Keep the column order and element types of the pages
+        result = cls({name: element.type for name, element in first.dict.items()})
+        for page in pages:
+            if page.name != "VIDEO_SEEKINFO":
+                raise ValueError("Page name is not 'VIDEO_SEEKINFO'")
+
+            result.append(
+                page["ofs_frmid"].val,
+                page["ofs_byte"].val,
+                page["num_skip"].val,
+                page["resv"].val,
+            )
+
+        return result
+
+    def to_pages(self) -> List[UsmPage]:
+        """Writes the table as a list of VIDEO_SEEKINFO pages."""
+        columns = {
+            "ofs_byte": self.ofs_byte,
+            "ofs_frmid": self.ofs_frmid,
+            "num_skip": self.num_skip,
+            "resv": self.resv,
+        }
+        names = list(self.element_types)
+        pages = []
+        for row in zip(*[columns[name] for name in names]):
+            page = UsmPage("VIDEO_SEEKINFO")
+            for name, value in zip(names, row):
+                page.update(name, self.element_types[name], value)
+
+            pages.append(page)
+
+        return pages
+
+
+class PacketTable:
+    """Columnar table of stream packets. Every row is a packet with its
+    offset and size in the source file, its timestamp and whether it's a
+    keyframe. Iterating gives (offset, size) tuples.
+
+    Columns are arrays and keyframes a bitmap, so a table takes a fraction
+    of the memory of lists of tuples and pickles quickly, e.g. to send to
+    worker processes."""
+
+    def __init__(self, rate: float = 0) -> None:
+        self.offsets = array("Q")
+        self.sizes = array("Q")
+        # Signed since container timestamps can start below zero
+        self.timestamps = array("q")
+        self._keyframes = bytearray()
+        # Keyframe indexes, built from the bitmap on demand
+        self._keyframe_indexes: Optional[array] = None
+        # Timestamp ticks per second. 0 when unknown
+        self.rate = rate
+
+    def append(
+        self, offset: int, size: int, timestamp: int = 0, is_keyframe: bool = False
+    ) -> None:
+        index = len(self.offsets)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.timestamps.append(timestamp)
+        if index & 7 == 0:
+            self._keyframes.append(0)
+        if is_keyframe:
+            self._keyframes[index >> 3] |= 1 << (index & 7)
+            self._keyframe_indexes = None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.offsets, self.sizes)
+
+    def __getitem__(self, index: int) -> Tuple[int, int]:
+        return self.offsets[index], self.sizes[index]
+
+    def is_keyframe(self, index: int) -> bool:
+        if not 0 <= index < len(self.offsets):
+            raise IndexError(f"Packet {index} out of range.")
+
+        return bool(self._keyframes[index >> 3] & (1 << (index & 7)))
+
+    def set_keyframes(self, indexes: Iterable[int]) -> None:
+        """Marks packets as keyframes. Indexes past the end are ignored."""
+        for index in indexes:
+            if 0 <= index < len(self.offsets):
+                self._keyframes[index >> 3] |= 1 << (index & 7)
+
+        self._keyframe_indexes = None
+
+    @property
+    def keyframes(self) -> array:
+        """Sorted indexes of every keyframe, for bisecting. Built once and
+        shared until keyframes change, so it must not be modified."""
+        if self._keyframe_indexes is None:
+            result = array("Q")
+            for byte_index, byte in enumerate(self._keyframes):
+                if byte == 0:
+                    continue
+
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        result.append(byte_index * 8 + bit)
+
+            self._keyframe_indexes = result
+
+        return self._keyframe_indexes
+
+    def fill_sizes(self, end: int) -> None:
+        """Sets the size of every packet to the distance to the next packet's
+        offset. The last packet runs to end."""
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            self.sizes[i] = offsets[i + 1] - offsets[i]
+
+        if len(offsets) > 0:
+            self.sizes[-1] = end - offsets[-1]
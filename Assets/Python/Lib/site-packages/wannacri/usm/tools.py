@@ -1,9 +1,15 @@
 import math
-from typing import Tuple, IO, List, Callable, Union
+import mmap
+from typing import Container, Tuple, IO, List, Callable, Optional, Union, TYPE_CHECKING
 import threading
 import unicodedata
 import re
 
+from . import cipher
+
+if TYPE_CHECKING:
+    from .tables import PacketTable
+
 
 def slugify(value, allow_unicode=True):
     """
@@ -121,59 +127,29 @@ def generate_keys(key_num: int) -> Tuple[bytes, bytes]:
 
 def decrypt_video_packet(packet: bytes, video_key: bytes) -> bytes:
     """Decrypt an encrypted videos stream payload. Skips decryption if packet is
-    less than 0x240 bytes.
+    less than 0x240 bytes. Uses the fastest available engine from the cipher module.
     """
     if len(video_key) < 0x40:
         raise ValueError(f"Video key should be 0x40 bytes long. Given {len(video_key)}")
 
-    data = bytearray(packet)
-    encrypted_part_size = len(data) - 0x40
-    if encrypted_part_size >= 0x200:
-        rolling = bytearray(video_key)
-        for i in range(0x100, encrypted_part_size):
-            data[0x40 + i] ^= rolling[0x20 + i % 0x20]
-            rolling[0x20 + i % 0x20] = data[0x40 + i] ^ video_key[0x20 + i % 0x20]
-
-        for i in range(0x100):
-            rolling[i % 0x20] ^= data[0x140 + i]
-            data[0x40 + i] ^= rolling[i % 0x20]
-
-    return bytes(data)
+    return cipher.backend.decrypt_video(packet, video_key)
 
 
 def encrypt_video_packet(packet: bytes, video_key: bytes) -> bytes:
     """Encrypt an encrypted videos stream payload. Skips decryption if packet is
-    less than 0x240 bytes.
+    less than 0x240 bytes. Uses the fastest available engine from the cipher module.
     """
     if len(video_key) < 0x40:
         raise ValueError(f"Video key should be 0x40 bytes long. Given {len(video_key)}")
 
-    data = bytearray(packet)
-    if len(data) >= 0x240:
-        encrypted_part_size = len(data) - 0x40
-        rolling = bytearray(video_key)
-        for i in range(0x100):
-            rolling[i % 0x20] ^= data[0x140 + i]
-            data[0x40 + i] ^= rolling[i % 0x20]
-
-        for i in range(0x100, encrypted_part_size):
-            plainbyte = data[0x40 + i]
-            data[0x40 + i] ^= rolling[0x20 + i % 0x20]
-            rolling[0x20 + i % 0x20] = plainbyte ^ video_key[0x20 + i % 0x20]
-
-    return bytes(data)
+    return cipher.backend.encrypt_video(packet, video_key)
 
 
 def _crypt_audio_packet(packet: bytes, key: bytes) -> bytes:
     """Encrypt/decrypt a plaintext/encrypted audios stream payload. Skips encryption/decryption
     if packet is less than or equal to 0x140 bytes.
     """
-    data = bytearray(packet)
-    if len(data) > 0x140:
-        for i in range(0x140, len(data)):
-            data[i] ^= key[i % 0x20]
-
-    return bytes(data)
+    return cipher.backend.crypt_audio(packet, key)
 
 
 # Encrypting and decrypting audios stream payload are the same operation
@@ -231,39 +207,103 @@ def is_usm(magic: bytes) -> bool:
     return magic[:4] == bytearray("CRID", "UTF-8")
 
 
+class MappedPacketReader:
+    """Hands out packet payloads of a memory mapped file as memoryview slices.
+    Nothing is copied and no file position is shared, so any number of
+    sinks can read from it concurrently."""
+
+    def __init__(self, usmfile: IO):
+        self._mmap: Optional[mmap.mmap] = mmap.mmap(
+            usmfile.fileno(), 0, access=mmap.ACCESS_READ
+        )
+        self._view = memoryview(self._mmap)
+        self._usmfile = usmfile
+
+    def read(self, offset: int, size: int) -> memoryview:
+        return self._view[offset : offset + size]
+
+    def close(self) -> None:
+        """Unmaps and closes the file. Packets read before can't be used after."""
+        self._view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Packets are still referenced somewhere. The mapping goes
+                # away with the last of them.
+                pass
+            self._mmap = None
+        self._usmfile.close()
+
+    def __enter__(self) -> "MappedPacketReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class FilePacketReader:
+    """Reads packet payloads through a shared file handle. Used for inputs
+    that can't be memory mapped."""
+
+    def __init__(self, usmfile: IO):
+        self._usmfile = usmfile
+        self._mutex = threading.Lock()
+
+    def read(self, offset: int, size: int) -> bytes:
+        with self._mutex:
+            self._usmfile.seek(offset)
+            return self._usmfile.read(size)
+
+    def close(self) -> None:
+        """Closes the file."""
+        with self._mutex:
+            self._usmfile.close()
+
+    def __enter__(self) -> "FilePacketReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+PacketReader = Union[MappedPacketReader, FilePacketReader]
+
+
+def open_packet_reader(usmfile: IO) -> PacketReader:
+    """Memory map an opened usm file, falling back to buffered reads when the
+    file can't be mapped (empty files, pipes, in-memory streams). The reader
+    takes over the file, which is closed with it."""
+    try:
+        return MappedPacketReader(usmfile)
+    except (OSError, ValueError):
+        return FilePacketReader(usmfile)
+
+
 def video_sink(
-    usmfile: IO,
-    usmmutex: threading.Lock,
-    offsets_and_sizes: List[Tuple[int, int]],
-    keyframes: List[int],
+    reader: PacketReader,
+    packets: "PacketTable",
+    keyframes: Optional[Container[int]] = None,
 ):
-    """A generator for videos chunk payloads. Takes a handle of a usm file, a mutex,
-    a list of tuples of a chunk payload's offset and size, and a list of keyframes'
-    frame number.
+    """A generator for videos chunk payloads. Takes a packet reader of a usm file
+    and the PacketTable of a video channel. Keyframes are taken from the table
+    unless a collection of keyframe indexes, e.g. a SeekTable, is given.
 
     Yields the raw chunk payload and a bool whether the frame is a keyframe or not.
     All in chronological order."""
-    num_frames = len(offsets_and_sizes)
-    for i in range(num_frames):
-        offset, size = offsets_and_sizes[i]
-        is_keyframe = i in keyframes
-        with usmmutex:
-            usmfile.seek(offset)
-            frame = usmfile.read(size)
+    for i, (offset, size) in enumerate(packets):
+        if keyframes is None:
+            is_keyframe = packets.is_keyframe(i)
+        else:
+            is_keyframe = i in keyframes
 
-        yield frame, is_keyframe
+        yield reader.read(offset, size), is_keyframe
 
 
-def audio_sink(usmfile: IO, usmmutex: threading.Lock, offsets_and_sizes: list):
-    """A generator for audios chunk payloads. Takes a handle of a usm file, a mutex,
-    and a list of tuples of a chunk payload's offset and size.
+def audio_sink(reader: PacketReader, packets: "PacketTable"):
+    """A generator for audios chunk payloads. Takes a packet reader of a usm file
+    and the PacketTable of an audio channel.
 
     Yields the raw chunk payload in chronological order."""
-    num_frames = len(offsets_and_sizes)
-    for i in range(num_frames):
-        offset, size = offsets_and_sizes[i]
-        with usmmutex:
-            usmfile.seek(offset)
-            frame = usmfile.read(size)
-
-        yield frame
+    for offset, size in packets:
+        yield reader.read(offset, size)
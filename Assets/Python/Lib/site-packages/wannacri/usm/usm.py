@@ -1,28 +1,55 @@
 from __future__ import annotations
 
+import functools
+import heapq
+import itertools
 import math
+import mmap
 import os
 import logging
 import pathlib
-import threading
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from tempfile import TemporaryFile
-from typing import List, Optional, Union, Tuple, Dict, Generator, IO, Callable
+from typing import (
+    List,
+    Optional,
+    Union,
+    Tuple,
+    Dict,
+    Generator,
+    IO,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    NamedTuple,
+)
 
 from .tools import (
     generate_keys,
+    encrypt_video_packet,
+    decrypt_video_packet,
+    encrypt_audio_packet,
+    decrypt_audio_packet,
     chunk_size_and_padding,
     bytes_to_hex,
     is_usm,
     video_sink,
     audio_sink,
+    open_packet_reader,
+    PacketReader,
     slugify,
     pad_to_next_sector,
 )
 from .types import ChunkType, PayloadType, ElementType, OpMode
-from .page import UsmPage, keyframes_from_seek_pages
-from .chunk import UsmChunk
+from .page import UsmPage
+from .chunk import UsmChunk, ChunkHeader
+from .tables import PacketTable, SeekTable
+from .info import UsmInfo, video_info, audio_info
+from .interleave import interleave, peak_buffer
 from .media import GenericVideo, GenericAudio, UsmVideo, UsmAudio
 
 
@@ -31,11 +58,30 @@ class UsmChannel:
     """Intermediate class for holding information on a UsmVideo
     and UsmAudio from a parsed Usm."""
 
-    stream: List[Tuple[int, int]]
+    stream: PacketTable
     header: UsmPage
     metadata: Optional[List[UsmPage]] = None
 
 
+class UsmClip(NamedTuple):
+    """A span of a Usm found by Usm.seek. Ranges are the indexes of the first
+    packet and of the one after the last packet of every channel, in the order
+    of Usm.videos, Usm.audios and Usm.alphas. The generators read only the
+    packets in those ranges, decrypted when the Usm has a key."""
+
+    # Always a keyframe of the first video
+    start_frame: int
+    end_frame: int
+    start_time: float
+    end_time: float
+    video_ranges: List[Tuple[int, int]]
+    audio_ranges: List[Tuple[int, int]]
+    alpha_ranges: List[Tuple[int, int]]
+    videos: List[Generator[Tuple[bytes, bool], None, None]]
+    audios: List[Generator[bytes, None, None]]
+    alphas: List[Generator[Tuple[bytes, bool], None, None]]
+
+
 class Usm:
     def __init__(
         self,
@@ -45,7 +91,12 @@ class Usm:
         key: Optional[int] = None,
         usm_crid: Optional[UsmPage] = None,
         version: int = 16777984,
+        max_lead: float = 0.0,
     ) -> None:
+        """Packets of all videos and audios are laid out in the stream by their
+        time. max_lead caps how many seconds a stream may run ahead of the
+        slowest stream in the file to save switches between streams. The
+        default of 0 lays packets out strictly by time. See interleave."""
         if len(videos) == 0:
             raise ValueError("No video given.")
 
@@ -66,7 +117,15 @@ class Usm:
         self.videos.sort()
 
         self._usm_crid = usm_crid
-        self._max_packet_size = 1
+        self.max_lead = max_lead
+        # Peak buffer occupancy of the last laid out stream
+        self._peak_buffer = 1
+
+        # Set by Usm.open so the stream payloads can be rewritten in place
+        self._reader: Optional[PacketReader] = None
+        self._filesize = 0
+        # Byte ranges skipped by Usm.open in recover mode
+        self.damaged_ranges: List[Tuple[int, int]] = []
 
         logging.info(
             "Initialising USM",
@@ -119,8 +178,7 @@ class Usm:
         crid.update("chno", ElementType.SHORT, -1)
         crid.update("minchk", ElementType.SHORT, 1)
 
-        # TODO: Find formula for minbuf
-        minbuf = round(self._max_packet_size * 1.98746)
+        minbuf = self._peak_buffer
         minbuf += 0x10 - (minbuf % 0x10) if minbuf % 0x10 != 0 else 0
         crid.update("minbuf", ElementType.INT, minbuf)
 
@@ -141,7 +199,15 @@ class Usm:
         filepath: Union[str, pathlib.Path],
         key: Optional[int] = None,
         encoding: str = "UTF-8",
+        header_only: bool = True,
+        recover: bool = False,
     ) -> Usm:
+        """Load a Usm from a file. By default only the chunk headers of stream
+        chunks are read; set header_only to False to fully parse every chunk.
+
+        With recover set, damaged chunks are skipped instead of raising by
+        scanning forward to the next valid chunk header. The skipped byte
+        ranges are kept in the damaged_ranges attribute."""
         filesize = os.path.getsize(filepath)
         if filesize <= 0x20:
             raise ValueError(f"File {filepath} too small.")
@@ -163,12 +229,12 @@ class Usm:
         if not is_usm(signature):
             raise ValueError(f"Invalid file signature: {bytes_to_hex(signature)}")
 
+        damaged_ranges: Optional[List[Tuple[int, int]]] = [] if recover else None
         crids, video_channels, audio_channels, alpha_channels = _process_chunks(
-            usmfile, filesize, encoding
+            usmfile, filesize, encoding, header_only=header_only, damaged=damaged_ranges
         )
 
-        # We don't need a mutex because of the GIL, but it feels dirty without one
-        usmmutex = threading.Lock()
+        reader = open_packet_reader(usmfile)
         videos = []
         audios = []
         alphas = []
@@ -186,18 +252,18 @@ class Usm:
             if channel_number == 0:
                 version = crid[0].get("fmtver").val
 
+            video_channel.stream.set_keyframes(
+                SeekTable.from_pages(video_channel.metadata).frames
+            )
             videos.append(
                 GenericVideo(
-                    video_sink(
-                        usmfile,
-                        usmmutex,
-                        video_channel.stream,
-                        keyframes_from_seek_pages(video_channel.metadata),
-                    ),
+                    video_sink(reader, video_channel.stream),
                     crid[0],
                     video_channel.header,
                     len(video_channel.stream),
                     channel_number=channel_number,
+                    packets=video_channel.stream,
+                    reader=reader,
                 )
             )
 
@@ -214,11 +280,13 @@ class Usm:
 
             audios.append(
                 GenericAudio(
-                    audio_sink(usmfile, usmmutex, audio_channel.stream),
+                    audio_sink(reader, audio_channel.stream),
                     crid[0],
                     audio_channel.header,
                     len(audio_channel.stream),
                     channel_number=channel_number,
+                    packets=audio_channel.stream,
+                    reader=reader,
                 )
             )
 
@@ -228,19 +296,19 @@ class Usm:
             if len(crid) == 0:
                 raise ValueError(f"No crid page found for video ch {channel_number}")
 
+            alpha_channel.stream.set_keyframes(
+                SeekTable.from_pages(alpha_channel.metadata).frames
+            )
             alphas.append(
                 GenericVideo(
-                    video_sink(
-                        usmfile,
-                        usmmutex,
-                        alpha_channel.stream,
-                        keyframes_from_seek_pages(alpha_channel.metadata)
-                    ),
+                    video_sink(reader, alpha_channel.stream),
                     crid[0],
                     alpha_channel.header,
                     len(alpha_channel.stream),
                     channel_number=channel_number,
                     is_alpha=True,
+                    packets=alpha_channel.stream,
+                    reader=reader,
                 )
             )
 
@@ -250,9 +318,202 @@ class Usm:
         if version is None:
             raise ValueError("Format version not found.")
 
-        return cls(
+        usm = cls(
             version=version, videos=videos, audios=audios, alphas=alphas, key=key, usm_crid=usm_crid[0]
         )
+        usm._reader = reader
+        usm._filesize = filesize
+        if damaged_ranges is not None:
+            usm.damaged_ranges = damaged_ranges
+        return usm
+
+    def close(self) -> None:
+        """Closes the file this Usm was opened from, if any. Its videos and
+        audios can't be read after. Usm can also be used as a context manager."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def __enter__(self) -> Usm:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def rekey(
+        self, old_key: int, new_key: int, workers: int = 1
+    ) -> Generator[bytes, None, None]:
+        """Generates the file this Usm was opened from with every stream payload
+        re-encrypted from old_key to new_key, in a single pass. All other bytes
+        are copied as they are. Only available for a Usm loaded with Usm.open."""
+        if self._reader is None:
+            raise ValueError("Usm was not loaded from a file.")
+
+        reader = self._reader
+        rekey_video, rekey_audio = _rekeyers(old_key, new_key)
+        payloads = _stream_payloads(
+            [(media.packet_table, False) for media in [*self.videos, *self.alphas]]
+            + [(media.packet_table, True) for media in self.audios]
+        )
+        position = 0
+        for offset, size, data in _recrypt_payloads(
+            reader.read, payloads, rekey_video, rekey_audio, workers
+        ):
+            if offset > position:
+                yield bytes(reader.read(position, offset - position))
+
+            yield data
+            position = offset + size
+
+        if self._filesize > position:
+            yield bytes(reader.read(position, self._filesize - position))
+
+    @staticmethod
+    def read_info(
+        filepath: Union[str, pathlib.Path], encoding: str = "UTF-8"
+    ) -> UsmInfo:
+        """Summarises a USM from its CRID, header and metadata sections. Reading
+        stops at the first stream chunk, right after the #METADATA END markers,
+        so it takes the same time regardless of the length of the movie."""
+        filesize = os.path.getsize(filepath)
+        if filesize <= 0x20:
+            raise ValueError(f"File {filepath} too small.")
+
+        with open(filepath, "rb") as usmfile:
+            signature = usmfile.read(4)
+            if not is_usm(signature):
+                raise ValueError(f"Invalid file signature: {bytes_to_hex(signature)}")
+
+            crids, video_channels, audio_channels, alpha_channels = _process_chunks(
+                usmfile, filesize, encoding, until_stream=True
+            )
+
+        def crid_page(channel_number: int, stmid: int) -> UsmPage:
+            for page in crids:
+                if page.get("chno").val == channel_number and page.get("stmid").val == stmid:
+                    return page
+
+            raise ValueError(f"No crid page found for ch {channel_number}.")
+
+        usm_crid = [page for page in crids if page.get("chno").val == -1]
+        if len(usm_crid) == 0:
+            raise ValueError("No usm crid page found.")
+
+        videos = [
+            video_info(
+                channel_number,
+                crid_page(channel_number, 0x40534656),  # @SFV
+                channel.header,
+                channel.metadata,
+            )
+            for channel_number, channel in sorted(video_channels.items())
+        ]
+        audios = [
+            audio_info(
+                channel_number,
+                crid_page(channel_number, 0x40534641),  # @SFA
+                channel.header,
+            )
+            for channel_number, channel in sorted(audio_channels.items())
+        ]
+        alphas = [
+            video_info(
+                channel_number,
+                crid_page(channel_number, 0x40414C50),  # @ALP
+                channel.header,
+                channel.metadata,
+            )
+            for channel_number, channel in sorted(alpha_channels.items())
+        ]
+
+        return UsmInfo(
+            filename=usm_crid[0].get("filename").val.split("/")[-1],
+            filesize=filesize,
+            version=usm_crid[0].get("fmtver").val,
+            videos=videos,
+            audios=audios,
+            alphas=alphas,
+        )
+
+    def seek(
+        self,
+        frame: Optional[int] = None,
+        time: Optional[float] = None,
+        end_frame: Optional[int] = None,
+        end_time: Optional[float] = None,
+    ) -> UsmClip:
+        """Finds the span of the Usm starting at a frame or a time in seconds,
+        moved back to the nearest keyframe so it can be decoded on its own.
+        The span ends before end_frame or end_time, or at the end of the Usm.
+        Audio packets covering the same time span come along with the video.
+
+        Frames and keyframes are those of the first video, as read from its
+        VIDEO_SEEKINFO. Video times are frames at the frame rate and audio
+        times are counted in samples, see packet_times, so audio and video
+        stay in sync however the chunk headers were stamped.
+        Only available for a Usm loaded with Usm.open.
+
+        Raises:
+            ValueError: When neither or both frame and time are given, when
+                both end_frame and end_time are given, or when the span is
+                empty.
+        """
+        if (frame is None) == (time is None):
+            raise ValueError("Give either a frame or a time to seek to.")
+        if end_frame is not None and end_time is not None:
+            raise ValueError("Give either an end frame or an end time.")
+
+        video = self.videos[0]
+        if time is not None:
+            frame, _ = video.packet_range(time, time)
+        if end_time is not None:
+            _, end_frame = video.packet_range(end_time, end_time)
+
+        end = len(video) if end_frame is None else min(end_frame, len(video))
+        start = video.keyframe_before(min(frame, end - 1))
+        if start >= end or frame >= end:
+            raise ValueError(f"Empty span from frame {frame} to {end}.")
+
+        start_time = video.time_of(start)
+        clip_end_time = video.time_of(end)
+
+        audio_ranges = []
+        for audio in self.audios:
+            audio_start, audio_end = audio.packet_range(start_time, clip_end_time)
+            # Packets before the first frames, like an ADX or HCA header,
+            # share its time
+            if start == 0:
+                audio_start = 0
+            if end == len(video):
+                audio_end = len(audio)
+            audio_ranges.append((audio_start, audio_end))
+
+        video_ranges = [(start, min(end, len(other))) for other in self.videos]
+        alpha_ranges = [(start, min(end, len(alpha))) for alpha in self.alphas]
+
+        video_mode = OpMode.NONE if self.video_key is None else OpMode.DECRYPT
+        audio_mode = OpMode.NONE if self.audio_key is None else OpMode.DECRYPT
+        return UsmClip(
+            start_frame=start,
+            end_frame=end,
+            start_time=start_time,
+            end_time=clip_end_time,
+            video_ranges=video_ranges,
+            audio_ranges=audio_ranges,
+            alpha_ranges=alpha_ranges,
+            videos=[
+                media.packets(*packet_range, video_mode, self.video_key)
+                for media, packet_range in zip(self.videos, video_ranges)
+            ],
+            audios=[
+                media.packets(*packet_range, audio_mode, self.audio_key)
+                for media, packet_range in zip(self.audios, audio_ranges)
+            ],
+            alphas=[
+                media.packets(*packet_range, video_mode, self.video_key)
+                for media, packet_range in zip(self.alphas, alpha_ranges)
+            ],
+        )
 
     def demux(
         self,
@@ -262,8 +523,27 @@ class Usm:
         save_alpha: bool = True,
         save_pages: bool = False,
         folder_name: Optional[str] = None,
+        start_frame: Optional[int] = None,
+        start_time: Optional[float] = None,
+        end_frame: Optional[int] = None,
+        end_time: Optional[float] = None,
     ) -> Tuple[List[str], List[str]]:
-        """Saves all videos, audios, alpha videos, pages (depending on configuration) of a Usm."""
+        """Saves all videos, audios, alpha videos, pages (depending on configuration) of a Usm.
+
+        Given a start or an end frame or time, only the span found by Usm.seek
+        is read, decrypted and saved, as standalone files. See UsmVideo.clip
+        and UsmAudio.clip."""
+        clip: Optional[UsmClip] = None
+        if any(x is not None for x in (start_frame, start_time, end_frame, end_time)):
+            if start_frame is None and start_time is None:
+                start_frame = 0
+
+            clip = self.seek(start_frame, start_time, end_frame, end_time)
+            logging.info(
+                "Saving span of USM",
+                extra={"start_frame": clip.start_frame, "end_frame": clip.end_frame},
+            )
+
         if folder_name is None:
             folder_name = self.filename
 
@@ -278,7 +558,7 @@ class Usm:
         audios = []
         alphas = []
 
-        def save(usm_array, output_array, name, key):
+        def save(usm_array, output_array, name, key, ranges):
             if len(usm_array) == 0:
                 return
 
@@ -288,22 +568,27 @@ class Usm:
             if not os.path.exists(sub_output):
                 os.mkdir(sub_output)
 
-            for item in usm_array:
+            for i, item in enumerate(usm_array):
                 filename = os.path.join(sub_output, item.filename)
+                if clip is None:
+                    packets = item.stream(mode, key)
+                else:
+                    packets = item.clip(*ranges[i], mode, key)
+
                 with open(filename, "wb") as f:
-                    for packet in item.stream(mode, key):
+                    for packet in packets:
                         f.write(packet if type(packet) is not tuple else packet[0])
 
                 output_array.append(filename)
 
         if save_video:
-            save(self.videos, videos, "videos", self.video_key)
+            save(self.videos, videos, "videos", self.video_key, clip and clip.video_ranges)
 
         if save_audio:
-            save(self.audios, audios, "audios", self.audio_key)
+            save(self.audios, audios, "audios", self.audio_key, clip and clip.audio_ranges)
 
         if save_alpha:
-            save(self.alphas, alphas, "alphas", self.video_key)
+            save(self.alphas, alphas, "alphas", self.video_key, clip and clip.alpha_ranges)
 
         if save_pages:
             logging.info("Saving pages")
@@ -314,13 +599,14 @@ class Usm:
     def _generate_prestream_chunks(
         self,
         stream_filesize: int,
-        keyframe_index_and_offsets: dict,
+        seek_tables: Dict[int, SeekTable],
         encoding: str,
+        extra_padding: int = 0,
     ) -> Generator[UsmChunk, None, None]:
         header_metadata_chunks = []
         header_metadata_size = 0
         for chunk, position in _generate_header_metadata_chunks(
-            self.videos, self.audios, keyframe_index_and_offsets, encoding
+            self.videos, self.audios, seek_tables, encoding, extra_padding
         ):
             header_metadata_chunks.append(chunk)
             header_metadata_size = position
@@ -348,25 +634,141 @@ class Usm:
 
     def chunks(
         self, mode: OpMode = OpMode.NONE, encoding: str = "UTF-8"
+    ) -> Generator[UsmChunk, None, None]:
+        plan = _plan_stream(self.videos, self.audios, self.max_lead)
+        if plan is None:
+            yield from self._spooled_chunks(mode, encoding)
+            return
+
+        yield from self._planned_file_chunks(plan, mode, encoding)
+
+    def _planned_file_chunks(
+        self,
+        plan: Tuple[int, int, Dict[int, SeekTable]],
+        mode: OpMode,
+        encoding: str,
+    ) -> Generator[UsmChunk, None, None]:
+        """Generates every chunk of the Usm as laid out by a plan from _plan_stream."""
+        filesize, self._peak_buffer, seek_tables = plan
+
+        for chunk in self._generate_prestream_chunks(
+            stream_filesize=filesize,
+            seek_tables=seek_tables,
+            encoding=encoding,
+        ):
+            yield chunk
+
+        yield from _planned_chunks(
+            self.videos,
+            self.audios,
+            mode,
+            self.video_key,
+            self.audio_key,
+            filesize,
+            seek_tables,
+            self.max_lead,
+        )
+
+    def stream(
+        self, mode: OpMode = OpMode.NONE, encoding: str = "UTF-8"
+    ) -> Generator[bytes, None, None]:
+        """Generates the packed Usm. When the packet sizes of all videos and audios
+        are known beforehand, the file is laid out first and then written in a
+        single forward pass. Otherwise the stream is spooled to a temporary file."""
+        plan = _plan_stream(self.videos, self.audios, self.max_lead)
+        if plan is None:
+            yield from self._spooled_stream(mode, encoding)
+            return
+
+        for chunk in self._planned_file_chunks(plan, mode, encoding):
+            yield chunk.pack()
+
+    def write(
+        self,
+        usmfile: IO,
+        mode: OpMode = OpMode.NONE,
+        encoding: str = "UTF-8",
+        reserved_keyframes: int = 2048,
+    ) -> int:
+        """Packs the Usm into a seekable file while the packets of its videos
+        and audios are read, e.g. from Vp9.from_stream as the encoder runs.
+
+        The stream is written after a region reserved for the crid, header and
+        metadata chunks, sized for reserved_keyframes keyframes per video. They
+        are written last, once the seek tables are known, with the padding of
+        the last chunk filling the rest of the region. When they don't fit, the
+        stream is moved in a final fix-up pass instead.
+
+        Returns the size of the Usm."""
+        reserved_tables: Dict[int, SeekTable] = {}
+        for video in self.videos:
+            reserved_table = SeekTable()
+            for i in range(reserved_keyframes):
+                reserved_table.append(i, i)
+            reserved_tables[video.channel_number] = reserved_table
+
+        reserved_size = sum(
+            len(chunk)
+            for chunk in self._generate_prestream_chunks(0, reserved_tables, encoding)
+        )
+
+        usmfile.seek(reserved_size)
+        filesize, self._peak_buffer, seek_tables = _write_stream(
+            usmfile,
+            self.videos,
+            self.audios,
+            mode,
+            self.video_key,
+            self.audio_key,
+            self.max_lead,
+        )
+
+        chunks = list(self._generate_prestream_chunks(filesize, seek_tables, encoding))
+        prestream_size = sum(len(chunk) for chunk in chunks)
+        extra_padding = reserved_size - prestream_size
+        # Padding size is stored in 2 bytes
+        if 0 <= extra_padding <= 0xFFFF:
+            chunks = list(
+                self._generate_prestream_chunks(
+                    filesize, seek_tables, encoding, extra_padding
+                )
+            )
+            prestream_size = reserved_size
+        else:
+            logging.info(
+                "Moving stream to fit header",
+                extra={"reserved_size": reserved_size, "header_size": prestream_size},
+            )
+            _move_range(usmfile, reserved_size, prestream_size, filesize)
+            usmfile.truncate(prestream_size + filesize)
+
+        usmfile.seek(0)
+        for chunk in chunks:
+            usmfile.write(chunk.pack())
+
+        usmfile.seek(prestream_size + filesize)
+        return prestream_size + filesize
+
+    def _spooled_chunks(
+        self, mode: OpMode, encoding: str
     ) -> Generator[UsmChunk, None, None]:
         (
             stream_file,
             filesize,
-            max_packet_size,
-            keyframe_index_and_offsets,
+            self._peak_buffer,
+            seek_tables,
         ) = _pack_stream(
-            self.max_frame,
             self.videos,
             self.audios,
             mode,
             self.video_key,
             self.audio_key,
+            self.max_lead,
         )
-        self._max_packet_size = max_packet_size
 
         for chunk in self._generate_prestream_chunks(
             stream_filesize=filesize,
-            keyframe_index_and_offsets=keyframe_index_and_offsets,
+            seek_tables=seek_tables,
             encoding=encoding,
         ):
             yield chunk
@@ -380,27 +782,26 @@ class Usm:
             yield UsmChunk.from_bytes(stream_file.read(chunk_size), encoding=encoding)
             stream_file.seek(chunk_padding, 1)
 
-    def stream(
-        self, mode: OpMode = OpMode.NONE, encoding: str = "UTF-8"
+    def _spooled_stream(
+        self, mode: OpMode, encoding: str
     ) -> Generator[bytes, None, None]:
         (
             stream_file,
             filesize,
-            max_packet_size,
-            keyframe_index_and_offsets,
+            self._peak_buffer,
+            seek_tables,
         ) = _pack_stream(
-            self.max_frame,
             self.videos,
             self.audios,
             mode,
             self.video_key,
             self.audio_key,
+            self.max_lead,
         )
-        self._max_packet_size = max_packet_size
 
         for chunk in self._generate_prestream_chunks(
             stream_filesize=filesize,
-            keyframe_index_and_offsets=keyframe_index_and_offsets,
+            seek_tables=seek_tables,
             encoding=encoding,
         ):
             yield chunk.pack()
@@ -409,13 +810,161 @@ class Usm:
             yield stream_file.read(0x800)
 
 
+def crypt_usm_in_place(
+    filepath: Union[str, pathlib.Path],
+    mode: OpMode,
+    key: int,
+    encoding: str = "UTF-8",
+    workers: int = 1,
+) -> int:
+    """Encrypts or decrypts the stream payloads of a USM file in place through a
+    memory map. Payload sizes don't change, so only the payload ranges found by
+    the chunk index are rewritten. Header, metadata and padding bytes are left
+    alone. Returns the number of payloads processed.
+
+    Nothing in a USM tells whether it's encrypted, so encrypting an already
+    encrypted file will scramble it."""
+    video_key, audio_key = generate_keys(key)
+    if mode is OpMode.ENCRYPT:
+        crypt_video = functools.partial(encrypt_video_packet, video_key=video_key)
+        crypt_audio = functools.partial(encrypt_audio_packet, key=audio_key)
+    elif mode is OpMode.DECRYPT:
+        crypt_video = functools.partial(decrypt_video_packet, video_key=video_key)
+        crypt_audio = functools.partial(decrypt_audio_packet, key=audio_key)
+    else:
+        raise ValueError(f"Unknown mode {mode}.")
+
+    return _recrypt_in_place(filepath, crypt_video, crypt_audio, encoding, workers)
+
+
+def rekey_usm_in_place(
+    filepath: Union[str, pathlib.Path],
+    old_key: int,
+    new_key: int,
+    encoding: str = "UTF-8",
+    workers: int = 1,
+) -> int:
+    """Re-encrypts the stream payloads of a USM file from old_key to new_key in
+    place. See crypt_usm_in_place. Returns the number of payloads processed."""
+    rekey_video, rekey_audio = _rekeyers(old_key, new_key)
+    return _recrypt_in_place(filepath, rekey_video, rekey_audio, encoding, workers)
+
+
+def _rekeyers(
+    old_key: int, new_key: int
+) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """Returns functions that take a video and an audio payload encrypted
+    with old_key and return them encrypted with new_key."""
+    old_video_key, old_audio_key = generate_keys(old_key)
+    new_video_key, new_audio_key = generate_keys(new_key)
+
+    # Audio payloads are XORed with their key, so both keys fold into one.
+    audio_key = bytes(old ^ new for old, new in zip(old_audio_key, new_audio_key))
+
+    def rekey_video(packet: bytes) -> bytes:
+        return encrypt_video_packet(
+            decrypt_video_packet(packet, old_video_key), new_video_key
+        )
+
+    return rekey_video, functools.partial(encrypt_audio_packet, key=audio_key)
+
+
+def _stream_payloads(
+    tables: List[Tuple[PacketTable, bool]],
+) -> Iterator[Tuple[int, int, bool]]:
+    """Offset, size and whether it's audio of every stream payload in file
+    order, merged as they are read from the packet tables of every channel
+    and whether the channel is audio. Tables are in file order already."""
+    return heapq.merge(
+        *[
+            zip(table.offsets, table.sizes, itertools.repeat(is_audio))
+            for table, is_audio in tables
+        ]
+    )
+
+
+def _recrypt_payloads(
+    read: Callable[[int, int], bytes],
+    payloads: Iterable[Tuple[int, int, bool]],
+    crypt_video: Callable[[bytes], bytes],
+    crypt_audio: Callable[[bytes], bytes],
+    workers: int = 1,
+) -> Generator[Tuple[int, int, bytes], None, None]:
+    """Generates the offset, size and transformed data of every payload in
+    order. With more than one worker, payloads are transformed on a thread
+    pool a bounded window at a time so memory use stays flat."""
+
+    def recrypt(payload: Tuple[int, int, bool]) -> bytes:
+        offset, size, is_audio = payload
+        data = read(offset, size)
+        return crypt_audio(data) if is_audio else crypt_video(data)
+
+    if workers <= 1:
+        for payload in payloads:
+            yield payload[0], payload[1], recrypt(payload)
+        return
+
+    window = workers * 4
+    payloads = iter(payloads)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(itertools.islice(payloads, window))
+            if len(batch) == 0:
+                break
+
+            for payload, data in zip(batch, executor.map(recrypt, batch)):
+                yield payload[0], payload[1], data
+
+
+def _recrypt_in_place(
+    filepath: Union[str, pathlib.Path],
+    crypt_video: Callable[[bytes], bytes],
+    crypt_audio: Callable[[bytes], bytes],
+    encoding: str,
+    workers: int,
+) -> int:
+    filesize = os.path.getsize(filepath)
+    if filesize <= 0x20:
+        raise ValueError(f"File {filepath} too small.")
+
+    with open(filepath, "r+b") as usmfile:
+        signature = usmfile.read(4)
+        if not is_usm(signature):
+            raise ValueError(f"Invalid file signature: {bytes_to_hex(signature)}")
+
+        _, video_channels, audio_channels, alpha_channels = _process_chunks(
+            usmfile, filesize, encoding
+        )
+        payloads = _stream_payloads(
+            [(channel.stream, False) for channel in video_channels.values()]
+            + [(channel.stream, False) for channel in alpha_channels.values()]
+            + [(channel.stream, True) for channel in audio_channels.values()]
+        )
+
+        count = 0
+        with mmap.mmap(usmfile.fileno(), 0) as mapped:
+            for offset, size, data in _recrypt_payloads(
+                lambda offset, size: mapped[offset : offset + size],
+                payloads,
+                crypt_video,
+                crypt_audio,
+                workers,
+            ):
+                mapped[offset : offset + size] = data
+                count += 1
+
+            mapped.flush()
+
+    return count
+
+
 def _chunk_helper(default_dict_ch: Dict[int, UsmChannel], chunk: UsmChunk, offset: int):
     """Helper function for _process_chunks. Fills default_dict_ch with information about
     the passed chunk and offset."""
     if chunk.payload_type == PayloadType.STREAM:
-        default_dict_ch[chunk.channel_number].stream.append(
-            (offset + chunk.payload_offset, len(chunk.payload))
-        )
+        packets = default_dict_ch[chunk.channel_number].stream
+        packets.append(offset + chunk.payload_offset, len(chunk.payload), chunk.frame_time)
+        packets.rate = chunk.frame_rate
     elif chunk.payload_type == PayloadType.SECTION_END:
         logging.debug(
             f"{chunk.chunk_type} section end",
@@ -436,37 +985,96 @@ def _process_chunks(
         usmfile: IO,
         filesize: int,
         encoding: str,
+        header_only: bool = True,
+        until_stream: bool = False,
+        damaged: Optional[List[Tuple[int, int]]] = None,
 ) -> Tuple[List[UsmPage], Dict[int, UsmChannel], Dict[int, UsmChannel], Dict[int, UsmChannel]]:
     """Helper function that reads all the chunks in a USM file and returns a tuple of
     1. A list of USM pages about the contents of the USM file.
     2. A dictionary of USM video channels.
     3. A dictionary of USM audio channels.
-    4. A dictionary of USM alpha video channels."""
+    4. A dictionary of USM alpha video channels.
+
+    When header_only is set, stream chunks are indexed from their 0x20 byte header
+    and their payloads are skipped. Other chunks are always fully parsed.
+
+    When until_stream is set, reading stops at the first stream chunk. Only the
+    CRID, header and metadata sections at the front of the file are read then.
+
+    When a damaged list is given, invalid chunks are skipped by scanning forward
+    for the next valid chunk header, and the skipped byte ranges are appended
+    to the list."""
     crids: List[UsmPage] = []
     video_ch: Dict[int, UsmChannel] = defaultdict(
-        lambda: UsmChannel(stream=[], header=UsmPage(""))
+        lambda: UsmChannel(stream=PacketTable(), header=UsmPage(""))
     )
     audio_ch: Dict[int, UsmChannel] = defaultdict(
-        lambda: UsmChannel(stream=[], header=UsmPage(""))
+        lambda: UsmChannel(stream=PacketTable(), header=UsmPage(""))
+    )
+    alpha_ch: Dict[int, UsmChannel] = defaultdict(
+        lambda: UsmChannel(stream=PacketTable(), header=UsmPage(""))
     )
-    alpha_ch: Dict[int, UsmChannel] = defaultdict(lambda: UsmChannel(stream=[], header=UsmPage("")))
+    channels = {
+        ChunkType.VIDEO: video_ch,
+        ChunkType.AUDIO: audio_ch,
+        ChunkType.ALPHA: alpha_ch,
+    }
 
     usmfile.seek(0, 0)
-    while filesize > usmfile.tell():
-        # Peek to read chunk's true size and _padding.
+    offset = 0
+    while filesize > offset:
         temp_buf = usmfile.read(0x20)
-        usmfile.seek(-0x20, 1)
+        if damaged is not None:
+            valid_header = _valid_chunk_header(temp_buf, offset, filesize)
+            if valid_header is None:
+                next_offset = _find_chunk(usmfile, offset + 1, filesize)
+                _skip_damaged(damaged, offset, next_offset)
+                offset = next_offset
+                usmfile.seek(offset, 0)
+                continue
 
-        chunk_size, chunk_padding = chunk_size_and_padding(temp_buf)
-        offset = usmfile.tell()
+            header = valid_header
+        else:
+            try:
+                header = ChunkHeader.from_bytes(temp_buf)
+            except ValueError as e:
+                # If in debug mode, continue gathering information about the problematic usm
+                if logging.root.level <= logging.DEBUG and len(temp_buf) == 0x20:
+                    logging.error(e, extra={"offset": offset})
+                    offset += 0x08 + int.from_bytes(temp_buf[0x4:0x8], "big")
+                    usmfile.seek(offset, 0)
+                    continue
+                else:
+                    raise
+
+        if until_stream and header.payload_type is PayloadType.STREAM:
+            break
+
+        if (
+            header_only
+            and header.payload_type is PayloadType.STREAM
+            and header.chunk_type in channels
+        ):
+            payload_size = min(header.payload_size, filesize - offset - header.payload_begin)
+            packets = channels[header.chunk_type][header.channel_number].stream
+            packets.append(offset + header.payload_begin, payload_size, header.frame_time)
+            packets.rate = header.frame_rate
+            offset += header.size
+            usmfile.seek(offset, 0)
+            continue
 
-        # Read chunk payload and the 0x20 byte chunk header. Then skip _padding.
-        data = usmfile.read(chunk_size + 0x20)
-        usmfile.seek(chunk_padding, 1)
+        # Read chunk payload with the 0x20 byte chunk header. Then skip _padding.
+        data = temp_buf + usmfile.read(header.payload_begin - 0x20 + header.payload_size)
+        chunk_offset = offset
+        offset += header.size
+        usmfile.seek(offset, 0)
 
         try:
             chunk = UsmChunk.from_bytes(data, encoding=encoding)
         except ValueError as e:
+            if damaged is not None:
+                _skip_damaged(damaged, chunk_offset, offset)
+                continue
             # If in debug mode, continue gathering information about the problematic usm
             if logging.root.level <= logging.DEBUG:
                 logging.error(e)
@@ -482,27 +1090,79 @@ def _process_chunks(
                     "Received info chunk payload that's not a list",
                     extra={"payload": chunk.payload},
                 )
-        # Video chunk
-        elif chunk.chunk_type is ChunkType.VIDEO:
-            _chunk_helper(video_ch, chunk, offset)
+        else:
+            _chunk_helper(channels[chunk.chunk_type], chunk, chunk_offset)
 
-        # Alpha chunk
-        elif chunk.chunk_type is ChunkType.ALPHA:
-            _chunk_helper(alpha_ch, chunk, offset)
+    return crids, video_ch, audio_ch, alpha_ch
 
-        # Audio chunk
-        elif chunk.chunk_type is ChunkType.AUDIO:
-            _chunk_helper(audio_ch, chunk, offset)
 
-    return crids, video_ch, audio_ch, alpha_ch
+_CHUNK_SIGNATURES = (b"CRID", b"@SFV", b"@SFA", b"@ALP")
+
+
+def _valid_chunk_header(data: bytes, offset: int, filesize: int) -> Optional[ChunkHeader]:
+    """Parses a chunk header at offset, or returns None when it's invalid or
+    doesn't fit in the file. Payloads always start 0x18 bytes after the size
+    field, and the padding has to fit in the chunk."""
+    try:
+        header = ChunkHeader.from_bytes(data)
+    except ValueError:
+        return None
+
+    if (
+        header.payload_offset != 0x18
+        or header.padding_size > header.chunksize - header.payload_offset
+        or offset + header.size > filesize
+    ):
+        return None
+
+    return header
+
+
+def _find_chunk(usmfile: IO, start: int, filesize: int, block_size: int = 0x100000) -> int:
+    """Scans forward from start for the next valid chunk header, in blocks
+    searched for every chunk signature with bytes.find. Returns its offset,
+    or filesize when there's none."""
+    position = start
+    while position < filesize:
+        usmfile.seek(position, 0)
+        # Overlap blocks so headers starting in this block are read whole
+        block = usmfile.read(block_size + 0x1F)
+        # Next occurrence of every signature in the block
+        found = {signature: block.find(signature) for signature in _CHUNK_SIGNATURES}
+        while True:
+            candidates = [index for index in found.values() if 0 <= index < block_size]
+            if len(candidates) == 0:
+                break
+
+            index = min(candidates)
+            if _valid_chunk_header(block[index : index + 0x20], position + index, filesize):
+                return position + index
+
+            signature = bytes(block[index : index + 4])
+            found[signature] = block.find(signature, index + 1)
+
+        position += block_size
+
+    return filesize
+
+
+def _skip_damaged(damaged: List[Tuple[int, int]], start: int, end: int):
+    logging.warning("Skipping damaged bytes", extra={"start": start, "end": end})
+    if len(damaged) > 0 and damaged[-1][1] == start:
+        damaged[-1] = (damaged[-1][0], end)
+    else:
+        damaged.append((start, end))
 
 
 def _generate_header_metadata_chunks(
     videos: List[UsmVideo],
     audios: List[UsmAudio],
-    keyframe_index_and_offsets: Dict[int, List[Tuple[int, int]]],
+    seek_tables: Dict[int, SeekTable],
     encoding: str,
+    extra_padding: int = 0,
 ) -> Generator[Tuple[UsmChunk, int], None, None]:
+    """Generates the header and metadata chunks with the position after each.
+    extra_padding is added to the last chunk, before the stream."""
     current_position = 0
     # ========= YIELD HEADER PAGE CHUNKS ==========
 
@@ -573,29 +1233,21 @@ def _generate_header_metadata_chunks(
 
     for video in videos:
         if video.metadata_pages is None:
-            index_and_offsets = keyframe_index_and_offsets[video.channel_number]
-            metadata_pages: List[UsmPage] = []
-            for index, offset in index_and_offsets:
-                page = UsmPage("VIDEO_SEEKINFO")
-                # ofs_byte is modified later
-                page.update("ofs_byte", ElementType.LONGLONG, offset)
-                page.update("ofs_frmid", ElementType.UINT, index)
-                page.update("num_skip", ElementType.USHORT, 0)
-                page.update("resv", ElementType.USHORT, 0)
-                metadata_pages.append(page)
+            seek_table = seek_tables[video.channel_number]
         else:
-            metadata_pages = video.metadata_pages
+            seek_table = SeekTable.from_pages(video.metadata_pages)
 
+        # ofs_byte is set later. Its size doesn't change
         chunk = UsmChunk(
             chunk_type=ChunkType.VIDEO,
             payload_type=PayloadType.METADATA,
-            payload=metadata_pages,
+            payload=seek_table.to_pages(),
             padding=metadata_pad,
             channel_number=video.channel_number,
             encoding=encoding,
         )
         metadata_section_size += len(chunk)
-        metadata_section_chunks_vid.append(chunk)
+        metadata_section_chunks_vid.append((chunk, seek_table))
 
     for audio in audios:
         if audio.metadata_pages is None:
@@ -613,28 +1265,20 @@ def _generate_header_metadata_chunks(
         metadata_section_chunks_aud.append(chunk)
 
     metadata_end_payload = bytes("#METADATA END   ===============", "UTF-8") + bytes(1)
-    for video in videos:
+    metadata_end_channels = [(ChunkType.VIDEO, video.channel_number) for video in videos]
+    metadata_end_channels += [
+        (ChunkType.AUDIO, audio.channel_number)
+        for audio in audios
+        if audio.metadata_pages is not None
+    ]
+    for i, (chunk_type, channel_number) in enumerate(metadata_end_channels):
         chunk = UsmChunk(
-            chunk_type=ChunkType.VIDEO,
+            chunk_type=chunk_type,
             payload_type=PayloadType.SECTION_END,
             payload=metadata_end_payload,
-            padding=0,  # Based from real USMs
-            channel_number=video.channel_number,
-            encoding=encoding,
-        )
-        metadata_section_size += len(chunk)
-        metadata_section_chunks_sec_end.append(chunk)
-
-    for audio in audios:
-        if audio.metadata_pages is None:
-            continue
-
-        chunk = UsmChunk(
-            chunk_type=ChunkType.AUDIO,
-            payload_type=PayloadType.SECTION_END,
-            payload=metadata_end_payload,
-            padding=0,  # Based from real USMs
-            channel_number=audio.channel_number,
+            # Based from real USMs. The last one takes any extra padding
+            padding=extra_padding if i == len(metadata_end_channels) - 1 else 0,
+            channel_number=channel_number,
             encoding=encoding,
         )
         metadata_section_size += len(chunk)
@@ -642,18 +1286,12 @@ def _generate_header_metadata_chunks(
 
     # ========= YIELD METADATA CHUNKS ==========
 
-    for chunk in metadata_section_chunks_vid:
-        payload = chunk.payload
-        if isinstance(payload, bytes):
-            raise ValueError("Video metadata is not list of pages.")
-        else:
-            # Add 0x800(crid chunks and _padding) and the size of the entire
-            # metadata section to offsets of stream file
-            for metadata in payload:
-                offset = metadata["ofs_byte"].val
-                offset += 0x800 + current_position + metadata_section_size
-                metadata.update("ofs_byte", ElementType.LONGLONG, offset)
-
+    for chunk, seek_table in metadata_section_chunks_vid:
+        # Add 0x800(crid chunks and _padding) and the size of the entire
+        # metadata section to offsets of stream file
+        chunk.payload = seek_table.shifted(
+            0x800 + current_position + metadata_section_size
+        ).to_pages()
         yield chunk, current_position + metadata_section_size
 
     for chunk in metadata_section_chunks_aud:
@@ -663,66 +1301,243 @@ def _generate_header_metadata_chunks(
         yield chunk, current_position + metadata_section_size
 
 
-def _pack_stream(
-    max_frames: int,
+def _packet_time(
+    media: Union[UsmVideo, UsmAudio], index: int, framerate: float
+) -> float:
+    """The time in seconds of a packet from the media's packet table. Without
+    timestamps, packets are taken to be frames at the given frame rate."""
+    table = media.packet_table
+    if table is not None and table.rate > 0 and len(table) == len(media):
+        return table.timestamps[index] / table.rate
+
+    return index / framerate
+
+
+def _media_framerates(videos: List[UsmVideo], audios: List[UsmAudio]) -> List[float]:
+    """Frame rate of every video, and of the first video for every audio,
+    so audio packets without timestamps are taken to last a video frame."""
+    default_framerate = videos[0].framerate if len(videos) > 0 else 30
+    return [
+        *[video.framerate for video in videos],
+        *[default_framerate for _ in audios],
+    ]
+
+
+def _packet_times(
+    media: Union[UsmVideo, UsmAudio], framerate: float
+) -> Iterator[float]:
+    """The time in seconds of every packet of a video or audio, read as they
+    are needed from the timestamp column of its packet table. See _packet_time."""
+    table = media.packet_table
+    if table is not None and table.rate > 0 and len(table) == len(media):
+        rate = table.rate
+        times = (timestamp / rate for timestamp in table.timestamps)
+    else:
+        times = (index / framerate for index in range(len(media)))
+
+    # Streams are merged in order, so times can't go backwards
+    return itertools.accumulate(times, max)
+
+
+def _interleave_chunks(
     videos: List[UsmVideo],
     audios: List[UsmAudio],
     mode: OpMode = OpMode.NONE,
     video_key: Optional[bytes] = None,
     audio_key: Optional[bytes] = None,
-) -> Tuple[IO, int, int, Dict[int, List[Tuple[int, int]]]]:
-    videos_iter: List[Callable[[], Tuple[List[UsmChunk], bool]]] = [
-        vid.chunks(mode=mode, key=video_key).__next__ for vid in videos
+    max_lead: float = 0.0,
+) -> Generator[Tuple[int, List[UsmChunk], bool, float], None, None]:
+    """Generates the stream chunks of every video and audio in file order, as laid
+    out by interleave from the packet times. Yields the packet index, the chunks
+    of a packet, whether the packet is a video keyframe, and the packet time.
+
+    Every stream is read one packet ahead of what has been yielded, so streams
+    whose length is only known once they end, like Vp9.from_stream, work too."""
+    streams: List[Union[UsmVideo, UsmAudio]] = [*videos, *audios]
+    framerates = _media_framerates(videos, audios)
+    chunk_iters: List[Iterator[Tuple[List[UsmChunk], bool]]] = [
+        *[vid.chunks(mode=mode, key=video_key) for vid in videos],
+        *[
+            ((chunks, False) for chunks in aud.chunks(mode=mode, key=audio_key))
+            for aud in audios
+        ],
     ]
-    audios_iter: List[Callable[[], List[UsmChunk]]] = [
-        aud.chunks(mode=mode, key=audio_key).__next__ for aud in audios
+    # Chunks read ahead by stream_times along with their packet time
+    pending: List[Deque[Tuple[List[UsmChunk], bool, float]]] = [
+        deque() for _ in streams
     ]
 
-    stream_file = TemporaryFile("wb+")
-    keyframe_index_and_offsets: Dict[int, List[Tuple[int, int]]] = defaultdict(
-        lambda: list()
-    )
-    max_packet_size = 1
-    for index in range(max_frames):
-        finished_video_iters = []
-        finished_audio_iters = []
+    def stream_times(stream: int) -> Generator[float, None, None]:
+        time = 0.0
+        for index, (chunks, is_keyframe) in enumerate(chunk_iters[stream]):
+            # Streams are merged in order, so times can't go backwards
+            time = max(time, _packet_time(streams[stream], index, framerates[stream]))
+            pending[stream].append((chunks, is_keyframe, time))
+            yield time
 
-        # Process videos generators
-        for i, vid_tuple in enumerate(videos_iter):
-            try:
-                chunks, is_keyframe = vid_tuple()
-                if is_keyframe:
-                    keyframe_index_and_offsets[chunks[0].channel_number].append(
-                        (index, stream_file.tell())
-                    )
-
-                for chunk in chunks:
-                    max_packet_size = max(len(chunk), max_packet_size)
-                    stream_file.write(chunk.pack())
-            except StopIteration:
-                finished_video_iters.append(i)
-                continue
+    for stream, index in interleave(
+        [stream_times(stream) for stream in range(len(streams))], max_lead
+    ):
+        chunks, is_keyframe, time = pending[stream].popleft()
+        yield index, chunks, is_keyframe, time
 
-        # Process audios generators
-        for i, aud_chunk in enumerate(audios_iter):
-            try:
-                chunks = aud_chunk()
-                for chunk in chunks:
-                    max_packet_size = max(len(chunk), max_packet_size)
-                    stream_file.write(chunk.pack())
-            except StopIteration:
-                finished_audio_iters.append(i)
-                continue
 
-        # Remove finished audios generators
-        videos_iter = [
-            vid for i, vid in enumerate(videos_iter) if i not in finished_video_iters
-        ]
-        audios_iter = [
-            aud for i, aud in enumerate(audios_iter) if i not in finished_audio_iters
-        ]
+def _stream_chunk_size(payload_size: int) -> int:
+    """Packed size of a stream chunk as generated by UsmVideo and UsmAudio's chunks."""
+    padding_size = 0x20 - (payload_size % 0x20) if payload_size % 0x20 != 0 else 0
+    return 0x20 + payload_size + padding_size
 
+
+def _plan_stream(
+    videos: List[UsmVideo],
+    audios: List[UsmAudio],
+    max_lead: float = 0.0,
+) -> Optional[Tuple[int, int, Dict[int, SeekTable]]]:
+    """Lays out the stream that _interleave_chunks generates from the known packet
+    sizes of every video and audio. Returns the stream size, the peak buffer
+    occupancy, and the seek table of every video channel. Returns None when
+    a video or audio doesn't know its packet sizes beforehand."""
+    for media in [*videos, *audios]:
+        if media.packet_sizes is None or len(media.packet_sizes) != len(media):
+            return None
+
+    for video in videos:
+        if video.keyframes is None:
+            return None
+
+    # Two chunks are generated at the last packet. The second one is a SECTION_END
+    section_end_size = 0x40
+    streams: List[Union[UsmVideo, UsmAudio]] = [*videos, *audios]
+    framerates = _media_framerates(videos, audios)
+    keyframes = [set(video.keyframes) for video in videos]
+    # Times read ahead by interleave, until their packet is laid out
+    pending: List[Deque[float]] = [deque() for _ in streams]
+
+    def stream_times(stream: int) -> Generator[float, None, None]:
+        for time in _packet_times(streams[stream], framerates[stream]):
+            pending[stream].append(time)
+            yield time
+
+    seek_tables: Dict[int, SeekTable] = defaultdict(SeekTable)
+    chunk_times = array("d")
+    chunk_sizes = array("Q")
+    position = 0
+    for stream, index in interleave(
+        [stream_times(stream) for stream in range(len(streams))], max_lead
+    ):
+        media = streams[stream]
+        if stream < len(videos) and index in keyframes[stream]:
+            seek_tables[media.channel_number].append(index, position)
+
+        size = _stream_chunk_size(media.packet_sizes[index])
+        if index == len(media) - 1:
+            size += section_end_size
+
+        chunk_times.append(pending[stream].popleft())
+        chunk_sizes.append(size)
+        position += size
+
+    return position, peak_buffer(chunk_times, chunk_sizes), seek_tables
+
+
+def _planned_chunks(
+    videos: List[UsmVideo],
+    audios: List[UsmAudio],
+    mode: OpMode,
+    video_key: Optional[bytes],
+    audio_key: Optional[bytes],
+    filesize: int,
+    seek_tables: Dict[int, SeekTable],
+    max_lead: float = 0.0,
+) -> Generator[UsmChunk, None, None]:
+    """Generates the stream chunks laid out by _plan_stream. Raises ValueError when
+    the packets don't match the plan, since the header has already been written."""
+    planned_offsets = {
+        channel_number: dict(seek_table)
+        for channel_number, seek_table in seek_tables.items()
+    }
+    position = 0
+    for index, chunks, is_keyframe, _ in _interleave_chunks(
+        videos, audios, mode, video_key, audio_key, max_lead
+    ):
+        if is_keyframe:
+            offset = planned_offsets[chunks[0].channel_number].get(index)
+            if offset != position:
+                raise ValueError(
+                    f"Keyframe {index} of video ch {chunks[0].channel_number} "
+                    f"is at {position} instead of planned offset {offset}."
+                )
+
+        for chunk in chunks:
+            position += len(chunk)
+            yield chunk
+
+    if position != filesize:
+        raise ValueError(f"Stream size is {position} instead of planned {filesize}.")
+
+
+def _write_stream(
+    stream_file: IO,
+    videos: List[UsmVideo],
+    audios: List[UsmAudio],
+    mode: OpMode = OpMode.NONE,
+    video_key: Optional[bytes] = None,
+    audio_key: Optional[bytes] = None,
+    max_lead: float = 0.0,
+) -> Tuple[int, int, Dict[int, SeekTable]]:
+    """Writes the stream chunks at the current position of a file. Returns the
+    stream size, the peak buffer occupancy, and the seek table of every video
+    channel, with offsets from the start of the stream."""
+    seek_tables: Dict[int, SeekTable] = defaultdict(SeekTable)
+    chunk_times = array("d")
+    chunk_sizes = array("Q")
+    position = 0
+    for index, chunks, is_keyframe, time in _interleave_chunks(
+        videos, audios, mode, video_key, audio_key, max_lead
+    ):
+        if is_keyframe:
+            seek_tables[chunks[0].channel_number].append(index, position)
+
+        size = 0
+        for chunk in chunks:
+            packed = chunk.pack()
+            size += len(packed)
+            stream_file.write(packed)
+
+        chunk_times.append(time)
+        chunk_sizes.append(size)
+        position += size
+
+    return position, peak_buffer(chunk_times, chunk_sizes), seek_tables
+
+
+def _pack_stream(
+    videos: List[UsmVideo],
+    audios: List[UsmAudio],
+    mode: OpMode = OpMode.NONE,
+    video_key: Optional[bytes] = None,
+    audio_key: Optional[bytes] = None,
+    max_lead: float = 0.0,
+) -> Tuple[IO, int, int, Dict[int, SeekTable]]:
+    """Writes the stream chunks to a temporary file. Returns it with the stream
+    size, the peak buffer occupancy, and the seek table of every video channel."""
+    stream_file = TemporaryFile("wb+")
+    filesize, peak, seek_tables = _write_stream(
+        stream_file, videos, audios, mode, video_key, audio_key, max_lead
+    )
     stream_file.flush()
-    filesize = stream_file.tell()
     stream_file.seek(0, 0)
-    return stream_file, filesize, max_packet_size, keyframe_index_and_offsets
+    return stream_file, filesize, peak, seek_tables
+
+
+def _move_range(
+    usmfile: IO, source: int, destination: int, size: int, block_size: int = 0x100000
+) -> None:
+    """Moves size bytes of a file from source to destination. Blocks are copied
+    from the end when moving forward, so overlapping ranges work."""
+    starts = range(0, size, block_size)
+    for start in reversed(starts) if destination > source else starts:
+        usmfile.seek(source + start)
+        block = usmfile.read(min(block_size, size - start))
+        usmfile.seek(destination + start)
+        usmfile.write(block)
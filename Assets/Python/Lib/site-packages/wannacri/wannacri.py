@@ -1,20 +1,36 @@
 import logging
 import os
 import argparse
+import json
 import pathlib
 import platform
 import shutil
 import string
 import tempfile
 import random
-from typing import List, Optional
+import sys
+from typing import List, Optional, Tuple, Union
 
 import ffmpeg
 from pythonjsonlogger import jsonlogger
 
 import wannacri
 from .codec import Sofdec2Codec
-from .usm import is_usm, Usm, Vp9, H264, OpMode, generate_keys
+from .encode import encode_vp9
+from .usm import (
+    is_usm,
+    Usm,
+    Vp9,
+    H264,
+    Adx,
+    Hca,
+    OpMode,
+    generate_keys,
+    crypt_usm_in_place,
+    rekey_usm_in_place,
+    demux_stream,
+    ProbeCache,
+)
 
 
 def create_usm():
@@ -29,8 +45,13 @@ def create_usm():
     parser.add_argument(
         "input",
         metavar="input file path",
-        type=existing_file,
-        help="Path to video file.",
+        type=str,
+        help="Path to video file. With --stdin, the name of the video, which also names the USM.",
+    )
+    parser.add_argument(
+        "--stdin",
+        action="store_true",
+        help="Read a VP9 ivf from stdin, e.g. piped from ffmpeg, and mux it while it is being encoded.",
     )
     parser.add_argument(
         "-e",
@@ -55,25 +76,178 @@ def create_usm():
     parser.add_argument(
         "-k", "--key", type=key, default=None, help="Encryption key for encrypted USMs."
     )
+    parser.add_argument(
+        "-a",
+        "--audio",
+        type=existing_file,
+        action="append",
+        default=[],
+        help="Path to an ADX or HCA file to add as an audio channel. Can be given more than once.",
+    )
+    parser.add_argument(
+        "--probe-cache",
+        type=dir_path,
+        default=None,
+        help="Folder to keep ffprobe results in, so unchanged files aren't probed again.",
+    )
     args = parser.parse_args()
+    probe_cache = ProbeCache(folder=args.probe_cache)
+
+    if not args.stdin:
+        existing_file(args.input)
 
     ffprobe_path = find_ffprobe(args.ffprobe)
 
     # TODO: Add support for more video codecs and audio codecs
-    codec = Sofdec2Codec.from_file(args.input)
-    if codec is Sofdec2Codec.VP9:
-        video = Vp9(args.input, ffprobe_path=ffprobe_path)
-    elif codec is Sofdec2Codec.H264:
-        video = H264(args.input, ffprobe_path=ffprobe_path)
+    if args.stdin:
+        video = Vp9.from_stream(sys.stdin.buffer, os.path.basename(args.input))
     else:
-        raise NotImplementedError("Non-Vp9/H.264 files are not yet implemented.")
+        codec = Sofdec2Codec.from_file(args.input, probe_cache=probe_cache)
+        if codec is Sofdec2Codec.VP9:
+            video = Vp9(args.input)
+        elif codec is Sofdec2Codec.H264:
+            video = H264(args.input, ffprobe_path=ffprobe_path, probe_cache=probe_cache)
+        else:
+            raise NotImplementedError("Non-Vp9/H.264 files are not yet implemented.")
 
     filename = os.path.splitext(args.input)[0]
 
-    usm = Usm(videos=[video], key=args.key)
-    with open(filename + ".usm", "wb") as f:
-        mode = OpMode.NONE if args.key is None else OpMode.ENCRYPT
+    audios = [
+        open_audio(path, channel_number=i) for i, path in enumerate(args.audio)
+    ]
+
+    usm = Usm(videos=[video], audios=audios, key=args.key)
+    mode = OpMode.NONE if args.key is None else OpMode.ENCRYPT
+    if args.stdin:
+        # The header is written last, once the encoder closes the pipe
+        with open(filename + ".usm", "wb+") as f:
+            usm.write(f, mode, encoding=args.encoding)
+    else:
+        with open(filename + ".usm", "wb") as f:
+            for packet in usm.stream(mode, encoding=args.encoding):
+                f.write(packet)
 
+    print("Done creating USM file.")
+
+
+def encode_usm():
+    """One of the main functions in the command-line program. Encodes a video to
+    VP9 in keyframe segments on parallel FFmpeg processes, then creates a USM."""
+    parser = argparse.ArgumentParser("WannaCRI Encode USM", allow_abbrev=False)
+    parser.add_argument(
+        "operation",
+        metavar="operation",
+        type=str,
+        choices=OP_LIST,
+        help="Specify operation.",
+    )
+    parser.add_argument(
+        "input",
+        metavar="input file path",
+        type=existing_file,
+        help="Path to video file in any format FFmpeg reads.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=dir_path,
+        default=None,
+        help="Output path for the ivf and USM. Defaults to the same place as input.",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        type=str,
+        default="shift-jis",
+        help="Character encoding used in creating USM. Defaults to shift-jis.",
+    )
+    parser.add_argument(
+        "-k", "--key", type=key, default=None, help="Encryption key for encrypted USMs."
+    )
+    parser.add_argument(
+        "-a",
+        "--audio",
+        type=existing_file,
+        action="append",
+        default=[],
+        help="Path to an ADX or HCA file to add as an audio channel. Can be given more than once.",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of FFmpeg processes encoding at once. Defaults to the number of cores.",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=None,
+        help="Number of segments to split the video into. Defaults to one per worker.",
+    )
+    parser.add_argument(
+        "--crf", type=int, default=20, help="VP9 constant rate factor. Defaults to 20."
+    )
+    parser.add_argument(
+        "--bitrate",
+        type=int,
+        default=None,
+        help="VP9 target bitrate in bits per second. Defaults to constant quality.",
+    )
+    parser.add_argument(
+        "--speed", type=int, default=4, help="libvpx speed. Defaults to 4."
+    )
+    parser.add_argument(
+        "--vf", type=str, default=None, help="FFmpeg video filter applied while encoding."
+    )
+    parser.add_argument(
+        "--ffmpeg",
+        type=str,
+        default=".",
+        help="Path to ffmpeg executable or directory. Defaults to CWD.",
+    )
+    parser.add_argument(
+        "--ffprobe",
+        type=str,
+        default=".",
+        help="Path to ffprobe executable or directory. Defaults to CWD.",
+    )
+    parser.add_argument(
+        "--probe-cache",
+        type=dir_path,
+        default=None,
+        help="Folder to keep ffprobe results in, so unchanged files aren't probed again.",
+    )
+    args = parser.parse_args()
+    probe_cache = ProbeCache(folder=args.probe_cache)
+
+    name = os.path.splitext(os.path.basename(args.input))[0]
+    output = os.path.dirname(args.input) if args.output is None else args.output
+    if args.output is not None:
+        os.makedirs(output, exist_ok=True)
+
+    ivf_path = os.path.join(output, name + ".ivf")
+    num_frames = encode_vp9(
+        args.input,
+        ivf_path,
+        workers=args.workers,
+        num_segments=args.segments,
+        crf=args.crf,
+        bitrate=args.bitrate,
+        speed=args.speed,
+        video_filter=args.vf,
+        ffmpeg_path=find_ffmpeg(args.ffmpeg),
+        ffprobe_path=find_ffprobe(args.ffprobe),
+        probe_cache=probe_cache,
+    )
+    print(f"Encoded {num_frames} frames.")
+
+    audios = [
+        open_audio(path, channel_number=i) for i, path in enumerate(args.audio)
+    ]
+    usm = Usm(videos=[Vp9(ivf_path)], audios=audios, key=args.key)
+    with open(os.path.join(output, name + ".usm"), "wb") as f:
+        mode = OpMode.NONE if args.key is None else OpMode.ENCRYPT
         for packet in usm.stream(mode, encoding=args.encoding):
             f.write(packet)
 
@@ -94,8 +268,8 @@ def extract_usm():
     parser.add_argument(
         "input",
         metavar="input file/folder",
-        type=existing_path,
-        help="Path to USM file or path.",
+        type=existing_path_or_stdin,
+        help="Path to USM file or path. Use - to read a single USM from stdin.",
     )
     parser.add_argument(
         "-k", "--key", type=key, default=None, help="Decryption key for encrypted USMs."
@@ -122,28 +296,71 @@ def extract_usm():
         default="./output",
         help="Output path. Defaults to a folder named output in CWD.",
     )
+    parser.add_argument(
+        "--recover",
+        action="store_true",
+        help="Skip damaged chunks of broken USMs and list the skipped byte ranges.",
+    )
+    parser.add_argument(
+        "--start",
+        type=clip_position,
+        default=None,
+        help="Extract from this frame, or time given as 12.5s or [hh:]mm:ss. "
+        "Moved back to the nearest keyframe.",
+    )
+    parser.add_argument(
+        "--end",
+        type=clip_position,
+        default=None,
+        help="Extract up to this frame, or time given as 12.5s or [hh:]mm:ss.",
+    )
     args = parser.parse_args()
 
+    if args.input == "-":
+        if args.start is not None or args.end is not None:
+            parser.error("--start and --end need a seekable input file.")
+
+        print("Processing stdin... ", end="", flush=True)
+        try:
+            demux_stream(
+                sys.stdin.buffer, args.output, key=args.key, encoding=args.encoding
+            )
+        except ValueError as e:
+            print("ERROR")
+            print(e)
+        else:
+            print("DONE")
+        return
+
+    start_frame, start_time = split_clip_position(args.start)
+    end_frame, end_time = split_clip_position(args.end)
     usmfiles = find_usm(args.input)
 
     for i, usmfile in enumerate(usmfiles):
         filename = os.path.basename(usmfile)
         print(f"Processing {i+1} of {len(usmfiles)}... ", end="", flush=True)
         try:
-            usm = Usm.open(usmfile, encoding=args.encoding, key=args.key)
-
-            usm.demux(
-                path=args.output,
-                save_video=True,
-                save_audio=True,
-                save_pages=args.pages,
-                folder_name=filename,
-            )
+            with Usm.open(
+                usmfile, encoding=args.encoding, key=args.key, recover=args.recover
+            ) as usm:
+                usm.demux(
+                    path=args.output,
+                    save_video=True,
+                    save_audio=True,
+                    save_pages=args.pages,
+                    folder_name=filename,
+                    start_frame=start_frame,
+                    start_time=start_time,
+                    end_frame=end_frame,
+                    end_time=end_time,
+                )
         except ValueError:
             print("ERROR")
             print(f"Please run probe on {usmfile}")
         else:
             print("DONE")
+            for start, end in usm.damaged_ranges:
+                print(f"Skipped damaged bytes {start:#x} to {end:#x} ({end - start} bytes)")
 
 
 def probe_usm():
@@ -183,7 +400,19 @@ def probe_usm():
         default=".",
         help="Path to ffprobe executable or directory. Defaults to CWD.",
     )
+    parser.add_argument(
+        "--full-scan",
+        action="store_true",
+        help="Fully parse every chunk instead of indexing stream chunk headers.",
+    )
+    parser.add_argument(
+        "--probe-cache",
+        type=dir_path,
+        default=None,
+        help="Folder to keep ffprobe results in, so unchanged files aren't probed again.",
+    )
     args = parser.parse_args()
+    probe_cache = ProbeCache(folder=args.probe_cache)
 
     usmfiles = find_usm(args.input)
 
@@ -229,16 +458,19 @@ def probe_usm():
         )
 
         try:
-            usm = Usm.open(usmfile, encoding=args.encoding)
+            usm = Usm.open(
+                usmfile, encoding=args.encoding, header_only=not args.full_scan
+            )
         except ValueError:
             logging.exception("Error occurred in parsing usm file")
             continue
 
         logging.info("Extracting files")
         try:
-            videos, audios = usm.demux(
-                path=temp_dir, save_video=True, save_audio=True, save_pages=False
-            )
+            with usm:
+                videos, audios = usm.demux(
+                    path=temp_dir, save_video=True, save_audio=True, save_pages=False
+                )
         except ValueError:
             logging.exception("Error occurred in demuxing usm file")
             continue
@@ -246,10 +478,10 @@ def probe_usm():
         logging.info("Probing videos")
         try:
             for video in videos:
-                info = ffmpeg.probe(
+                info = probe_cache.probe(
                     video,
                     show_entries="packet=dts,pts_time,pos,flags",
-                    cmd="ffprobe" if ffprobe_path is None else ffprobe_path,
+                    cmd=ffprobe_path,
                 )
                 logging.info(
                     "Video info",
@@ -273,10 +505,10 @@ def probe_usm():
         logging.info("Probing audios")
         try:
             for audio in audios:
-                info = ffmpeg.probe(
+                info = probe_cache.probe(
                     audio,
                     show_entries="packet=dts,pts_time,pos,flags",
-                    cmd="ffprobe" if ffprobe_path is None else ffprobe_path,
+                    cmd=ffprobe_path,
                 )
                 logging.info(
                     "Audio info",
@@ -337,21 +569,224 @@ def encrypt_usm():
         default=None,
         help="Output path. Defaults to the same place as input.",
     )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Encrypt stream payloads inside the input files instead of writing new files.",
+    )
     args = parser.parse_args()
 
-    outdir = dir_or_parent_dir(args.input) if args.output is None else pathlib.Path(args.output)
     usmfiles = find_usm(args.input)
+    if args.in_place:
+        for filepath in usmfiles:
+            crypt_usm_in_place(filepath, OpMode.ENCRYPT, args.key, encoding=args.encoding)
+        return
+
+    outdir = dir_or_parent_dir(args.input) if args.output is None else pathlib.Path(args.output)
 
     for filepath in usmfiles:
         filename = pathlib.PurePath(filepath).name
-        usm = Usm.open(filepath)
-        usm.video_key, usm.audio_key = generate_keys(args.key)
-        with open(outdir.joinpath(filename), "wb") as out:
+        with Usm.open(filepath) as usm, open(outdir.joinpath(filename), "wb") as out:
+            usm.video_key, usm.audio_key = generate_keys(args.key)
             for packet in usm.stream(OpMode.ENCRYPT, encoding=args.encoding):
                 out.write(packet)
 
 
-OP_DICT = {"extractusm": extract_usm, "createusm": create_usm, "probeusm": probe_usm, "encryptusm": encrypt_usm}
+def decrypt_usm():
+    parser = argparse.ArgumentParser("WannaCRI Decrypt USM/s", allow_abbrev=False)
+    parser.add_argument(
+        "operation",
+        metavar="operation",
+        type=str,
+        choices=OP_LIST,
+        help="Specify operation.",
+    )
+    parser.add_argument(
+        "input",
+        metavar="input file path",
+        type=existing_path,
+        help="Path to usm file or directory of usm files.",
+    )
+    parser.add_argument(
+        "key", type=key, help="Decryption key."
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        type=str,
+        default="shift-jis",
+        help="Character encoding used in USM. Defaults to shift-jis.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=dir_path,
+        default="./output",
+        help="Output path. Defaults to a folder named output in CWD.",
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Decrypt stream payloads inside the input files instead of writing new files.",
+    )
+    args = parser.parse_args()
+
+    usmfiles = find_usm(args.input)
+    if args.in_place:
+        for filepath in usmfiles:
+            crypt_usm_in_place(filepath, OpMode.DECRYPT, args.key, encoding=args.encoding)
+        return
+
+    outdir = pathlib.Path(args.output)
+    os.makedirs(outdir, exist_ok=True)
+    for filepath in usmfiles:
+        filename = pathlib.PurePath(filepath).name
+        usm = Usm.open(filepath, key=args.key, encoding=args.encoding)
+        with usm, open(outdir.joinpath(filename), "wb") as out:
+            for packet in usm.stream(OpMode.DECRYPT, encoding=args.encoding):
+                out.write(packet)
+
+
+def rekey_usm():
+    parser = argparse.ArgumentParser("WannaCRI Rekey USM/s", allow_abbrev=False)
+    parser.add_argument(
+        "operation",
+        metavar="operation",
+        type=str,
+        choices=OP_LIST,
+        help="Specify operation.",
+    )
+    parser.add_argument(
+        "input",
+        metavar="input file path",
+        type=existing_path,
+        help="Path to usm file or directory of usm files.",
+    )
+    parser.add_argument("old_key", type=key, help="Key the USM/s are encrypted with.")
+    parser.add_argument("new_key", type=key, help="Key to re-encrypt the USM/s with.")
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        type=str,
+        default="shift-jis",
+        help="Character encoding used in USM. Defaults to shift-jis.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=dir_path,
+        default="./output",
+        help="Output path. Defaults to a folder named output in CWD.",
+    )
+    parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Re-encrypt stream payloads inside the input files instead of writing new files.",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of threads re-encrypting payloads. Defaults to 1.",
+    )
+    args = parser.parse_args()
+
+    usmfiles = find_usm(args.input)
+    if args.in_place:
+        for filepath in usmfiles:
+            rekey_usm_in_place(
+                filepath, args.old_key, args.new_key, encoding=args.encoding, workers=args.workers
+            )
+        return
+
+    outdir = pathlib.Path(args.output)
+    os.makedirs(outdir, exist_ok=True)
+    for filepath in usmfiles:
+        output = outdir.joinpath(pathlib.PurePath(filepath).name)
+        if output.resolve() == pathlib.Path(filepath).resolve():
+            raise ValueError(f"Output {output} is the input file. Use --in-place instead.")
+
+        usm = Usm.open(filepath, encoding=args.encoding)
+        with usm, open(output, "wb") as out:
+            for data in usm.rekey(args.old_key, args.new_key, workers=args.workers):
+                out.write(data)
+
+
+def info_usm():
+    """Prints a summary of a USM or of every USM found in a directory. Only
+    the header section at the front of each file is read."""
+    parser = argparse.ArgumentParser("WannaCRI Info USM", allow_abbrev=False)
+    parser.add_argument(
+        "operation",
+        metavar="operation",
+        type=str,
+        choices=OP_LIST,
+        help="Specify operation.",
+    )
+    parser.add_argument(
+        "input",
+        metavar="input file/folder",
+        type=existing_path,
+        help="Path to USM file or path.",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding",
+        type=str,
+        default="shift-jis",
+        help="Character encoding used in USM. Defaults to shift-jis.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print one JSON object per USM instead of a summary line.",
+    )
+    args = parser.parse_args()
+
+    for usmfile in find_usm(args.input):
+        try:
+            info = Usm.read_info(usmfile, encoding=args.encoding)
+        except ValueError as e:
+            if args.json:
+                print(json.dumps({"path": usmfile, "error": str(e)}, ensure_ascii=False))
+            else:
+                print(f"{usmfile}: ERROR {e}")
+            continue
+
+        if args.json:
+            print(json.dumps({"path": usmfile, **info.to_dict()}, ensure_ascii=False))
+            continue
+
+        streams = []
+        for kind, videos in (("video", info.videos), ("alpha", info.alphas)):
+            for video in videos:
+                keyframes = "?" if video.num_keyframes is None else video.num_keyframes
+                streams.append(
+                    f"{kind} ch{video.channel_number} {video.codec} "
+                    f"{video.width}x{video.height} {video.num_frames} frames "
+                    f"@ {video.framerate:.3f} fps, {keyframes} keyframes, {video.bitrate} bps"
+                )
+
+        for audio in info.audios:
+            streams.append(
+                f"audio ch{audio.channel_number} {audio.codec} "
+                f"{audio.sampling_rate} Hz {audio.num_channels} ch, {audio.bitrate} bps"
+            )
+
+        print(f"{usmfile}: " + "; ".join(streams))
+
+
+OP_DICT = {
+    "extractusm": extract_usm,
+    "createusm": create_usm,
+    "encodeusm": encode_usm,
+    "probeusm": probe_usm,
+    "encryptusm": encrypt_usm,
+    "decryptusm": decrypt_usm,
+    "rekeyusm": rekey_usm,
+    "infousm": info_usm,
+}
 OP_LIST = list(OP_DICT.keys())
 
 
@@ -370,6 +805,19 @@ def main():
     OP_DICT[args.operation]()
 
 
+def open_audio(path: str, channel_number: int = 0):
+    """Opens an ADX or HCA file, recognised from its first bytes."""
+    with open(path, "rb") as f:
+        signature = f.read(4)
+
+    if signature[:2] == b"\x80\x00":
+        return Adx(path, channel_number=channel_number)
+    if bytes(b & 0x7F for b in signature) == b"HCA\x00":
+        return Hca(path, channel_number=channel_number)
+
+    raise ValueError(f"{path} is not an ADX or HCA file.")
+
+
 def find_usm(directory: str) -> List[str]:
     """Walks a path to find USMs."""
     if os.path.isfile(directory):
@@ -394,6 +842,16 @@ def find_usm(directory: str) -> List[str]:
 
 def find_ffprobe(path: str) -> Optional[str]:
     """Find ffprobe.exe in given path."""
+    return find_executable(path, "ffprobe.exe")
+
+
+def find_ffmpeg(path: str) -> Optional[str]:
+    """Find ffmpeg.exe in given path."""
+    return find_executable(path, "ffmpeg.exe")
+
+
+def find_executable(path: str, name: str) -> Optional[str]:
+    """Find a Windows executable by name in given path."""
     if os.name != "nt":
         # Assume that ffmpeg is installed in Unix systems
         return
@@ -404,8 +862,8 @@ def find_ffprobe(path: str) -> Optional[str]:
         cwdfiles = os.listdir(path)
         for cwdfile in cwdfiles:
             filename = os.path.basename(cwdfile)
-            if filename == "ffprobe.exe":
-                return os.path.abspath(os.path.join(path, "ffprobe.exe"))
+            if filename == name:
+                return os.path.abspath(os.path.join(path, name))
 
 
 def key(key_str) -> int:
@@ -418,6 +876,33 @@ def key(key_str) -> int:
     return int(key_str, 16)
 
 
+def clip_position(position: str) -> Union[int, float]:
+    """Parses a frame number as an int, or a time in seconds given as 12.5s
+    or [hh:]mm:ss[.ms] as a float."""
+    try:
+        if position.endswith("s"):
+            return float(position[:-1])
+        if ":" in position:
+            seconds = 0.0
+            for part in position.split(":"):
+                seconds = seconds * 60 + float(part)
+            return seconds
+
+        return int(position)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid frame or time: {position}")
+
+
+def split_clip_position(
+    position: Optional[Union[int, float]]
+) -> Tuple[Optional[int], Optional[float]]:
+    """Splits a parsed clip_position into a frame and a time."""
+    if isinstance(position, float):
+        return None, position
+
+    return position, None
+
+
 def existing_path(path) -> str:
     if os.path.isfile(path):
         return path
@@ -427,6 +912,13 @@ def existing_path(path) -> str:
     raise FileNotFoundError(path)
 
 
+def existing_path_or_stdin(path) -> str:
+    if path == "-":
+        return path
+
+    return existing_path(path)
+
+
 def existing_file(path) -> str:
     if not os.path.exists(path):
         raise FileNotFoundError(path)
@@ -0,0 +1,66 @@
+import os
+import sys
+from typing import List, NamedTuple
+
+import pytest
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "Assets", "Python", "Lib", "site-packages"),
+)
+
+
+class IvfSample(NamedTuple):
+    path: str
+    width: int
+    height: int
+    # Offset of every frame's data, after its frame header
+    offsets: List[int]
+    sizes: List[int]
+    timestamps: List[int]
+    keyframes: List[bool]
+
+
+def filler(size: int) -> bytes:
+    return bytes(i & 0xFF for i in range(size))
+
+
+def vp9_frame(is_keyframe: bool, width: int, height: int, size: int) -> bytes:
+    """A VP9 profile 0 frame with a real uncompressed header and filler data."""
+    if not is_keyframe:
+        # frame_marker, profile 0, show_existing_frame 0, inter frame, show_frame
+        return b"\x86" + filler(size - 1)
+
+    # frame_marker, profile 0, show_existing_frame 0, keyframe, show_frame,
+    # then the sync code and color_config (BT.601, studio range)
+    bits = (0b0001 << 32) | ((width - 1) << 16) | (height - 1)
+    header = b"\x82" + b"\x49\x83\x42" + (bits << 4).to_bytes(5, "big")
+    return header + filler(size - len(header))
+
+
+@pytest.fixture
+def vp9_ivf(tmp_path) -> IvfSample:
+    width, height = 64, 36
+    keyframes = [i % 4 == 0 for i in range(10)]
+    sizes = [0x40 + 0x30 * i for i in range(10)]
+    timestamps = list(range(10))
+
+    path = str(tmp_path / "sample.ivf")
+    offsets = []
+    with open(path, "wb") as ivf:
+        ivf.write(b"DKIF")
+        ivf.write((0).to_bytes(2, "little"))
+        ivf.write((0x20).to_bytes(2, "little"))
+        ivf.write(b"VP90")
+        ivf.write(width.to_bytes(2, "little"))
+        ivf.write(height.to_bytes(2, "little"))
+        ivf.write((30).to_bytes(4, "little"))
+        ivf.write((1).to_bytes(4, "little"))
+        ivf.write(len(sizes).to_bytes(4, "little"))
+        ivf.write(bytes(4))
+        for size, timestamp, is_keyframe in zip(sizes, timestamps, keyframes):
+            ivf.write(size.to_bytes(4, "little") + timestamp.to_bytes(8, "little"))
+            offsets.append(ivf.tell())
+            ivf.write(vp9_frame(is_keyframe, width, height, size))
+
+    return IvfSample(path, width, height, offsets, sizes, timestamps, keyframes)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import io
+
+import pytest
+
+from wannacri.usm.media.annexb import (
+    AccessUnit,
+    SequenceParameterSet,
+    index_access_units,
+    nal_units,
+    parse_sps,
+    scan_nal_units,
+    unescape_rbsp,
+)
+
+
+class BitWriter:
+    def __init__(self) -> None:
+        self.bits = ""
+
+    def write(self, value: int, num_bits: int) -> BitWriter:
+        self.bits += format(value, f"0{num_bits}b") if num_bits > 0 else ""
+        return self
+
+    def write_ue(self, value: int) -> BitWriter:
+        code = format(value + 1, "b")
+        self.bits += "0" * (len(code) - 1) + code
+        return self
+
+    def rbsp(self) -> bytes:
+        # rbsp_stop_one_bit and alignment
+        bits = self.bits + "1"
+        bits += "0" * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+
+def sps(width_in_mbs: int, height_in_mbs: int) -> bytes:
+    writer = (
+        BitWriter()
+        .write(66, 8)  # profile_idc, baseline
+        .write(0, 8)
+        .write(30, 8)  # level_idc
+        .write_ue(0)  # seq_parameter_set_id
+        .write_ue(0)  # log2_max_frame_num_minus4
+        .write_ue(2)  # pic_order_cnt_type
+        .write_ue(1)  # max_num_ref_frames
+        .write(0, 1)
+        .write_ue(width_in_mbs - 1)
+        .write_ue(height_in_mbs - 1)
+        .write(1, 1)  # frame_mbs_only_flag
+        .write(1, 1)  # direct_8x8_inference_flag
+        .write(0, 1)  # frame_cropping_flag
+        .write(0, 1)  # vui_parameters_present_flag
+    )
+    return b"\x67" + writer.rbsp()
+
+
+def slice_nal(is_idr: bool, first_mb: int) -> bytes:
+    header = b"\x65" if is_idr else b"\x41"
+    # first_mb_in_slice, then filler without emulation prevention bytes
+    return header + BitWriter().write_ue(first_mb).rbsp() + bytes(range(1, 0x40))
+
+
+AUD = b"\x09\xf0"
+PPS = b"\x68\xce\x38\x80"
+LONG_START = b"\x00\x00\x00\x01"
+SHORT_START = b"\x00\x00\x01"
+
+
+def sample_stream():
+    """Annex B stream and its access units."""
+    access_units = [
+        # AUD, SPS, PPS and an IDR picture in two slices
+        (True, [AUD, sps(4, 3), PPS, slice_nal(True, 0), slice_nal(True, 6)]),
+        (False, [AUD, slice_nal(False, 0)]),
+        # No AUD, split at the slice starting a new picture
+        (False, [slice_nal(False, 0), slice_nal(False, 5)]),
+        (True, [sps(4, 3), PPS, slice_nal(True, 0)]),
+        (False, [slice_nal(False, 0)]),
+    ]
+
+    data = bytearray()
+    expected = []
+    for is_keyframe, nals in access_units:
+        expected.append(AccessUnit(len(data), is_keyframe))
+        for i, nal in enumerate(nals):
+            data += (LONG_START if i == 0 else SHORT_START) + nal
+
+    return bytes(data), expected
+
+
+def test_index_access_units():
+    data, expected = sample_stream()
+    access_units, parsed_sps = index_access_units(io.BytesIO(data))
+    assert access_units == expected
+    assert parsed_sps == SequenceParameterSet(64, 48, None)
+
+
+def test_leading_bytes_belong_to_first_access_unit():
+    data, expected = sample_stream()
+    access_units, _ = index_access_units(io.BytesIO(b"\x00\x00" + data))
+    assert access_units[0] == AccessUnit(0, True)
+    assert [au.offset - 2 for au in access_units[1:]] == [au.offset for au in expected[1:]]
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 4, 5, 0x10, 0x41])
+def test_scan_across_blocks(block_size):
+    """Start codes straddling blocks are found as in a single read."""
+    data, _ = sample_stream()
+    whole = list(scan_nal_units(io.BytesIO(data), block_size=len(data)))
+    split = list(scan_nal_units(io.BytesIO(data), block_size=block_size))
+    assert split == whole
+
+
+def test_nal_units():
+    data, _ = sample_stream()
+    units = nal_units(data)
+    assert b"".join(nal for _, nal in units) == data
+    assert [nal_type for nal_type, _ in units[:5]] == [9, 7, 8, 5, 5]
+
+
+def test_unescape_rbsp():
+    assert unescape_rbsp(b"\x67\x00\x00\x03\x01\x00\x00\x03") == b"\x67\x00\x00\x01\x00\x00"
+    assert unescape_rbsp(b"\x67\x01") == b"\x67\x01"
+
+
+def test_parse_sps():
+    assert parse_sps(sps(120, 68)) == SequenceParameterSet(1920, 1088, None)
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from wannacri.usm import cipher, generate_keys
+from wannacri.usm.tools import (
+    decrypt_audio_packet,
+    decrypt_video_packet,
+    encrypt_audio_packet,
+    encrypt_video_packet,
+)
+
+# Sizes around the thresholds of the video (0x240) and audio (0x140) ciphers
+# and rows that don't end on a 0x20 byte lane boundary
+SIZES = [0, 0x20, 0x13F, 0x140, 0x141, 0x1FF, 0x23F, 0x240, 0x241, 0x25F, 0x1000, 0x1001, 0x12345]
+
+VIDEO_KEY, AUDIO_KEY = generate_keys(0x1234567890ABCDEF)
+
+
+def packet(size: int) -> bytes:
+    return random.Random(size).randbytes(size)
+
+
+@pytest.fixture(params=list(cipher.BACKENDS))
+def backend(request) -> cipher.CipherBackend:
+    return cipher.BACKENDS[request.param]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_matches_reference(backend, size):
+    data = packet(size)
+    assert backend.encrypt_video(data, VIDEO_KEY) == cipher._encrypt_video_python(
+        data, VIDEO_KEY
+    )
+    assert backend.decrypt_video(data, VIDEO_KEY) == cipher._decrypt_video_python(
+        data, VIDEO_KEY
+    )
+    assert backend.crypt_audio(data, AUDIO_KEY) == cipher._crypt_audio_python(
+        data, AUDIO_KEY
+    )
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_round_trip(backend, size):
+    data = packet(size)
+    assert backend.decrypt_video(backend.encrypt_video(data, VIDEO_KEY), VIDEO_KEY) == data
+    assert backend.crypt_audio(backend.crypt_audio(data, AUDIO_KEY), AUDIO_KEY) == data
+
+
+def test_short_packets_unchanged(backend):
+    assert backend.encrypt_video(packet(0x23F), VIDEO_KEY) == packet(0x23F)
+    assert backend.crypt_audio(packet(0x140), AUDIO_KEY) == packet(0x140)
+
+
+def test_use_backend(backend):
+    previous = cipher.use_backend(backend.name)
+    try:
+        data = packet(0x1001)
+        encrypted = encrypt_video_packet(data, VIDEO_KEY)
+        assert encrypted == cipher._encrypt_video_python(data, VIDEO_KEY)
+        assert decrypt_video_packet(encrypted, VIDEO_KEY) == data
+        assert decrypt_audio_packet(encrypt_audio_packet(data, AUDIO_KEY), AUDIO_KEY) == data
+    finally:
+        cipher.use_backend(previous.name)
+
+
+def test_use_backend_unknown():
+    with pytest.raises(ValueError):
+        cipher.use_backend("nope")
+
+
+def test_tiled_keys_bounded():
+    rng = random.Random(0)
+    for size in [0x1000, 0x40000, cipher._TILED_KEYS_MAX_SIZE + 0x1000] * 4:
+        key = rng.randbytes(0x20)
+        data = bytes(0x140 + size)
+        crypted = cipher._crypt_audio_int(data, key)
+        assert crypted[0x140:] == key * (size // 0x20) + key[: size % 0x20]
+        kept_size = sum(len(tiled) for tiled in cipher._tiled_keys.values())
+        assert kept_size <= cipher._TILED_KEYS_MAX_SIZE
@@ -0,0 +1,120 @@
+import itertools
+import random
+
+import pytest
+
+from wannacri.usm.interleave import interleave, peak_buffer
+
+
+def random_streams(seed: int, num_streams: int = 3):
+    """Times of the packets of streams with different frame rates and jitter."""
+    rng = random.Random(seed)
+    streams = []
+    for _ in range(num_streams):
+        step = rng.choice([1 / 24, 1 / 30, 1 / 60, 0.1])
+        length = rng.randint(0, 60)
+        streams.append(
+            list(itertools.accumulate(rng.uniform(0, 2 * step) for _ in range(length)))
+        )
+
+    return streams
+
+
+def file_times(streams, order):
+    return [streams[stream][index] for stream, index in order]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_strict_order(seed):
+    """With no lead, packets are sorted by time, then stream."""
+    streams = random_streams(seed)
+    expected = sorted(
+        (time, stream, index)
+        for stream, times in enumerate(streams)
+        for index, time in enumerate(times)
+    )
+    assert list(interleave(streams)) == [(stream, index) for _, stream, index in expected]
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("max_lead", [0.05, 0.3, 1.0])
+def test_lead_cap(seed, max_lead):
+    streams = random_streams(seed)
+    order = list(interleave(streams, max_lead))
+
+    # Every packet once, and every stream in its own order
+    assert sorted(order) == [
+        (stream, index) for stream, times in enumerate(streams) for index in range(len(times))
+    ]
+    for stream in range(len(streams)):
+        indexes = [index for s, index in order if s == stream]
+        assert indexes == sorted(indexes)
+
+    # No packet is max_lead or more ahead of a packet after it
+    times = file_times(streams, order)
+    earliest_after = float("inf")
+    for time in reversed(times):
+        assert time - earliest_after < max_lead
+        earliest_after = min(earliest_after, time)
+
+
+def test_lead_saves_switches():
+    streams = [[i / 30 for i in range(30)], [i / 30 + 0.001 for i in range(30)]]
+
+    def switches(order):
+        return sum(a[0] != b[0] for a, b in zip(order, order[1:]))
+
+    assert switches(list(interleave(streams, 0.5))) < switches(list(interleave(streams)))
+
+
+def test_reads_lazily():
+    read = []
+
+    def stream(times):
+        for time in times:
+            read.append(time)
+            yield time
+
+    order = interleave([stream([0.0, 1.0, 2.0]), stream([0.5, 1.5])])
+    assert next(order) == (0, 0)
+    assert read == [0.0, 0.5]
+    assert next(order) == (1, 0)
+    assert read == [0.0, 0.5, 1.0]
+
+
+def reference_peak_buffer(times, sizes):
+    """Chunk i is read once the earliest time of it and every chunk after it
+    has come, and held until its own time has passed."""
+    peak = 0
+    for i in range(len(times)):
+        read_time = min(times[i:])
+        peak = max(peak, sum(sizes[j] for j in range(i + 1) if times[j] >= read_time))
+
+    return peak
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_lead", [0.0, 0.3, 1.0])
+def test_peak_buffer(seed, max_lead):
+    streams = random_streams(seed)
+    rng = random.Random(seed)
+    order = list(interleave(streams, max_lead))
+    times = file_times(streams, order)
+    sizes = [rng.randint(1, 0x10000) for _ in times]
+    assert peak_buffer(times, sizes) == reference_peak_buffer(times, sizes)
+
+
+def test_peak_buffer_grows_with_lead():
+    streams = [[i / 30 for i in range(90)], [i / 10 for i in range(30)]]
+    sizes = {0: 0x1000, 1: 0x100}
+
+    def peak(max_lead):
+        order = list(interleave(streams, max_lead))
+        return peak_buffer(file_times(streams, order), [sizes[s] for s, _ in order])
+
+    assert peak(0.0) <= peak(0.5) <= peak(2.0)
+    assert peak(0.0) < peak(2.0)
+
+
+def test_peak_buffer_empty():
+    assert peak_buffer([], []) == 0
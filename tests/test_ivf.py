@@ -0,0 +1,87 @@
+import io
+import os
+
+import pytest
+
+from wannacri.usm import Vp9
+from wannacri.usm.media.ivf import (
+    index_ivf_frames,
+    read_ivf_header,
+    vp9_frame_size,
+    vp9_is_keyframe,
+)
+
+
+def test_header(vp9_ivf):
+    with open(vp9_ivf.path, "rb") as ivf:
+        header = read_ivf_header(ivf)
+
+    assert header.fourcc == b"VP90"
+    assert (header.width, header.height) == (vp9_ivf.width, vp9_ivf.height)
+    assert (header.timebase_denominator, header.timebase_numerator) == (30, 1)
+    assert header.num_frames == len(vp9_ivf.sizes)
+    assert header.header_size == 0x20
+
+
+def test_index_frames(vp9_ivf):
+    with open(vp9_ivf.path, "rb") as ivf:
+        frames = [frame for frame, _ in index_ivf_frames(ivf, read_ivf_header(ivf))]
+
+    assert [frame.offset for frame in frames] == vp9_ivf.offsets
+    assert [frame.size for frame in frames] == vp9_ivf.sizes
+    assert [frame.timestamp for frame in frames] == vp9_ivf.timestamps
+    assert [frame.is_keyframe for frame in frames] == vp9_ivf.keyframes
+
+
+def test_index_truncated_frame(vp9_ivf):
+    with open(vp9_ivf.path, "rb") as ivf:
+        data = ivf.read()
+
+    # The last frame header is cut short
+    ivf = io.BytesIO(data[: vp9_ivf.offsets[-1] - 4])
+    frames = list(index_ivf_frames(ivf, read_ivf_header(ivf)))
+    assert len(frames) == len(vp9_ivf.sizes) - 1
+
+
+def test_frame_size(vp9_ivf):
+    with open(vp9_ivf.path, "rb") as ivf:
+        frames = list(index_ivf_frames(ivf, read_ivf_header(ivf)))
+
+    assert vp9_frame_size(frames[0][1]) == (vp9_ivf.width, vp9_ivf.height)
+    assert vp9_frame_size(frames[1][1]) is None
+
+
+def test_is_keyframe_invalid():
+    assert not vp9_is_keyframe(b"")
+    # Wrong frame marker
+    assert not vp9_is_keyframe(b"\x02\x49\x83\x42")
+
+
+def test_vp9_packets(vp9_ivf):
+    """Packets start at every frame's data, the first one at the file start."""
+    video = Vp9(vp9_ivf.path)
+    packets = video.packet_table
+    assert list(packets.offsets) == [0, *vp9_ivf.offsets[1:]]
+    ends = [*vp9_ivf.offsets[1:], os.path.getsize(vp9_ivf.path)]
+    assert list(packets.sizes) == [end - offset for offset, end in zip(packets.offsets, ends)]
+    assert list(packets.timestamps) == vp9_ivf.timestamps
+    assert list(packets.keyframes) == [
+        i for i, is_keyframe in enumerate(vp9_ivf.keyframes) if is_keyframe
+    ]
+    assert len(video) == len(vp9_ivf.sizes)
+
+
+def test_vp9_ffprobe_path_deprecated(vp9_ivf):
+    with pytest.warns(DeprecationWarning):
+        Vp9(vp9_ivf.path, ffprobe_path="ffprobe")
+
+
+def test_vp9_not_vp9(vp9_ivf, tmp_path):
+    with open(vp9_ivf.path, "rb") as ivf:
+        data = bytearray(ivf.read())
+
+    data[8:12] = b"AV01"
+    path = tmp_path / "av1.ivf"
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        Vp9(str(path))
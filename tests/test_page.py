@@ -0,0 +1,86 @@
+import pytest
+
+from wannacri.usm import UsmPage, get_pages, pack_pages, packed_pages_size
+from wannacri.usm.types import ElementType
+
+# sample_pages() packed by the original pack_pages
+BASELINE_PAYLOAD = bytes.fromhex(
+    "40555446000001160000004d0000008f0000010a0000000700080016000000033500000019"
+    "010003005a0000002056000000295200000032310000003740380000003d0000c03f5b0000"
+    "00433a000000480000005c000000500000000123456789ffff000000000000000000000063"
+    "00000002468acf12000100000000000000040000006f0000000369d0369b00020000000400"
+    "00000c3c4e554c4c3e004352495553465f4449525f53545245414d00666d74766572006669"
+    "6c656e616d650066696c6573697a650063686e6f0073746d69640061766270730064617461"
+    "00636f6d6d656e74006d6f7669655f302e69766600736861726564006d6f7669655f312e69"
+    "7666006d6f7669655f322e69766600000102030001020304050607"
+)
+
+
+def sample_pages():
+    pages = []
+    for i in range(3):
+        page = UsmPage("CRIUSF_DIR_STREAM")
+        page.update("fmtver", ElementType.UINT, 16777984)
+        page.update("filename", ElementType.STRING, f"movie_{i}.ivf")
+        page.update("filesize", ElementType.LONGLONG, 0x123456789 * (i + 1))
+        page.update("chno", ElementType.SHORT, -1 if i == 0 else i)
+        page.update("stmid", ElementType.UCHAR, 0x40)
+        page.update("avbps", ElementType.FLOAT, 1.5)
+        page.update("data", ElementType.BYTES, bytes(range(i * 4)))
+        page.update("comment", ElementType.STRING, "shared")
+        pages.append(page)
+
+    return pages
+
+
+def contents(pages):
+    """Names and elements of pages. Floats are read back as 1-tuples."""
+    result = []
+    for page in pages:
+        elements = {}
+        for name, element in page.dict.items():
+            value = element.val
+            if isinstance(value, tuple):
+                (value,) = value
+            elif isinstance(value, bytearray):
+                value = bytes(value)
+
+            elements[name] = (value, element.type)
+
+        result.append((page.name, elements))
+
+    return result
+
+
+def test_round_trip():
+    pages = sample_pages()
+    assert contents(get_pages(bytearray(pack_pages(pages, "UTF-8")))) == contents(pages)
+
+
+def test_reads_baseline_payload():
+    assert contents(get_pages(bytearray(BASELINE_PAYLOAD))) == contents(sample_pages())
+
+
+def test_keeps_column_order():
+    (page,) = get_pages(bytearray(pack_pages(sample_pages()[:1], "UTF-8")))
+    assert list(page.dict) == list(sample_pages()[0].dict)
+
+
+def test_strings_stored_once():
+    payload = pack_pages(sample_pages(), "UTF-8")
+    assert payload.count(b"shared\x00") == 1
+    assert payload.count(b"CRIUSF_DIR_STREAM\x00") == 1
+
+
+@pytest.mark.parametrize("num_pages", [0, 1, 3])
+@pytest.mark.parametrize("string_padding", [0, 5])
+def test_packed_pages_size(num_pages, string_padding):
+    pages = sample_pages()[:num_pages]
+    assert packed_pages_size(pages, "UTF-8", string_padding) == len(
+        pack_pages(pages, "UTF-8", string_padding)
+    )
+
+
+def test_invalid_signature():
+    with pytest.raises(ValueError):
+        get_pages(bytearray(b"@UTX" + BASELINE_PAYLOAD[4:]))
@@ -0,0 +1,77 @@
+import pytest
+
+from wannacri.usm import ChunkParser, Usm, Vp9
+from wannacri.usm.chunk import ChunkHeader
+from wannacri.usm.types import ChunkType, PayloadType
+
+
+@pytest.fixture
+def usm_bytes(vp9_ivf) -> bytes:
+    return b"".join(Usm([Vp9(vp9_ivf.path)]).stream())
+
+
+def parse(data: bytes, block_size: int):
+    parser = ChunkParser()
+    events = []
+    for i in range(0, len(data), block_size):
+        events += parser.feed(data[i : i + block_size])
+
+    parser.close()
+    assert parser.offset == len(data)
+    return events
+
+
+def summary(events):
+    return [
+        (
+            event.offset,
+            event.header,
+            [(page.name, page.dict) for page in event.payload]
+            if isinstance(event.payload, list)
+            else bytes(event.payload),
+        )
+        for event in events
+    ]
+
+
+def test_whole_stream(usm_bytes):
+    # Walk the chunk headers directly
+    offsets = []
+    position = 0
+    while position < len(usm_bytes):
+        offsets.append(position)
+        position += ChunkHeader.from_bytes(usm_bytes[position : position + 0x20]).size
+
+    events = parse(usm_bytes, len(usm_bytes))
+    assert [event.offset for event in events] == offsets
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 0x20, 0x21, 0x800, 0x1001])
+def test_split_feeds(usm_bytes, block_size):
+    assert summary(parse(usm_bytes, block_size)) == summary(
+        parse(usm_bytes, len(usm_bytes))
+    )
+
+
+def test_video_payloads(usm_bytes, vp9_ivf):
+    """Video packets cover the whole ivf, from its file header on."""
+    payloads = [
+        event.payload
+        for event in parse(usm_bytes, 0x800)
+        if event.header.chunk_type is ChunkType.VIDEO
+        and event.header.payload_type is PayloadType.STREAM
+    ]
+    with open(vp9_ivf.path, "rb") as ivf:
+        assert b"".join(payloads) == ivf.read()
+
+
+def test_truncated(usm_bytes):
+    parser = ChunkParser()
+    parser.feed(usm_bytes[:-1])
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_invalid_header():
+    with pytest.raises(ValueError):
+        ChunkParser().feed(b"JUNK" + bytes(0x1C))
@@ -0,0 +1,130 @@
+import pickle
+import random
+
+import pytest
+
+from wannacri.usm import PacketTable, SeekTable, UsmPage
+from wannacri.usm.types import ElementType
+
+
+def random_table(seed: int, length: int = 100) -> PacketTable:
+    rng = random.Random(seed)
+    table = PacketTable(rate=30)
+    offset = 0
+    for i in range(length):
+        size = rng.randint(1, 0x1000)
+        table.append(offset, size, i - 2, rng.random() < 0.2)
+        offset += size
+
+    return table
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_packet_table_keyframes(seed):
+    table = random_table(seed)
+    expected = [i for i in range(len(table)) if table.is_keyframe(i)]
+    assert list(table.keyframes) == expected
+
+
+def test_packet_table_keyframes_cache():
+    table = random_table(0, 20)
+    keyframes = table.keyframes
+    assert table.keyframes is keyframes
+
+    table.set_keyframes([1, 3, 100])
+    assert table.keyframes is not keyframes
+    assert {1, 3} <= set(table.keyframes)
+    assert table.is_keyframe(1) and table.is_keyframe(3)
+
+    keyframes = table.keyframes
+    table.append(0, 0, 0, is_keyframe=False)
+    assert table.keyframes is keyframes
+    table.append(0, 0, 0, is_keyframe=True)
+    assert list(table.keyframes) == [*keyframes, len(table) - 1]
+
+
+def test_packet_table_rows():
+    table = random_table(1, 10)
+    rows = list(table)
+    assert rows == list(zip(table.offsets, table.sizes))
+    assert [table[i] for i in range(len(table))] == rows
+    assert list(table.timestamps) == list(range(-2, 8))
+    with pytest.raises(IndexError):
+        table.is_keyframe(len(table))
+
+
+def test_packet_table_fill_sizes():
+    table = PacketTable()
+    for offset in [0, 0x10, 0x45, 0x100]:
+        table.append(offset, 0)
+
+    table.fill_sizes(0x180)
+    assert list(table.sizes) == [0x10, 0x35, 0xBB, 0x80]
+
+
+def test_packet_table_pickle():
+    table = random_table(2)
+    copy = pickle.loads(pickle.dumps(table))
+    assert list(copy) == list(table)
+    assert list(copy.keyframes) == list(table.keyframes)
+    assert copy.rate == table.rate
+
+
+def seek_table() -> SeekTable:
+    table = SeekTable()
+    for frame, offset in [(0, 0x800), (30, 0x12000), (60, 0x24800)]:
+        table.append(frame, offset)
+
+    return table
+
+
+def test_seek_table_pages_round_trip():
+    table = seek_table()
+    pages = table.to_pages()
+    assert [page.name for page in pages] == ["VIDEO_SEEKINFO"] * 3
+    assert pages[1]["ofs_frmid"].val == 30
+    assert pages[1]["ofs_byte"] == (0x12000, ElementType.LONGLONG)
+
+    result = SeekTable.from_pages(pages)
+    assert list(result) == list(table)
+    assert result.element_types == table.element_types
+
+
+def test_seek_table_keeps_element_types():
+    page = UsmPage("VIDEO_SEEKINFO")
+    page.update("ofs_frmid", ElementType.INT, 5)
+    page.update("ofs_byte", ElementType.ULONGLONG, 0x800)
+    page.update("num_skip", ElementType.SHORT, 0)
+    page.update("resv", ElementType.SHORT, 0)
+
+    table = SeekTable.from_pages([page])
+    (result,) = table.to_pages()
+    assert list(result.dict) == list(page.dict)
+    assert result.dict == page.dict
+
+
+def test_seek_table_from_pages_invalid():
+    assert len(SeekTable.from_pages(None)) == 0
+    with pytest.raises(ValueError):
+        SeekTable.from_pages([UsmPage("CRIUSF_DIR_STREAM")])
+
+    page = UsmPage("VIDEO_SEEKINFO")
+    page.update("ofs_frmid", ElementType.INT, 5)
+    with pytest.raises(ValueError):
+        SeekTable.from_pages([page])
+
+
+def test_seek_table_lookup():
+    table = seek_table()
+    assert 30 in table
+    assert 31 not in table
+    table.append(90, 0x30000)
+    assert 90 in table
+    assert list(table.frames) == [0, 30, 60, 90]
+
+
+def test_seek_table_shifted():
+    table = seek_table()
+    shifted = table.shifted(0x100)
+    assert list(shifted) == [(frame, offset + 0x100) for frame, offset in table]
+    assert list(table.ofs_byte) == [0x800, 0x12000, 0x24800]